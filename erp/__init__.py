@@ -5,4 +5,5 @@ from .utils import DEFAULT_ER_CONFIGURATION, DATABASES_LOCATIONS, DATABSE_COLUMN
 from .main import *
 from .matching import matching, blocking
 from .clustering import clustering
+from .incremental import IncrementalER
 import logging
@@ -0,0 +1,644 @@
+import logging
+import os
+from multiprocessing import get_context
+from time import time
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from erp import dperp
+from erp.clustering import clustering
+from erp.evaluation import PAPER_ID_COLUMNS, confusion_matrix, pair_keys
+from erp.features import FeatureStore
+from erp.instrumentation import peak_rss
+from erp.matching import (
+    DEFAULT_MEMORY_BUDGET,
+    CandidatePairs,
+    blocking,
+    matching,
+    parallel_matching,
+)
+from erp.perturbation import add_typos, decode_column, join_tokens
+from erp.utils import (
+    DATA_FOLDER,
+    DATABSE_COLUMNS,
+    DEFAULT_ER_CONFIGURATION,
+    FILENAME_BENCHMARK_RESULTS,
+    RESULTS_FOLDER,
+    read_database,
+    save_database_cache,
+    save_result,
+    test_and_create_folder,
+)
+
+# Total number of records of both databases
+SCALE_FACTORS = [10000, 100000, 1000000, 10000000]
+# Scale factors running in minutes on a laptop
+SMALL_SCALE_FACTORS = [10000, 100000]
+BACKENDS = ["local", "parallel", "dp"]
+BENCHMARK_FOLDER = DATA_FOLDER + "benchmark/"
+VENUES = ["vldb", "sigmod record", "sigmod conference", "vldb j"]
+YEARS = (1995, 2004)
+TITLE_VOCABULARY_SIZE = 50000
+NUM_FIRST_NAMES = 5000
+NUM_LAST_NAMES = 20000
+# Records generated at once, bounds the memory of the string buffers
+GENERATION_CHUNK_SIZE = 1 << 20
+# A run with more candidate pairs than this fails without matching them, the
+# default blocking gives about 1e12 pairs at 10M records
+MAX_CANDIDATE_PAIRS = 10**9
+# Seconds before an isolated run is killed and recorded as failed
+RUN_TIMEOUT = 3600
+# "basic" clustering builds a dense matrix of all the records, which measures
+# the clustering instead of the pipeline and runs out of memory at 100k records
+BENCHMARK_ER_CONFIGURATION = {
+    **DEFAULT_ER_CONFIGURATION,
+    "clustering_method": "unionFind",
+}
+
+
+def run_benchmark(
+    scale_factors=SCALE_FACTORS,
+    backends=BACKENDS,
+    ERconfiguration=BENCHMARK_ER_CONFIGURATION,
+    duplicate_rate=0.5,
+    noise=1,
+    seed=0,
+    output=FILENAME_BENCHMARK_RESULTS,
+    isolate=True,
+    max_candidate_pairs=MAX_CANDIDATE_PAIRS,
+    timeout=RUN_TIMEOUT,
+):
+    """benchmark every pipeline stage on synthetic databases of growing size
+
+    Every backend runs load, block, match, cluster and evaluate on the same
+    synthetic databases, and the wall time, pairs per second and peak RSS of
+    every stage are written to output after each run, so the results of the
+    smaller scale factors are kept if a larger one runs out of memory. The
+    stages a failed run finished are kept along with its error. A backend
+    failing at a scale factor, out of memory, with too many candidate pairs or
+    out of time, is skipped at the larger ones.
+
+    Args:
+        scale_factors (list, optional): total numbers of records of both
+        databases. Defaults to SCALE_FACTORS.
+        backends (list, optional): {"local", "parallel", "dp"}. Defaults to BACKENDS.
+        ERconfiguration (dict, optional): ER pipeline Configuration. Defaults to
+        BENCHMARK_ER_CONFIGURATION.
+        duplicate_rate (float, optional): part of database2 duplicating a record
+        of database1. Defaults to 0.5.
+        noise (int, optional): random characters replaced in the title and the
+        author names of a duplicate. Defaults to 1.
+        seed (int, optional): seed of the synthetic databases. Defaults to 0.
+        output (str, optional): results CSV filename. Defaults to FILENAME_BENCHMARK_RESULTS.
+        isolate (bool, optional): run every backend and scale factor in a new
+        process, so its peak RSS is its own. Defaults to True.
+        max_candidate_pairs (int, optional): local and parallel runs with more
+        candidate pairs fail before matching, None for no limit. Defaults to
+        MAX_CANDIDATE_PAIRS.
+        timeout (float, optional): seconds before an isolated run is killed,
+        None for no limit. Defaults to RUN_TIMEOUT.
+
+    Returns:
+        DataFrame: one row per scale factor, backend and stage
+    """
+    results = []
+    failed = {}
+    for num_records in sorted(scale_factors):
+        filenames = create_synthetic_databases(num_records, duplicate_rate, noise, seed)
+        for backend in backends:
+            run = {
+                "scale factor": num_records,
+                "backend": backend,
+                "blocking method": ERconfiguration["blocking_method"],
+                "matching method": ERconfiguration["matching_method"],
+                "threshold": ERconfiguration["threshold"],
+                "duplicate rate": duplicate_rate,
+                "noise": noise,
+            }
+            if backend in failed:
+                results.append(
+                    {**run, "error": f"skipped, failed with {failed[backend]} records"}
+                )
+                continue
+            logging.info(f"benchmark of the {backend} backend on {num_records} records")
+            args = (backend, filenames, ERconfiguration, max_candidate_pairs)
+            # Filled as the stages finish, so a failed run keeps its stages
+            stages = []
+            try:
+                if isolate:
+                    run_isolated(benchmark_backend, args, timeout, stages.append)
+                else:
+                    benchmark_backend(*args, report=stages.append)
+                results += [{**run, **stage} for stage in stages]
+            except Exception as e:
+                # Includes a run killed by the system when out of memory or
+                # by the timeout
+                logging.error(f"{backend} failed on {num_records} records: {e!r}")
+                failed[backend] = num_records
+                results += [{**run, **stage} for stage in stages]
+                results.append({**run, "error": repr(e)})
+            save_result(fill_candidate_pairs(pd.DataFrame(results)), output)
+    logging.info(f"benchmark results are stored in {RESULTS_FOLDER + output}")
+    return fill_candidate_pairs(pd.DataFrame(results))
+
+
+def benchmark_backend(
+    backend,
+    filenames,
+    ERconfiguration=BENCHMARK_ER_CONFIGURATION,
+    max_candidate_pairs=MAX_CANDIDATE_PAIRS,
+    report=None,
+):
+    """run every stage of a backend on synthetic databases
+
+    Args:
+        backend (str): {"local", "parallel", "dp"}
+        filenames (tuple): database1, database2 and truth filenames of
+        create_synthetic_databases
+        max_candidate_pairs (int, optional): local and parallel runs with more
+        candidate pairs raise a RuntimeError before matching. Defaults to
+        MAX_CANDIDATE_PAIRS.
+        report (callable, optional): called with every stage as it finishes.
+        Defaults to None.
+
+    Returns:
+        list: one dict per stage
+    """
+    stages = []
+
+    def add_stage(stage):
+        stages.append(stage)
+        if report is not None:
+            report(stage)
+
+    if backend == "dp":
+        benchmark_dp(filenames, ERconfiguration, add_stage)
+    else:
+        benchmark_local(
+            filenames,
+            ERconfiguration,
+            add_stage,
+            backend == "parallel",
+            max_candidate_pairs,
+        )
+    return stages
+
+
+def create_synthetic_databases(num_records, duplicate_rate=0.5, noise=1, seed=0):
+    """synthetic databases of a scale factor, generated once and reused
+
+    Returns:
+        (str, str, str): database1, database2 and truth filenames
+    """
+    filenames = tuple(
+        synthetic_filename(num_records, duplicate_rate, noise, seed, name)
+        for name in ["df1", "df2", "truth"]
+    )
+    if all(os.path.exists(filename) for filename in filenames):
+        return filenames
+    logging.info(f"generating synthetic databases of {num_records} records")
+    start_time = time()
+    df1, df2, truth_df = synthetic_databases(num_records, duplicate_rate, noise, seed)
+    test_and_create_folder(BENCHMARK_FOLDER)
+    for df, filename in zip([df1, df2], filenames):
+        df.to_csv(filename, index=False)
+        # Written after the CSV file so that read_database finds it up to date
+        save_database_cache(filename, df)
+    truth_df.to_csv(filenames[2], index=False)
+    logging.info(f"generated in {time() - start_time:.1f}s")
+    return filenames
+
+
+def synthetic_databases(num_records, duplicate_rate=0.5, noise=1, seed=0):
+    """two synthetic citation databases with known duplicates
+
+    Title words and authors are drawn with Zipf-like frequencies. A part of
+    database2 duplicates records of database1, with `noise` random characters
+    replaced in their title and author names as add_random_characters_to_string
+    does, the other records are new.
+
+    Args:
+        num_records (int): total number of records of both databases
+        duplicate_rate (float, optional): part of database2 duplicating a record
+        of database1. Defaults to 0.5.
+        noise (int, optional): random characters replaced in the title and the
+        author names of a duplicate. Defaults to 1.
+        seed (int, optional): Defaults to 0.
+
+    Returns:
+        (DataFrame, DataFrame, DataFrame): database1, database2 and the paper
+        IDs of the duplicates
+    """
+    rng = np.random.default_rng(seed)
+    num_df1 = num_records // 2
+    num_df2 = num_records - num_df1
+    num_duplicates = int(round(duplicate_rate * min(num_df1, num_df2)))
+    num_new = num_df1 + num_df2 - num_duplicates
+
+    # Vocabularies as character buffers, token i is data[starts[i]:ends[i]]
+    words = random_words(rng, TITLE_VOCABULARY_SIZE)
+    first_names = random_words(rng, NUM_FIRST_NAMES)
+    last_names = random_words(rng, NUM_LAST_NAMES)
+    num_people = max(num_records // 3, 1)
+    names = np.stack(
+        [
+            rng.integers(0, NUM_FIRST_NAMES, num_people),
+            rng.integers(0, NUM_LAST_NAMES, num_people) + NUM_FIRST_NAMES,
+        ],
+        axis=1,
+    ).ravel()
+    people = join_tokens(
+        *concatenate_tokens(first_names, last_names),
+        names,
+        np.full(num_people, 2),
+        b" ",
+    )[:3]
+
+    # Records of database1 followed by the new records of database2
+    title_counts = np.clip(rng.poisson(7, num_new) + 1, 1, 30)
+    title_tokens = zipf_choice(rng, TITLE_VOCABULARY_SIZE, title_counts.sum())
+    author_counts = np.clip(rng.poisson(1.9, num_new) + 1, 1, 20)
+    author_tokens = zipf_choice(rng, num_people, author_counts.sum(), exponent=0.8)
+    years = rng.integers(YEARS[0], YEARS[1] + 1, num_new)
+    venues = rng.integers(0, len(VENUES), num_new)
+
+    # database2 takes its duplicates from database1, in a random order
+    duplicates = rng.choice(num_df1, num_duplicates, replace=False)
+    rows_df2 = rng.permutation(
+        np.concatenate([duplicates, np.arange(num_df1, num_new)])
+    )
+    typos_df2 = np.where(rows_df2 < num_df1, noise, 0)
+
+    dfs = []
+    for database, rows, typos in [
+        ("df1", np.arange(num_df1), np.zeros(num_df1, dtype=np.int64)),
+        ("df2", rows_df2, typos_df2),
+    ]:
+        tokens, counts = take_rows(title_tokens, title_counts, rows)
+        titles = decode_rows(rng, words, tokens, counts, b" ", typos)
+        tokens, counts = take_rows(author_tokens, author_counts, rows)
+        authors = decode_rows(rng, people, tokens, counts, b", ", typos)
+        dfs.append(
+            pd.DataFrame(
+                {
+                    DATABSE_COLUMNS[0]: np.char.add(
+                        database + "-", np.arange(len(rows)).astype(str)
+                    ).astype(object),
+                    DATABSE_COLUMNS[1]: titles,
+                    DATABSE_COLUMNS[2]: authors,
+                    DATABSE_COLUMNS[3]: np.array(VENUES, dtype=object)[venues[rows]],
+                    DATABSE_COLUMNS[4]: years[rows],
+                }
+            )
+        )
+    df1, df2 = dfs
+    is_duplicate = rows_df2 < num_df1
+    truth_df = pd.DataFrame(
+        {
+            PAPER_ID_COLUMNS[0]: df1[DATABSE_COLUMNS[0]].to_numpy()[
+                rows_df2[is_duplicate]
+            ],
+            PAPER_ID_COLUMNS[1]: df2[DATABSE_COLUMNS[0]].to_numpy()[is_duplicate],
+        }
+    )
+    return df1, df2, truth_df
+
+
+def plot_benchmark(results, filename="benchmark.png"):
+    """wall time and peak RSS of every backend against the scale factor"""
+    results = results.dropna(subset=["seconds"])
+    fig, (ax_time, ax_memory) = plt.subplots(1, 2, figsize=(10, 4), dpi=100)
+    for backend, runs in results.groupby("backend"):
+        runs = runs.groupby("scale factor").agg(
+            {"seconds": "sum", "peak rss (MB)": "max"}
+        )
+        ax_time.plot(runs.index, runs["seconds"], marker="o", label=backend)
+        ax_memory.plot(runs.index, runs["peak rss (MB)"], marker="o", label=backend)
+    for ax, ylabel in [(ax_time, "execution time(s)"), (ax_memory, "peak RSS(MB)")]:
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("number of records")
+        ax.set_ylabel(ylabel)
+        ax.legend(loc="upper left")
+    fig.suptitle("Benchmark on Synthetic Databases")
+    test_and_create_folder(RESULTS_FOLDER)
+    fig.savefig(RESULTS_FOLDER + filename)
+
+
+# ==================================================================================
+# ==============Functions basically never called externally=========================
+# ==================================================================================
+
+
+def run_isolated(function, args, timeout=None, report=None):
+    """function(*args, report=...) in a new process, killed after timeout seconds
+
+    Args:
+        function (callable): reports values with its report keyword argument
+        args (tuple):
+        timeout (float, optional): seconds. Defaults to None, no limit.
+        report (callable, optional): called in this process with every value
+        reported by the function, also when it fails later. Defaults to None.
+
+    Raises:
+        TimeoutError: the process did not finish in time
+        RuntimeError: the process died, e.g. killed when out of memory
+        Exception: the exception raised by the function
+    """
+    context = get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=send_result, args=(sender, function, args))
+    process.start()
+    sender.close()
+    deadline = None if timeout is None else time() + timeout
+    try:
+        while True:
+            remaining = None if deadline is None else max(deadline - time(), 0)
+            if not receiver.poll(remaining):
+                raise TimeoutError(f"killed after {timeout}s")
+            try:
+                kind, value = receiver.recv()
+            except EOFError:
+                process.join()
+                raise RuntimeError(f"process exited with code {process.exitcode}")
+            if kind == "error":
+                raise value
+            if kind == "result":
+                return value
+            if report is not None:
+                report(value)
+    finally:
+        process.terminate()
+        process.join()
+        receiver.close()
+
+
+def send_result(connection, function, args):
+    # Runs in the process of run_isolated, every message is a (kind, value)
+    def report(value):
+        connection.send(("report", value))
+
+    try:
+        message = ("result", function(*args, report=report))
+    except Exception as e:
+        message = ("error", e)
+    try:
+        connection.send(message)
+    except Exception:
+        # An exception that cannot be pickled is sent as text
+        connection.send(("error", RuntimeError(repr(message[1]))))
+    connection.close()
+
+
+def check_candidate_pairs(df1, df2, blocking_method, features, max_candidate_pairs):
+    # Counted from the block sizes, without generating the pairs
+    if max_candidate_pairs is None:
+        return
+    num_pairs = CandidatePairs(df1, df2, blocking_method, features).max_num_pairs()
+    if num_pairs > max_candidate_pairs:
+        raise RuntimeError(
+            f"{num_pairs} candidate pairs of {blocking_method} blocking, "
+            f"more than {max_candidate_pairs}"
+        )
+
+
+def benchmark_local(
+    filenames, ERconfiguration, add_stage, parallel=False, max_candidate_pairs=None
+):
+    backend = "parallel" if parallel else "local"
+    blocking_method = ERconfiguration["blocking_method"]
+    matching_method = ERconfiguration["matching_method"]
+    threshold = ERconfiguration["threshold"]
+    memory_budget = ERconfiguration.get("memory_budget", DEFAULT_MEMORY_BUDGET)
+
+    start_time = time()
+    df1 = read_database(filenames[0])
+    df2 = read_database(filenames[1])
+    df1["index"] = np.arange(len(df1))
+    df2["index"] = np.arange(len(df2)) + len(df1)
+    features = (FeatureStore(df1).extract(), FeatureStore(df2).extract())
+    num_records = len(df1) + len(df2)
+    add_stage(stage_result("load", start_time, num_records))
+    check_candidate_pairs(df1, df2, blocking_method, features, max_candidate_pairs)
+
+    if parallel:
+        # Blocks are blocked and matched together in the workers
+        start_time = time()
+        result_df = parallel_matching(
+            df1,
+            df2,
+            blocking_method,
+            threshold,
+            matching_method,
+            outputfile=f"benchmark_matched_{backend}.csv",
+            features=features,
+            num_workers=ERconfiguration.get("num_workers"),
+            memory_budget=memory_budget,
+        )
+        add_stage(stage_result("match", start_time, num_records))
+    elif memory_budget is not None:
+        # The candidate pairs are generated while they are matched, so
+        # blocking is only timed with matching
+        start_time = time()
+        candidate_pairs = blocking(df1, df2, blocking_method, features, memory_budget)
+        result_df = matching(
+            candidate_pairs,
+            threshold,
+            matching_method,
+            outputfile=f"benchmark_matched_{backend}.csv",
+            features=features,
+        )
+        add_stage(
+            stage_result("block+match", start_time, num_records, len(candidate_pairs))
+        )
+    else:
+        start_time = time()
+        result_df = blocking(df1, df2, blocking_method, features)
+        num_candidates = len(result_df)
+        add_stage(stage_result("block", start_time, num_records, num_candidates))
+        start_time = time()
+        result_df = matching(
+            result_df,
+            threshold,
+            matching_method,
+            outputfile=f"benchmark_matched_{backend}.csv",
+            features=features,
+        )
+        add_stage(stage_result("match", start_time, num_records, num_candidates))
+
+    start_time = time()
+    clustering(
+        result_df,
+        df1,
+        df2,
+        ERconfiguration["clustering_method"],
+        filename=f"benchmark_clustering_{backend}.csv",
+    )
+    add_stage(stage_result("cluster", start_time, num_records, len(result_df)))
+
+    truth_df = pd.read_csv(filenames[2])
+    start_time = time()
+    add_stage(evaluate(start_time, num_records, truth_df, result_df))
+
+
+def benchmark_dp(filenames, ERconfiguration, add_stage):
+    # The Spark session is started before the timed stages
+    spark = dperp.get_spark_session(ERconfiguration)
+
+    start_time = time()
+    df1, df2 = dperp.read_databases(spark, filenames[0], filenames[1])
+    sizes = [df1.count(), df2.count()]
+    num_records = sum(sizes)
+    add_stage(stage_result("load", start_time, num_records))
+
+    # Spark is lazy: blocking is timed by counting the candidate pairs, and
+    # runs again in the match stage
+    start_time = time()
+    pairs = dperp.blocking(
+        df1,
+        df2,
+        ERconfiguration["blocking_method"],
+        **dperp.join_strategy(df1, df2, sizes, ERconfiguration),
+    )
+    num_candidates = pairs.count()
+    add_stage(stage_result("block", start_time, num_records, num_candidates))
+
+    start_time = time()
+    matched_pairs = dperp.matching(
+        pairs, ERconfiguration["threshold"], output="benchmark_matched_dp.csv"
+    )
+    num_matched_pairs = matched_pairs.count()
+    add_stage(stage_result("match", start_time, num_records, num_candidates))
+
+    start_time = time()
+    dperp.clustering(
+        df1,
+        df2,
+        matched_pairs,
+        filename="benchmark_clustering_dp.csv",
+        clustering_method=ERconfiguration.get("dp_clustering_method", "largeSmallStar"),
+        local_threshold=ERconfiguration.get(
+            "local_clustering_threshold", dperp.LOCAL_CLUSTERING_MAX_EDGES
+        ),
+    )
+    add_stage(stage_result("cluster", start_time, num_records, num_matched_pairs))
+
+    truth_df = pd.read_csv(filenames[2])
+    start_time = time()
+    result_df = matched_pairs.select(*PAPER_ID_COLUMNS).toPandas()
+    add_stage(evaluate(start_time, num_records, truth_df, result_df))
+    matched_pairs.unpersist()
+
+
+def evaluate(start_time, num_records, truth_df, result_df):
+    keys_truth, keys_matched = pair_keys(truth_df, result_df, columns=PAPER_ID_COLUMNS)
+    tp, fn, fp, precision, recall, f1 = confusion_matrix(keys_truth, keys_matched)
+    return {
+        **stage_result("evaluate", start_time, num_records, len(result_df)),
+        "precision": precision,
+        "recall": recall,
+        "f1 score": f1,
+    }
+
+
+def stage_result(stage, start_time, num_records, num_pairs=None):
+    seconds = time() - start_time
+    # Not measured without the resource module, e.g. on Windows
+    peak_rss_mb = peak_rss()
+    if peak_rss_mb is not None:
+        peak_rss_mb = round(peak_rss_mb / (1 << 20), 1)
+    logging.info(f"{stage}: {seconds:.2f}s, {num_pairs} pairs, {peak_rss_mb}MB")
+    return {
+        "stage": stage,
+        "records": num_records,
+        "pairs": num_pairs,
+        "seconds": seconds,
+        "pairs per second": (
+            num_pairs / seconds if (num_pairs is not None) and seconds > 0 else None
+        ),
+        "peak rss (MB)": peak_rss_mb,
+    }
+
+
+def fill_candidate_pairs(results):
+    # The parallel backend does not count its candidate pairs, which are the
+    # candidate pairs of the other backends at the same scale factor
+    if "stage" not in results:
+        return results
+    candidates = (
+        results[results["stage"].isin(["block", "block+match"])]
+        .groupby("scale factor")["pairs"]
+        .first()
+    )
+    missing = (results["stage"] == "match") & results["pairs"].isna()
+    results.loc[missing, "pairs"] = results.loc[missing, "scale factor"].map(candidates)
+    results.loc[missing, "pairs per second"] = (
+        results.loc[missing, "pairs"] / results.loc[missing, "seconds"]
+    )
+    return results
+
+
+def synthetic_filename(num_records, duplicate_rate, noise, seed, name):
+    return (
+        f"{BENCHMARK_FOLDER}synthetic_{num_records}_{duplicate_rate}_{noise}_{seed}"
+        f"_{name}.csv"
+    )
+
+
+def random_words(rng, num_words, min_length=2, max_length=10):
+    """random lowercase words as a character buffer
+
+    Returns:
+        (ndarray, ndarray, ndarray): uint8 characters, starts and ends of the words
+    """
+    lengths = rng.integers(min_length, max_length + 1, num_words)
+    ends = np.cumsum(lengths)
+    data = rng.integers(ord("a"), ord("z") + 1, ends[-1], dtype=np.uint8)
+    return data, ends - lengths, ends
+
+
+def concatenate_tokens(*vocabularies):
+    # One vocabulary of the tokens of several vocabularies, one after the other
+    data = np.concatenate([vocabulary[0] for vocabulary in vocabularies])
+    offsets = np.cumsum([0] + [len(vocabulary[0]) for vocabulary in vocabularies])
+    starts = np.concatenate(
+        [vocabulary[1] + offset for vocabulary, offset in zip(vocabularies, offsets)]
+    )
+    ends = np.concatenate(
+        [vocabulary[2] + offset for vocabulary, offset in zip(vocabularies, offsets)]
+    )
+    return data, starts, ends
+
+
+def zipf_choice(rng, num_tokens, size, exponent=1.0):
+    # Token i is drawn with a probability proportional to 1 / (i + 1) ** exponent
+    cumulative = np.cumsum(1 / np.arange(1, num_tokens + 1) ** exponent)
+    tokens = np.searchsorted(cumulative, rng.random(size) * cumulative[-1])
+    return np.minimum(tokens, num_tokens - 1)
+
+
+def take_rows(tokens, counts, rows):
+    # Tokens of the given rows of a token list per row stored as CSR arrays
+    starts = np.cumsum(counts) - counts
+    row_counts = counts[rows]
+    within = np.arange(row_counts.sum()) - np.repeat(
+        np.cumsum(row_counts) - row_counts, row_counts
+    )
+    return tokens[np.repeat(starts[rows], row_counts) + within], row_counts
+
+
+def decode_rows(rng, vocabulary, tokens, counts, separator, typos):
+    """strings of the rows of tokens of a vocabulary, with typos, by chunks of rows"""
+    strings = np.empty(len(counts), dtype=object)
+    token_ends = np.cumsum(counts)
+    for begin in range(0, len(counts), GENERATION_CHUNK_SIZE):
+        end = min(begin + GENERATION_CHUNK_SIZE, len(counts))
+        token_begin = token_ends[begin - 1] if begin > 0 else 0
+        column = join_tokens(
+            *vocabulary[:3],
+            tokens[token_begin : token_ends[end - 1]],
+            counts[begin:end],
+            separator,
+        )
+        strings[begin:end] = decode_column(add_typos(column, typos[begin:end], rng))
+    return strings
@@ -3,7 +3,7 @@ import pandas as pd
 import numpy as np
 from erp.utils import DATABSE_COLUMNS, FILENAME_LOCAL_CLUSTERING, save_result
 
-CLUSTERING_METHODS = ["basic"]
+CLUSTERING_METHODS = ["basic", "unionFind"]
 
 def clustering(
     result_df, df1, df2, clustering_method="basic", filename=FILENAME_LOCAL_CLUSTERING
@@ -21,6 +21,8 @@ def clustering(
     df2["index"] = np.arange(len(df2)) + len(df1)
     if clustering_method == "basic":
         combined_df = clustering_basic(result_df, df1, df2)
+    elif clustering_method == "unionFind":
+        combined_df = clustering_union_find(result_df, df1, df2)
     save_result(combined_df[DATABSE_COLUMNS + ["index"]], filename)
     logging.info(
         "%.2f entities are deleted in clustering." % (1 - len(combined_df) / (len(df1) + len(df2)))
@@ -138,3 +140,75 @@ def clustering_basic(result_df, df1, df2):
         [df1[df1.index.isin(idx_list)], df2[df2.index.isin(idx_list)]]
     )
     return combined_df
+
+
+class DisjointSet:
+    """Union-find over the nodes 0..num_nodes-1 with path compression and union
+    by rank, remembering the largest node of every set."""
+
+    def __init__(self, num_nodes):
+        # Plain lists, element access is much cheaper than on numpy arrays
+        self.parent = list(range(num_nodes))
+        self.rank = [0] * num_nodes
+        self.maximum = list(range(num_nodes))
+
+    def add(self, num_nodes):
+        """add num_nodes singleton sets after the existing nodes"""
+        new_nodes = range(len(self.parent), len(self.parent) + num_nodes)
+        self.parent.extend(new_nodes)
+        self.rank.extend([0] * num_nodes)
+        self.maximum.extend(new_nodes)
+
+    def find(self, node):
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    def union(self, node1, node2):
+        root1, root2 = self.find(node1), self.find(node2)
+        if root1 == root2:
+            return root1
+        # Union by rank
+        if self.rank[root1] < self.rank[root2]:
+            root1, root2 = root2, root1
+        elif self.rank[root1] == self.rank[root2]:
+            self.rank[root1] += 1
+        self.parent[root2] = root1
+        self.maximum[root1] = max(self.maximum[root1], self.maximum[root2])
+        return root1
+
+    def representatives(self):
+        """largest node of the set of every node"""
+        parent = np.array(self.parent, dtype=np.int64)
+        roots = parent
+        while True:
+            parents = parent[roots]
+            if np.array_equal(parents, roots):
+                return np.array(self.maximum, dtype=np.int64)[roots]
+            roots = parents
+
+
+def clustering_union_find(result_df, df1, df2):
+    # Clustering on the connected components of the matched pairs, the entity
+    # with the largest index represents its component. The representatives are
+    # selected by the "index" column, the numbering of both databases set by
+    # clustering, while clustering_basic selects them by the DataFrame index,
+    # which only follows that numbering for database1 with a default RangeIndex
+    num_nodes = len(df1) + len(df2)
+    disjoint_set = DisjointSet(num_nodes)
+    for idx1, idx2 in zip(
+        result_df["index_df1"].to_numpy(dtype=np.int64).tolist(),
+        result_df["index_df2"].to_numpy(dtype=np.int64).tolist(),
+    ):
+        disjoint_set.union(idx1, idx2)
+
+    # Extract data from the original database
+    idx_list = np.unique(disjoint_set.representatives())
+    combined_df = pd.concat(
+        [df1[df1["index"].isin(idx_list)], df2[df2["index"].isin(idx_list)]]
+    )
+    return combined_df
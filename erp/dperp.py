@@ -1,35 +1,129 @@
+import atexit
+import io
 import logging
-from time import time
+from contextlib import redirect_stdout
+from math import ceil
 import numpy as np
-from pyspark import SparkConf, SparkContext
+from pyspark import SparkConf
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import (
-    udf,
+    array,
+    array_distinct,
+    array_intersect,
+    array_remove,
+    array_union,
+    broadcast,
+    coalesce,
+    count,
+    element_at,
+    explode,
+    filter as array_filter,
+    greatest,
     hash,
     col,
+    least,
+    lit,
+    max as spark_max,
+    min as spark_min,
+    pandas_udf,
+    sequence,
+    size,
+    split,
     substring,
+    sum as spark_sum,
     monotonically_increasing_id,
     expr,
+    transform,
+    when,
 )
-from pyspark.sql.types import StringType
+from pyspark.sql.types import DoubleType
+from scipy.sparse import csr_matrix
 from erp.matching import (
     calculate_confusion_matrix,
     resultToString,
     calculate_combined_similarity,
 )
 import pandas as pd
-from graphframes import GraphFrame
+from erp.clustering import DisjointSet
+from erp.features import encode_sets
+from erp.instrumentation import FILENAME_METRICS, export_metrics, get_instrumentation
 from erp.utils import (
     FILENAME_DP_MATCHED_ENTITIES,
     FILENAME_DP_CLUSTERING,
     RESULTS_FOLDER,
-    jaccard_similarity,
+    find_ngrams,
+    result_parquet_filename,
+    jaccard_similarity_batch,
     save_result,
-    trigram_similarity,
     DEFAULT_ER_CONFIGURATION,
     test_and_create_folder,
 )
 
+try:
+    from graphframes import GraphFrame
+except ImportError:
+    # Only the "graphframes" dp clustering needs it
+    GraphFrame = None
+
+# Spark settings that can be given in the ER configuration
+SPARK_SETTINGS = {
+    "spark_shuffle_partitions": "spark.sql.shuffle.partitions",
+    "spark_driver_memory": "spark.driver.memory",
+    "spark_parallelism": "spark.default.parallelism",
+}
+# Spark settings that can still be changed once the session is running
+SPARK_RUNTIME_SETTINGS = {"spark_shuffle_partitions"}
+# Matched pairs clustered with a local union-find rather than in Spark
+LOCAL_CLUSTERING_MAX_EDGES = 1000000
+
+_spark_session = None
+
+
+def get_spark_session(ERconfiguration=DEFAULT_ER_CONFIGURATION):
+    """Spark session shared by every dp pipeline call
+
+    The session is created on first use and stopped at process exit, so the
+    JVM is only started once per process.
+
+    Args:
+        ERconfiguration (dict, optional): "spark_master" and the keys of
+        SPARK_SETTINGS. Settings other than the shuffle partitions only apply
+        when the session is created. Defaults to DEFAULT_ER_CONFIGURATION.
+
+    Returns:
+        SparkSession
+    """
+    global _spark_session
+    if _spark_session is None:
+        conf = SparkConf().setAppName("Entity Resolution")
+        conf = conf.setMaster(ERconfiguration.get("spark_master", "local[*]"))
+        for key, setting in SPARK_SETTINGS.items():
+            if ERconfiguration.get(key) is not None:
+                conf = conf.set(setting, str(ERconfiguration[key]))
+        _spark_session = SparkSession.builder.config(conf=conf).getOrCreate()
+        test_and_create_folder("inbox")
+        _spark_session.sparkContext.setCheckpointDir("inbox")
+        atexit.register(stop_spark_session)
+        return _spark_session
+
+    for key in SPARK_SETTINGS:
+        if ERconfiguration.get(key) is None:
+            continue
+        if key in SPARK_RUNTIME_SETTINGS:
+            _spark_session.conf.set(SPARK_SETTINGS[key], str(ERconfiguration[key]))
+        elif _spark_session.sparkContext.getConf().get(SPARK_SETTINGS[key]) != str(
+            ERconfiguration[key]
+        ):
+            logging.warning(f"{key} is ignored, the Spark session is already running")
+    return _spark_session
+
+
+def stop_spark_session():
+    global _spark_session
+    if _spark_session is not None:
+        _spark_session.stop()
+        _spark_session = None
+
 
 def ER_pipeline_dp(
     filename1: str,
@@ -54,64 +148,181 @@ def ER_pipeline_dp(
     Returns:
         dict: execution information
     """
-
-    conf = SparkConf().setAppName("YourAppName").setMaster("local[*]")
-    sc = SparkContext(conf=conf)
-    test_and_create_folder("inbox")
-    sc.setCheckpointDir("inbox")
-
-    spark = SparkSession.builder.appName("Entity Resolution").getOrCreate()
-    # Read the datasets from two databases
-    start_time = time()
-    df1 = spark.read.option("delimiter", ",").option("header", True).csv(filename1)
-    df2 = spark.read.option("delimiter", ",").option("header", True).csv(filename2)
-    df1 = df1.withColumn("index", monotonically_increasing_id())
-    df2 = df2.withColumn("index", monotonically_increasing_id() + df1.count())
-    pairs = blocking(df1, df2, ERconfiguration["blocking_method"])
-    matched_pairs = matching(pairs, ERconfiguration["threshold"], output=matched_output)
-    end_time = time()
-    matching_time = end_time - start_time
-    if cluster:
-        clustering(df1, df2, matched_pairs, filename=cluster_output)
-    end_time = time()
-
+    spark = get_spark_session(ERconfiguration)
+    instrumentation = get_instrumentation()
+    with instrumentation.run(
+        pipeline="dp",
+        blocking_method=ERconfiguration["blocking_method"],
+        matching_method="Combined",
+        threshold=ERconfiguration["threshold"],
+    ) as records:
+        # Read the datasets from two databases
+        with instrumentation.stage("load") as metrics:
+            df1, df2 = read_databases(spark, filename1, filename2)
+            sizes = [df1.count(), df2.count()]
+            num_records = sum(sizes)
+            metrics["rows"] = num_records
+        # Spark is lazy: the blocking stage only plans the join, which runs in
+        # the matching stage
+        with instrumentation.stage("block") as metrics:
+            pairs = blocking(
+                df1,
+                df2,
+                ERconfiguration["blocking_method"],
+                **join_strategy(df1, df2, sizes, ERconfiguration),
+            )
+            metrics["rows"] = num_records
+        log_plan(pairs, "blocking")
+        with instrumentation.stage("match") as metrics:
+            matched_pairs = matching(
+                pairs, ERconfiguration["threshold"], output=matched_output
+            )
+            # Counted from the persisted matches, the matching plan only ran once
+            num_matched_pairs = matched_pairs.count()
+            metrics["matched_pairs"] = num_matched_pairs
+        log_plan(matched_pairs, "matching")
+        if cluster:
+            with instrumentation.stage("cluster") as metrics:
+                clustering(
+                    df1,
+                    df2,
+                    matched_pairs,
+                    filename=cluster_output,
+                    clustering_method=ERconfiguration.get(
+                        "dp_clustering_method", "largeSmallStar"
+                    ),
+                    local_threshold=ERconfiguration.get(
+                        "local_clustering_threshold", LOCAL_CLUSTERING_MAX_EDGES
+                    ),
+                )
+                metrics["rows"] = num_matched_pairs
+
+        if baseline:
+            with instrumentation.stage("evaluate") as metrics:
+                metrics["rows"] = num_matched_pairs
+                baseline_matches = create_baseline(df1, df2)
+                out = resultToString(
+                    DEFAULT_ER_CONFIGURATION,
+                    -1,
+                    -1,
+                    -1,
+                    baseline_matches,
+                    matched_df=matched_pairs,
+                    suffix="_dp",
+                )
+    export_metrics(
+        records,
+        ERconfiguration.get("metrics_output", FILENAME_METRICS),
+        ERconfiguration.get("prometheus_output"),
+    )
     if baseline:
-        baseline_matches = create_baseline(df1, df2)
-        return resultToString(
-            DEFAULT_ER_CONFIGURATION,
-            -1,
-            -1,
-            -1,
-            baseline_matches,
-            matched_df=matched_pairs,
-            suffix="_dp",
-        )
+        return out
 
+    stage_times = {record["stage"]: record["wall_seconds"] for record in records}
+    matching_time = stage_times["load"] + stage_times["block"] + stage_times["match"]
     out = {
-        "dp rate": round(matched_pairs.count() / (df1.count() + df2.count()), 4),
-        "dp execution time": round((end_time - start_time) / 60, 2),
+        "dp rate": round(num_matched_pairs / num_records, 4),
+        "dp execution time": round(
+            (matching_time + stage_times.get("cluster", 0)) / 60, 2
+        ),
         "dp execution time(matching+blocking)": round(matching_time / 60, 2),
     }
-    spark.stop()
+    matched_pairs.unpersist()
     return out
 
 
+def read_databases(spark, filename1, filename2):
+    """both databases with an "index" column, database2 numbered after database1
+
+    Returns:
+        (DataFrame, DataFrame)
+    """
+    df1 = spark.read.option("delimiter", ",").option("header", True).csv(filename1)
+    df2 = spark.read.option("delimiter", ",").option("header", True).csv(filename2)
+    df1 = df1.withColumn("index", monotonically_increasing_id())
+    df2 = df2.withColumn("index", monotonically_increasing_id() + df1.count())
+    return df1, df2
+
+
 def blocking(
-    df1: str, df2: str, blocking_method=DEFAULT_ER_CONFIGURATION["blocking_method"]
+    df1: str,
+    df2: str,
+    blocking_method=DEFAULT_ER_CONFIGURATION["blocking_method"],
+    **join_options,
 ):
     """blocking in dp framwork
 
     Args:
         filename1 (str): database input1 filename
         filename2 (str): database input2 filename
-        blocking_method (str, optional): 
-        {“FirstLetterTitle”, “FirstOrLastLetterTitle”}. Defaults to DEFAULT_ER_CONFIGURATION["blocking_method"].
+        blocking_method (str, optional):
+        {Year”,“TwoYear”,“FirstLetterTitle”,“LastLetterTitle”,“FirstOrLastLetterTitle”,
+        “numAuthors”,“authorLastName”,“commonAuthors”,“commonAndNumAuthors”}.
+        Defaults to DEFAULT_ER_CONFIGURATION["blocking_method"].
+        join_options: broadcast_side, repartition_side and skew of create_equi_join
 
     Returns:
         DataFrame
     """
     blocking_function = globals()[f"create_{blocking_method}Blocking"]
-    return blocking_function(df1, df2)
+    return blocking_function(df1, df2, **join_options)
+
+
+def join_strategy(df1, df2, sizes, ERconfiguration=DEFAULT_ER_CONFIGURATION):
+    """join options of the blocking for the sizes of the databases
+
+    The smaller database is broadcast if it has at most
+    ERconfiguration["broadcast_threshold"] records or, without that setting, if
+    its size estimated by Spark is at most spark.sql.autoBroadcastJoinThreshold.
+    The larger database is repartitioned by block key if
+    ERconfiguration["repartition_by_key"] is set.
+
+    Args:
+        df1 (DataFrame): database1
+        df2 (DataFrame): database2
+        sizes (list): number of records of database1 and database2
+        ERconfiguration (dict, optional): Defaults to DEFAULT_ER_CONFIGURATION.
+
+    Returns:
+        dict: join_options of blocking
+    """
+    smaller = 1 if sizes[0] <= sizes[1] else 2
+    size_in_bytes = estimated_size(df1 if smaller == 1 else df2)
+    join_options = {}
+    broadcast_threshold = ERconfiguration.get("broadcast_threshold")
+    if broadcast_threshold is not None:
+        broadcast_smaller = sizes[smaller - 1] <= broadcast_threshold
+    else:
+        max_bytes = auto_broadcast_threshold(df1.sparkSession)
+        broadcast_smaller = 0 <= max_bytes and size_in_bytes <= max_bytes
+    if broadcast_smaller:
+        join_options["broadcast_side"] = smaller
+    if ERconfiguration.get("repartition_by_key", False):
+        join_options["repartition_side"] = 3 - smaller
+    logging.info(
+        f"databases of {sizes[0]} and {sizes[1]} records, smaller database of "
+        f"about {size_in_bytes} bytes: {join_options}"
+    )
+    return join_options
+
+
+def estimated_size(df):
+    # Size in bytes estimated by the optimizer, from the file size for a CSV file
+    stats = df._jdf.queryExecution().optimizedPlan().stats()
+    return int(stats.sizeInBytes().toString())
+
+
+def auto_broadcast_threshold(spark):
+    # spark.sql.autoBroadcastJoinThreshold in bytes, negative when disabled
+    return spark._jsparkSession.sessionState().conf().autoBroadcastJoinThreshold()
+
+
+def log_plan(df, stage):
+    # Log the physical plan Spark chose for a stage of the pipeline
+    plan = io.StringIO()
+    with redirect_stdout(plan):
+        df.explain()
+    logging.info(f"physical plan of {stage}:\n{plan.getvalue()}")
 
 
 def matching(
@@ -127,22 +338,29 @@ def matching(
         output (str, optional): Defaults to FILENAME_DP_MATCHED_ENTITIES.
 
     Returns:
-        DataFrame
+        DataFrame: the matched pairs, persisted
     """
     pairs = pairs.withColumn(
         "similarity_score",
-        process_udf(
+        combined_similarity(
             col("paper title_df1"),
             col("paper title_df2"),
             col("author names_df1"),
             col("author names_df2"),
         ),
     )
-    pairs = pairs.filter(pairs.similarity_score > threshold)
-    save_result(pairs.toPandas(), output)
+    pairs = pairs.filter(pairs.similarity_score > threshold).persist()
+    save_result_dp(pairs, output)
     return pairs
 
-def clustering(df1, df2, matched_df, filename=FILENAME_DP_CLUSTERING):
+def clustering(
+    df1,
+    df2,
+    matched_df,
+    filename=FILENAME_DP_CLUSTERING,
+    clustering_method="largeSmallStar",
+    local_threshold=LOCAL_CLUSTERING_MAX_EDGES,
+):
     """clustering in dp framework
 
     Args:
@@ -150,6 +368,11 @@ def clustering(df1, df2, matched_df, filename=FILENAME_DP_CLUSTERING):
         df2 (DataFrame): database2
         matched_df (DataFrame): matched entities
         filename (str, optional):  Defaults to FILENAME_DP_CLUSTERING.
+        clustering_method (str, optional): {"largeSmallStar", "graphframes"}.
+        Defaults to "largeSmallStar".
+        local_threshold (int, optional): with at most this number of matched
+        pairs, "largeSmallStar" collects them and runs a local union-find.
+        Defaults to LOCAL_CLUSTERING_MAX_EDGES.
     """
     df = df1.union(df2)
     vertices = df.withColumnRenamed("index", "id")
@@ -159,15 +382,15 @@ def clustering(df1, df2, matched_df, filename=FILENAME_DP_CLUSTERING):
     edges = edges.withColumnRenamed("index_df1", "src")
     edges = edges.withColumnRenamed("index_df2", "dst")
 
-    # Create a GraphFrame
-    graph = GraphFrame(vertices, edges)
-    # graph = GraphFrame(
-    #     vertices, edges.union(edges.selectExpr("dst as src", "src as dst"))
-    # )
-
-    # Find connected components
-    connected_components = graph.connectedComponents()
-    # logging.info(connected_components.count(), vertices.count(), edges.count())
+    # Find connected components, labelled by their smallest vertex
+    if clustering_method == "graphframes":
+        if GraphFrame is None:
+            raise ImportError("graphframes is required by the graphframes clustering")
+        connected_components = GraphFrame(vertices, edges).connectedComponents()
+    elif edges.count() <= local_threshold:
+        connected_components = connected_components_local(vertices, edges)
+    else:
+        connected_components = connected_components_star(vertices, edges)
 
     # Select the first vertex in every connected component
     first_vertices_df = connected_components.groupBy("component").agg({"id": "max"})
@@ -177,72 +400,458 @@ def clustering(df1, df2, matched_df, filename=FILENAME_DP_CLUSTERING):
 
     # Construct the DataFrame
     first_vertices_df = first_vertices_df.orderBy("component")
-    save_result(first_vertices_df.toPandas(), filename)
+    save_result_dp(first_vertices_df, filename)
 
 
 #==================================================================================
 #==============Functions basically never called externally=========================
 #==================================================================================
 
-def isNoneOrEmpty(str):
-    return (str == None) or (str == "")
+def title_jaccard_similarity(title1, title2):
+    # Jaccard similarity of the sets of title words, computed in the JVM
+    words1 = array_remove(split(coalesce(title1, lit("")), "\\s+"), "")
+    words2 = array_remove(split(coalesce(title2, lit("")), "\\s+"), "")
+    union_size = size(array_union(words1, words2))
+    return when(union_size == 0, lit(0.0)).otherwise(
+        size(array_intersect(words1, words2)) / union_size
+    )
 
 
 def calculate_combined_similarity_dp(
-    title1, title2, author_names_df1, author_names_df2
+    title_similarity: pd.Series,
+    author_names_df1: pd.Series,
+    author_names_df2: pd.Series,
+) -> pd.Series:
+    # Combined similarity of a batch of pairs, title only when an author is missing
+    has_authors = (author_names_df1.fillna("") != "") & (
+        author_names_df2.fillna("") != ""
+    )
+    codes, author_names = pd.factorize(
+        pd.concat([author_names_df1[has_authors], author_names_df2[has_authors]])
+    )
+    indptr, indices, vocabulary = encode_sets(
+        [find_ngrams(names) for names in author_names]
+    )
+    trigrams = csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, indptr),
+        shape=(len(author_names), len(vocabulary)),
+    )
+    num_pairs = int(has_authors.sum())
+    trigram_similarity_author = jaccard_similarity_batch(
+        trigrams, codes[:num_pairs], codes[num_pairs:]
+    )
+    similarity = title_similarity.astype(np.float64)
+    similarity[has_authors] = (
+        0.7 * similarity[has_authors] + 0.3 * trigram_similarity_author
+    )
+    return similarity
+
+
+def combined_similarity(title1, title2, author_names_df1, author_names_df2):
+    # Arrow batches of pairs are scored by calculate_combined_similarity_dp
+    process_udf = pandas_udf(calculate_combined_similarity_dp, DoubleType())
+    return process_udf(
+        title_jaccard_similarity(title1, title2), author_names_df1, author_names_df2
+    )
+
+
+def save_result_dp(df, filename):
+    # Written by the executors as CSV and Parquet part files, never collected
+    folder_path = RESULTS_FOLDER
+    test_and_create_folder(folder_path)
+    df.write.mode("overwrite").option("header", True).csv(folder_path + filename)
+    df.write.mode("overwrite").parquet(folder_path + result_parquet_filename(filename))
+
+
+def suffix_columns(df, suffix):
+    return df.select(
+        [col(col_name).alias(col_name + suffix) for col_name in df.columns]
+    )
+
+
+def create_equi_join(
+    df1,
+    df2,
+    keys_df1,
+    keys_df2,
+    deduplicate=False,
+    skew=True,
+    broadcast_side=None,
+    repartition_side=None,
 ):
-    title_set1 = set(title1.split())
-    title_set2 = set(title2.split())
-    jaccard_similarity_title = jaccard_similarity(title_set1, title_set2)
+    """pairs of records with equal block keys, without any cartesian product
 
-    if isNoneOrEmpty(author_names_df1) or isNoneOrEmpty(author_names_df2):
-        combined_similarity = jaccard_similarity_title
-    else:
-        trigram_similarity_author = trigram_similarity(
-            author_names_df1, author_names_df2
+    Args:
+        df1 (DataFrame): database1
+        df2 (DataFrame): database2
+        keys_df1 (list): key columns of database1, keys_df1[i] is joined with
+        keys_df2[i]. Null keys never match.
+        keys_df2 (list): key columns of database2
+        deduplicate (bool, optional): if a pair can be joined on several keys.
+        Defaults to False.
+        skew (bool, optional): if blocks with too many pairs are split into
+        salted sub-blocks, only without broadcast. Defaults to True.
+        broadcast_side (int, optional): 1 or 2, the database sent to every
+        task to block map-side. Defaults to None.
+        repartition_side (int, optional): 1 or 2, the database repartitioned
+        by block key before the join. Defaults to None.
+
+    Returns:
+        DataFrame
+    """
+    pairs = None
+    for key_df1, key_df2 in zip(keys_df1, keys_df2):
+        buckets = [
+            suffix_columns(df1.withColumn("bucket", key_df1), "_df1"),
+            suffix_columns(df2.withColumn("bucket", key_df2), "_df2"),
+        ]
+        keys = [["bucket_df1"], ["bucket_df2"]]
+        if broadcast_side is not None:
+            buckets[broadcast_side - 1] = broadcast(buckets[broadcast_side - 1])
+        elif skew:
+            buckets = list(salt_hot_keys(*buckets))
+            keys = [["bucket_df1", "salt_df1"], ["bucket_df2", "salt_df2"]]
+        if repartition_side is not None:
+            buckets[repartition_side - 1] = buckets[repartition_side - 1].repartition(
+                *keys[repartition_side - 1]
+            )
+        bucket_df1, bucket_df2 = buckets
+        condition = [
+            bucket_df1[name_df1] == bucket_df2[name_df2]
+            for name_df1, name_df2 in zip(*keys)
+        ]
+        join = bucket_df1.join(bucket_df2, condition)
+        join = join.drop("bucket_df1", "bucket_df2", "salt_df1", "salt_df2")
+        pairs = join if pairs is None else pairs.unionByName(join)
+    if deduplicate:
+        pairs = pairs.dropDuplicates(["index_df1", "index_df2"])
+    return pairs
+
+
+def undirected_edges(edges):
+    # Every edge once as (larger vertex, smaller vertex), without self loops
+    return (
+        edges.select(
+            greatest("src", "dst").alias("src"), least("src", "dst").alias("dst")
+        )
+        .filter(col("src") != col("dst"))
+        .distinct()
+    )
+
+
+def both_directions(edges):
+    return edges.union(edges.select(col("dst").alias("src"), col("src").alias("dst")))
+
+
+def large_star(edges):
+    # Connect the larger neighbours of every vertex to its smallest neighbour
+    neighbours = both_directions(edges)
+    minimum = neighbours.groupBy("src").agg(spark_min("dst").alias("minimum"))
+    return undirected_edges(
+        neighbours.join(minimum, "src")
+        .filter(col("dst") > col("src"))
+        .select("dst", least("src", "minimum").alias("src"))
+    )
+
+
+def small_star(edges):
+    # Connect every vertex and its smaller neighbours to its smallest neighbour
+    smaller = both_directions(edges).filter(col("dst") < col("src"))
+    minimum = smaller.groupBy("src").agg(spark_min("dst").alias("minimum"))
+    return undirected_edges(
+        smaller.join(minimum, "src")
+        .select("dst", col("minimum").alias("src"))
+        .union(minimum.select(col("src").alias("dst"), col("minimum").alias("src")))
+    )
+
+
+def connected_components_star(vertices, edges):
+    """connected components with alternating large-star and small-star rounds
+
+    The rounds end when they do not change the edges anymore, every component
+    is then a star around its smallest vertex.
+
+    Returns:
+        DataFrame: "id" and "component" of every vertex
+    """
+    edges = undirected_edges(edges).localCheckpoint()
+    num_edges, num_rounds = edges.count(), 0
+    while True:
+        new_edges = small_star(large_star(edges)).localCheckpoint()
+        num_new_edges, num_rounds = new_edges.count(), num_rounds + 1
+        if num_new_edges == num_edges and new_edges.subtract(edges).isEmpty():
+            break
+        edges, num_edges = new_edges, num_new_edges
+    logging.info(f"connected components converged after {num_rounds} rounds")
+    return vertices.join(edges.withColumnRenamed("src", "id"), "id", "left").select(
+        "id", coalesce(col("dst"), col("id")).alias("component")
+    )
+
+
+def connected_components_local(vertices, edges):
+    """connected components of few edges with a local union-find
+
+    Returns:
+        DataFrame: "id" and "component" of every vertex
+    """
+    edges_pd = edges.toPandas()
+    ids, nodes = pd.factorize(
+        np.concatenate([edges_pd["src"].to_numpy(), edges_pd["dst"].to_numpy()])
+    )
+    disjoint_set = DisjointSet(len(nodes))
+    for node1, node2 in zip(
+        ids[: len(edges_pd)].tolist(), ids[len(edges_pd) :].tolist()
+    ):
+        disjoint_set.union(node1, node2)
+    roots = [disjoint_set.find(node) for node in range(len(nodes))]
+    components = pd.DataFrame({"id": np.asarray(nodes, dtype=np.int64), "root": roots})
+    components["component"] = components.groupby("root")["id"].transform("min")
+
+    spark = vertices.sparkSession
+    matched = spark.createDataFrame(
+        components[["id", "component"]], "id long, component long"
+    )
+    unmatched = vertices.join(matched, "id", "left_anti")
+    return matched.union(unmatched.select("id", col("id").alias("component")))
+
+
+def salt_hot_keys(bucket_df1, bucket_df2):
+    """split the blocks with more pairs than a shuffle partition should get
+
+    The records of database1 in a hot block are spread over salted sub-blocks
+    and the records of database2 in it are replicated in every sub-block, so
+    one task never has to compare a whole hot block.
+
+    Args:
+        bucket_df1 (DataFrame): database1 with its block key in "bucket_df1"
+        bucket_df2 (DataFrame): database2 with its block key in "bucket_df2"
+
+    Returns:
+        (DataFrame, DataFrame): both databases with a "salt_df1"/"salt_df2"
+        column, records only match in the same block and sub-block
+    """
+    spark = bucket_df1.sparkSession
+    histogram = (
+        bucket_df1.groupBy(col("bucket_df1").alias("bucket"))
+        .agg(count("*").alias("count_df1"))
+        .join(
+            bucket_df2.groupBy(col("bucket_df2").alias("bucket")).agg(
+                count("*").alias("count_df2")
+            ),
+            "bucket",
         )
-        combined_similarity = (
-            0.7 * jaccard_similarity_title + 0.3 * trigram_similarity_author
+        .withColumn("pairs", col("count_df1") * col("count_df2"))
+        .cache()
+    )
+    total_pairs = histogram.agg(spark_sum("pairs")).first()[0] or 0
+    num_partitions = int(spark.conf.get("spark.sql.shuffle.partitions"))
+    max_pairs = max(total_pairs // num_partitions, 1)
+    hot_blocks = histogram.filter(col("pairs") > max_pairs).collect()
+    log_partition_pairs(histogram, ["bucket"], num_partitions, "before salting")
+
+    num_salts = {
+        row["bucket"]: min(ceil(row["pairs"] / max_pairs), row["count_df1"])
+        for row in hot_blocks
+    }
+    partition_pairs = [
+        ceil(row["count_df1"] / num_salts[row["bucket"]]) * row["count_df2"]
+        for row in hot_blocks
+    ]
+    logging.info(
+        f"{total_pairs} candidate pairs, {len(hot_blocks)} blocks of more than "
+        f"{max_pairs} pairs are split into {sum(num_salts.values())} sub-blocks, "
+        f"largest block {max([row['pairs'] for row in hot_blocks], default=0)} "
+        f"pairs, largest sub-block {max(partition_pairs, default=0)} pairs"
+    )
+    if len(hot_blocks) == 0:
+        histogram.unpersist()
+        return bucket_df1.withColumn("salt_df1", lit(0)), bucket_df2.withColumn(
+            "salt_df2", lit(0)
         )
-    return combined_similarity
 
+    salts = broadcast(
+        spark.createDataFrame(list(num_salts.items()), ["bucket", "num_salts"])
+    )
+    bucket_df1 = (
+        bucket_df1.join(salts, bucket_df1.bucket_df1 == salts.bucket, "left")
+        .withColumn("salt_df1", coalesce(col("index_df1") % col("num_salts"), lit(0)))
+        .drop("bucket", "num_salts")
+    )
+    bucket_df2 = (
+        bucket_df2.join(salts, bucket_df2.bucket_df2 == salts.bucket, "left")
+        .withColumn(
+            "salt_df2",
+            explode(sequence(lit(0), coalesce(col("num_salts"), lit(1)) - 1)),
+        )
+        .drop("bucket", "num_salts")
+    )
+    salted_histogram = (
+        bucket_df1.groupBy(
+            col("bucket_df1").alias("bucket"), col("salt_df1").alias("salt")
+        )
+        .agg(count("*").alias("count_df1"))
+        .join(histogram.select("bucket", "count_df2"), "bucket")
+        .withColumn("pairs", col("count_df1") * col("count_df2"))
+    )
+    log_partition_pairs(
+        salted_histogram, ["bucket", "salt"], num_partitions, "after salting"
+    )
+    histogram.unpersist()
+    return bucket_df1, bucket_df2
 
-process_udf = udf(calculate_combined_similarity_dp, StringType())
 
+def log_partition_pairs(histogram, keys, num_partitions, when_salted):
+    """log the candidate pairs of the shuffle partitions of a join on keys
 
-def create_cross_product_pyspark(df1, df2):
-    bucket_df1 = df1.alias("df_copy")
-    bucket_df2 = df2.alias("df_copy")
-    # Rename columns for df1
-    df1_columns = [col(col_name).alias(col_name + "_df1") for col_name in df1.columns]
-    bucket_df1 = bucket_df1.select(df1_columns)
+    The partition of a key is computed like Spark's hash partitioning of the
+    join, pmod of the Murmur3 hash of the keys, instead of running the join.
 
-    # Rename columns for df2
-    df2_columns = [col(col_name).alias(col_name + "_df2") for col_name in df2.columns]
-    bucket_df2 = bucket_df2.select(df2_columns)
-    pairs = bucket_df1.crossJoin(bucket_df2)
-    return pairs
+    Args:
+        histogram (DataFrame): keys and the "pairs" of every key
+        keys (list): join key columns of histogram
+        num_partitions (int): number of shuffle partitions
+        when_salted (str): "before salting" or "after salting"
+    """
+    partition = expr(f"pmod(hash({', '.join(keys)}), {num_partitions})")
+    stats = (
+        histogram.groupBy(partition.alias("partition"))
+        .agg(spark_sum("pairs").alias("pairs"))
+        .agg(
+            spark_max("pairs").alias("max_pairs"),
+            expr("percentile_approx(pairs, 0.5)").alias("median_pairs"),
+            count("*").alias("num_partitions"),
+        )
+        .first()
+    )
+    logging.info(
+        f"candidate pairs per shuffle partition {when_salted}: largest "
+        f"{stats['max_pairs']}, median {stats['median_pairs']} over "
+        f"{stats['num_partitions']} non-empty partitions of {num_partitions}"
+    )
 
 
-def create_FirstLetterTitleBlocking(df1, df2):
-    df1 = df1.withColumn("bucket", substring(col("paper title"), 1, 1))
-    df2 = df2.withColumn("bucket", substring(col("paper title"), 1, 1))
-    pairs = create_cross_product_pyspark(df1, df2)
-    pairs = pairs.filter(pairs.bucket_df1 == pairs.bucket_df2)
-    return pairs
+def non_empty(column):
+    return when(column != "", column)
+
+
+def year_key():
+    return col("year of publication").cast("double")
+
+
+def first_letter_key():
+    return non_empty(substring(col("paper title"), 1, 1))
+
+
+def last_letter_key():
+    return non_empty(substring(col("paper title"), -1, 1))
+
+
+def num_authors(column="author names"):
+    # Missing author names count as one author, as in the local version
+    return size(split(coalesce(col(column), lit("nan")), ", "))
 
 
-def create_FirstOrLastLetterTitleBlocking(df1, df2):
-    df1 = df1.withColumn("bucket1", substring(col("paper title"), 1, 1))
-    df1 = df1.withColumn("bucket2", substring(col("paper title"), -1, 1))
-    df2 = df2.withColumn("bucket1", substring(col("paper title"), 1, 1))
-    df2 = df2.withColumn("bucket2", substring(col("paper title"), -1, 1))
-    pairs = create_cross_product_pyspark(df1, df2)
+def author_names_key():
+    return explode(
+        array_distinct(split(coalesce(col("author names"), lit("nan")), ", "))
+    )
+
+
+def last_names_key():
+    # Records without any last name only match each other
+    names = split(coalesce(col("author names"), lit("nan")), ", ")
+    last_names = array_distinct(
+        transform(
+            array_filter(names, lambda name: name != ""),
+            lambda name: element_at(split(name, " "), -1),
+        )
+    )
+    return explode(when(size(last_names) == 0, array(lit(" "))).otherwise(last_names))
+
+
+def create_YearBlocking(df1, df2, **join_options):
+    pairs = create_equi_join(df1, df2, [year_key()], [year_key()], **join_options)
+    return pairs.dropna(subset=["paper title_df1", "paper title_df2"])
+
+
+def create_TwoYearBlocking(df1, df2, **join_options):
+    # year_df2 - 1 == year_df1 or year_df2 == year_df1
+    pairs = create_equi_join(
+        df1,
+        df2,
+        [year_key(), year_key()],
+        [year_key(), year_key() - 1],
+        **join_options,
+    )
+    return pairs.dropna(subset=["paper title_df1", "paper title_df2"])
+
+
+def create_FirstLetterTitleBlocking(df1, df2, **join_options):
+    return create_equi_join(
+        df1, df2, [first_letter_key()], [first_letter_key()], **join_options
+    )
+
+
+def create_LastLetterTitleBlocking(df1, df2, **join_options):
+    return create_equi_join(
+        df1, df2, [last_letter_key()], [last_letter_key()], **join_options
+    )
+
+
+def create_FirstOrLastLetterTitleBlocking(df1, df2, **join_options):
+    # Union of the first letter and the last letter blocks
+    return create_equi_join(
+        df1,
+        df2,
+        [first_letter_key(), last_letter_key()],
+        [first_letter_key(), last_letter_key()],
+        deduplicate=True,
+        **join_options,
+    )
+
+
+def create_numAuthorsBlocking(df1, df2, **join_options):
+    # |num_authors_df1 - num_authors_df2| <= 1
+    pairs = create_equi_join(
+        df1,
+        df2,
+        [num_authors() - 1, num_authors(), num_authors() + 1],
+        [num_authors(), num_authors(), num_authors()],
+        **join_options,
+    )
+    return pairs.dropna(subset=["paper title_df1", "paper title_df2"])
+
+
+def create_commonAuthorsBlocking(df1, df2, **join_options):
+    return create_equi_join(
+        df1,
+        df2,
+        [author_names_key()],
+        [author_names_key()],
+        deduplicate=True,
+        **join_options,
+    )
+
+
+def create_authorLastNameBlocking(df1, df2, **join_options):
+    return create_equi_join(
+        df1,
+        df2,
+        [last_names_key()],
+        [last_names_key()],
+        deduplicate=True,
+        **join_options,
+    )
+
+
+def create_commonAndNumAuthorsBlocking(df1, df2, **join_options):
+    pairs = create_commonAuthorsBlocking(df1, df2, **join_options)
     pairs = pairs.filter(
-        (pairs.bucket1_df1 == pairs.bucket1_df2)
-        | (pairs.bucket2_df1 == pairs.bucket2_df2)
+        (num_authors("author names_df1") - num_authors("author names_df2")).between(
+            -2, 2
+        )
     )
-    return pairs
+    return pairs.dropna(subset=["paper title_df1", "paper title_df2"])
 
 
 def create_baseline(df1, df2, threshold=DEFAULT_ER_CONFIGURATION["threshold"]):
@@ -257,7 +866,7 @@ def create_baseline(df1, df2, threshold=DEFAULT_ER_CONFIGURATION["threshold"]):
         t_df1.crossJoin(t_df2)
         .withColumn(
             "similarity_score",
-            process_udf(
+            combined_similarity(
                 col("paper title_df1"),
                 col("paper title_df2"),
                 col("author names_df1"),
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+INDEX_COLUMNS = ["index_df1", "index_df2"]
+PAPER_ID_COLUMNS = ["paper ID_df1", "paper ID_df2"]
+
+
+def pair_keys(*results, columns=None):
+    """int64 keys of the pairs of several results, the same pair has the same key
+    in every result
+
+    Args:
+        results (DataFrame): pairs of records
+        columns (list, optional): the two record columns of the pairs. Defaults
+        to the index columns if every result has them, otherwise the paper IDs.
+
+    Returns:
+        list: the keys of every result
+    """
+    if columns is None:
+        columns = (
+            INDEX_COLUMNS
+            if all(set(INDEX_COLUMNS).issubset(result) for result in results)
+            else PAPER_ID_COLUMNS
+        )
+    codes = []
+    # The key of the first column is multiplied by 1 << 32, so it must stay
+    # below 1 << 31 for the keys to fit in an int64
+    for column, limit in zip(columns, [1 << 31, 1 << 32]):
+        values = np.concatenate([result[column].to_numpy() for result in results])
+        if values.dtype.kind in "iu" and (
+            len(values) == 0 or (values.min() >= 0 and values.max() < limit)
+        ):
+            # Record indexes are packed as they are
+            codes.append((values.astype(np.int64), 1 << 32))
+        else:
+            column_codes, uniques = pd.factorize(values)
+            codes.append((column_codes.astype(np.int64), max(len(uniques), 1)))
+    (codes_df1, _), (codes_df2, num_codes_df2) = codes
+    keys = codes_df1 * num_codes_df2 + codes_df2
+    return np.split(keys, np.cumsum([len(result) for result in results])[:-1])
+
+
+def in_sorted(keys, sorted_keys):
+    """which keys are in an array of sorted keys"""
+    positions = np.searchsorted(sorted_keys, keys)
+    found = positions < len(sorted_keys)
+    found[found] = sorted_keys[positions[found]] == keys[found]
+    return found
+
+
+def confusion_matrix(baseline_keys, matched_keys):
+    """confusion matrix of matched pairs against the baseline, as sets of pairs
+
+    Args:
+        baseline_keys (ndarray): pair keys of the baseline
+        matched_keys (ndarray): pair keys of the matched pairs
+
+    Returns:
+        (int, int, int, float, float, float): tp, fn, fp, precision, recall, f1
+    """
+    baseline_keys = np.unique(baseline_keys)
+    matched_keys = np.unique(matched_keys)
+    tp = int(in_sorted(matched_keys, baseline_keys).sum())
+    fn = len(baseline_keys) - tp
+    fp = len(matched_keys) - tp
+
+    # Calculate precision, recall, and F1 score
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+    f1 = (
+        (2 * (precision * recall) / (precision + recall))
+        if (precision + recall) > 0
+        else 0
+    )
+    return tp, fn, fp, precision, recall, f1
+
+
+def differences(df1, df2, keys_df1, keys_df2):
+    """pairs of only one of two results
+
+    Returns:
+        DataFrame: the rows of df1 missing in df2 ("_merge" is "left_only")
+        followed by the rows of df2 missing in df1 ("right_only")
+    """
+    only_df1 = ~in_sorted(keys_df1, np.unique(keys_df2))
+    only_df2 = ~in_sorted(keys_df2, np.unique(keys_df1))
+    return pd.concat(
+        [
+            df1[only_df1].assign(_merge="left_only"),
+            df2[only_df2].assign(_merge="right_only"),
+        ],
+        ignore_index=True,
+    )
@@ -0,0 +1,345 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from erp.utils import find_ngrams
+
+# Features made of a set of strings per record, stored as CSR arrays
+SET_FEATURES = ["title_tokens", "author_trigrams", "author_names", "last_names"]
+# Features made of one value per record
+ARRAY_FEATURES = ["num_authors", "has_authors", "first_letter", "last_letter", "year"]
+_SET_SUFFIXES = ("_indptr", "_indices", "_vocabulary")
+
+
+def title_tokens(df):
+    return [
+        set(title.split()) if isinstance(title, str) else set()
+        for title in df["paper title"]
+    ]
+
+
+def author_trigrams(df):
+    return [
+        find_ngrams(names) if isinstance(names, str) else set()
+        for names in df["author names"]
+    ]
+
+
+def author_names(df):
+    return [set(str(names).split(", ")) for names in df["author names"]]
+
+
+def authorLastName(df):
+    last_names_column = []
+    for author_names_list in [str(names).split(", ") for names in df["author names"]]:
+        if len(author_names_list) == 0:
+            last_names_column.append(set())
+        else:
+            last_names_column.append(
+                {name.split(" ")[-1] for name in author_names_list if len(name) > 0}
+            )
+    return last_names_column
+
+
+def num_authors(df):
+    return df["author names"].astype(str).str.split(", ").str.len().to_numpy(np.int32)
+
+
+def has_authors(df):
+    return df["author names"].notna().to_numpy()
+
+
+def first_letter(df):
+    return df["paper title"].str[0].fillna("").to_numpy(dtype="<U1")
+
+
+def last_letter(df):
+    return df["paper title"].str[-1].fillna("").to_numpy(dtype="<U1")
+
+
+def year(df):
+    return df["year of publication"].to_numpy(dtype=np.float64)
+
+
+FEATURE_EXTRACTORS = {
+    "title_tokens": title_tokens,
+    "author_trigrams": author_trigrams,
+    "author_names": author_names,
+    "last_names": authorLastName,
+    "num_authors": num_authors,
+    "has_authors": has_authors,
+    "first_letter": first_letter,
+    "last_letter": last_letter,
+    "year": year,
+}
+
+
+def encode_sets(sets):
+    """encode a list of sets as CSR arrays over a vocabulary
+
+    Returns:
+        (ndarray, ndarray, ndarray): indptr, vocabulary ids and vocabulary
+    """
+    indptr = np.zeros(len(sets) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in sets], out=indptr[1:])
+    values = np.array([value for values in sets for value in values], dtype=object)
+    indices, vocabulary = pd.factorize(values)
+    vocabulary = (
+        np.array(vocabulary, dtype=str) if len(vocabulary) else np.array([], "<U1")
+    )
+    return indptr, indices.astype(np.int32), vocabulary
+
+
+class FeatureStore:
+    """Per-record features of a database, extracted once and reused by every
+    blocking method, matching method and threshold.
+
+    Features are extracted lazily from the database on first use. A store
+    saved with `save` holds all of them and can be loaded without the
+    database.
+    """
+
+    def __init__(self, df=None, arrays=None):
+        self.df = df
+        self.arrays = {} if arrays is None else dict(arrays)
+        self.size = len(df) if df is not None else len(self.arrays["year"])
+        self.index = (
+            df["index"].to_numpy()
+            if (df is not None) and ("index" in df)
+            else np.arange(self.size)
+        )
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        if name in SET_FEATURES:
+            return self.indptr(name), self.indices(name), self.vocabulary(name)
+        return self._get(name)
+
+    def indptr(self, name):
+        return self._get(name + "_indptr")
+
+    def indices(self, name):
+        return self._get(name + "_indices")
+
+    def vocabulary(self, name):
+        return self._get(name + "_vocabulary")
+
+    def sizes(self, name):
+        return np.diff(self.indptr(name))
+
+    def values(self, name):
+        """the set feature flattened, in record order"""
+        return self.vocabulary(name)[self.indices(name)]
+
+    def positions(self, index):
+        """positions of the records with the given "index" values"""
+        index = np.asarray(index)
+        offset = self.index[0] if self.size else 0
+        if np.array_equal(self.index, np.arange(offset, offset + self.size)):
+            return index - offset
+        return pd.Index(self.index).get_indexer(index)
+
+    def take(self, positions):
+        """feature store of the records at the given positions"""
+        positions = np.asarray(positions, dtype=np.int64)
+        arrays = {}
+        for name in SET_FEATURES:
+            indptr, indices, vocabulary = self[name]
+            starts, sizes = indptr[positions], np.diff(indptr)[positions]
+            arrays[name + "_indptr"] = np.zeros(len(positions) + 1, dtype=np.int64)
+            np.cumsum(sizes, out=arrays[name + "_indptr"][1:])
+            within = np.arange(sizes.sum(), dtype=np.int64) - np.repeat(
+                arrays[name + "_indptr"][:-1], sizes
+            )
+            arrays[name + "_indices"] = indices[np.repeat(starts, sizes) + within]
+            arrays[name + "_vocabulary"] = vocabulary
+        for name in ARRAY_FEATURES:
+            arrays[name] = self[name][positions]
+        features = FeatureStore(arrays=arrays)
+        features.index = self.index[positions]
+        return features
+
+    def append(self, other):
+        """feature store of these records followed by the records of other"""
+        arrays = {}
+        for name in SET_FEATURES:
+            vocabulary = pd.Index(self.vocabulary(name))
+            vocabulary_other = pd.Index(other.vocabulary(name))
+            vocabulary = vocabulary.append(vocabulary_other.difference(vocabulary))
+            arrays[name + "_indptr"] = np.concatenate(
+                [self.indptr(name), other.indptr(name)[1:] + len(self.indices(name))]
+            )
+            arrays[name + "_indices"] = np.concatenate(
+                [
+                    self.indices(name),
+                    vocabulary.get_indexer(vocabulary_other)[other.indices(name)],
+                ]
+            ).astype(np.int32)
+            arrays[name + "_vocabulary"] = np.array(vocabulary, dtype=str)
+        for name in ARRAY_FEATURES:
+            arrays[name] = np.concatenate([self[name], other[name]])
+        features = FeatureStore(arrays=arrays)
+        features.index = np.concatenate([self.index, other.index])
+        return features
+
+    def extract(self):
+        for name in SET_FEATURES + ARRAY_FEATURES:
+            self[name]
+        return self
+
+    def save(self, filename):
+        np.savez(filename, **self.extract().arrays)
+
+    @classmethod
+    def load(cls, filename, df=None):
+        with np.load(filename, allow_pickle=False) as data:
+            features = cls(arrays={name: data[name] for name in data.files})
+        if df is not None:
+            features.df = df
+            features.index = df["index"].to_numpy() if "index" in df else features.index
+        return features
+
+    def _get(self, name):
+        if name not in self.arrays:
+            feature = name.rsplit("_", 1)[0] if name.endswith(_SET_SUFFIXES) else name
+            if feature in SET_FEATURES:
+                (
+                    self.arrays[feature + "_indptr"],
+                    self.arrays[feature + "_indices"],
+                    self.arrays[feature + "_vocabulary"],
+                ) = encode_sets(FEATURE_EXTRACTORS[feature](self.df))
+            else:
+                self.arrays[name] = FEATURE_EXTRACTORS[name](self.df)
+        return self.arrays[name]
+
+
+def concat_features(stores):
+    """feature store of the records of several stores, one after the other
+
+    Only the vocabulary used by the records is kept, so the cost is the size
+    of the records and not of the vocabularies of the stores.
+
+    Args:
+        stores (list): FeatureStore, at least one
+
+    Returns:
+        FeatureStore
+    """
+    arrays = {}
+    for name in SET_FEATURES:
+        used = [np.unique(store.indices(name)) for store in stores]
+        codes, vocabulary = pd.factorize(
+            np.concatenate(
+                [store.vocabulary(name)[ids] for store, ids in zip(stores, used)]
+            )
+        )
+        indptrs, indices = [np.zeros(1, dtype=np.int64)], []
+        num_codes, num_indices = 0, 0
+        for store, ids in zip(stores, used):
+            store_codes = codes[num_codes : num_codes + len(ids)]
+            indices.append(store_codes[np.searchsorted(ids, store.indices(name))])
+            indptrs.append(store.indptr(name)[1:] + num_indices)
+            num_codes += len(ids)
+            num_indices += len(store.indices(name))
+        arrays[name + "_indptr"] = np.concatenate(indptrs)
+        arrays[name + "_indices"] = np.concatenate(indices).astype(np.int32)
+        arrays[name + "_vocabulary"] = (
+            np.array(vocabulary, dtype=str) if len(vocabulary) else np.array([], "<U1")
+        )
+    for name in ARRAY_FEATURES:
+        arrays[name] = np.concatenate([store[name] for store in stores])
+    features = FeatureStore(arrays=arrays)
+    features.index = np.concatenate([store.index for store in stores])
+    return features
+
+
+def features_filename(dfilename):
+    return dfilename[:-4] + "_features.npz"
+
+
+def load_features(dfilename, df):
+    """feature store of a database, cached next to its file if the folder can
+    be written
+
+    Args:
+        dfilename (str): database filename
+        df (DataFrame): the database loaded from dfilename
+
+    Returns:
+        FeatureStore
+    """
+    filename = features_filename(dfilename)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(
+        dfilename
+    ):
+        features = FeatureStore.load(filename, df)
+        if len(features) == len(df):
+            return features
+    logging.info(f"Extracting features of {dfilename}")
+    features = FeatureStore(df).extract()
+    try:
+        features.save(filename)
+    except OSError as e:
+        logging.warning(f"Features of {dfilename} are not cached: {e}")
+    return features
+
+
+def shared_matrix(features_df1, features_df2, name):
+    """binary matrix of a set feature of both databases over a shared vocabulary,
+    the rows of database2 follow the rows of database1"""
+    vocabulary_df1 = pd.Index(features_df1.vocabulary(name))
+    vocabulary_df2 = pd.Index(features_df2.vocabulary(name))
+    vocabulary = vocabulary_df1.append(vocabulary_df2.difference(vocabulary_df1))
+    indices = np.concatenate(
+        [
+            vocabulary.get_indexer(vocabulary_df1)[features_df1.indices(name)],
+            vocabulary.get_indexer(vocabulary_df2)[features_df2.indices(name)],
+        ]
+    )
+    indptr = np.concatenate(
+        [
+            features_df1.indptr(name),
+            features_df2.indptr(name)[1:] + len(features_df1.indices(name)),
+        ]
+    )
+    matrix = csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, indptr),
+        shape=(len(features_df1) + len(features_df2), len(vocabulary)),
+    )
+    matrix.sort_indices()
+    return matrix
+
+
+def features_from_pairs(result_df):
+    """feature stores of the distinct records appearing in candidate pairs
+
+    Returns:
+        (FeatureStore, FeatureStore, ndarray, ndarray): features of both sides
+        and the positions of every pair in them
+    """
+    out = []
+    for suffix in ["_df1", "_df2"]:
+        titles = result_df["paper title" + suffix]
+        names = (
+            result_df["author names" + suffix]
+            if "author names" + suffix in result_df
+            else pd.Series(np.nan, index=result_df.index)
+        )
+        title_codes, title_values = pd.factorize(titles, use_na_sentinel=False)
+        name_codes, name_values = pd.factorize(names, use_na_sentinel=False)
+        positions, records = pd.factorize(
+            title_codes.astype(np.int64) * max(len(name_values), 1) + name_codes
+        )
+        title_codes, name_codes = np.divmod(records, max(len(name_values), 1))
+        df = pd.DataFrame(
+            {
+                "paper title": np.asarray(title_values, dtype=object)[title_codes],
+                "author names": np.asarray(name_values, dtype=object)[name_codes],
+            }
+        )
+        out.append((FeatureStore(df), positions))
+    (features_df1, positions_df1), (features_df2, positions_df2) = out
+    return features_df1, features_df2, positions_df1, positions_df2
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from erp.clustering import DisjointSet
+from erp.features import FeatureStore, concat_features
+from erp.indexing import BlockIndex, BlockKeys, merge_indexes
+from erp.matching import PARTITION_KEYS, blocking, blocking_keys, matching
+from erp.utils import (
+    DATABSE_COLUMNS,
+    DEFAULT_ER_CONFIGURATION,
+    FILENAME_LOCAL_CLUSTERING,
+    load_database_cache,
+    save_database_cache,
+    save_result,
+    test_and_create_folder,
+)
+
+# A block index segment is merged into the one before it while that one has
+# at most this many times its postings, so records are merged O(log n) times
+INDEX_MERGE_FACTOR = 2
+MATCHES_COLUMNS = ["index_df1", "index_df2", "similarity_score"]
+
+
+class IncrementalER:
+    """Entity resolution of two databases updated with batches of new records.
+
+    The state holds, for both databases, the records, their features and the
+    block index of the configured blocking method, along with the matched
+    pairs and the union-find of the clusters. A batch is only blocked and
+    matched against the records sharing a block with it, and its matches
+    merge the clusters they connect.
+
+    Records, features and matched pairs are kept as one segment per batch and
+    only concatenated by save and clusters, and block index segments are
+    merged geometrically, so a batch costs the size of the batch and of its
+    neighbourhood, not of the databases.
+
+    Records are numbered in the order they are added, so adding database1 and
+    then database2 to an empty state numbers them as ER_pipeline_local does.
+    """
+
+    def __init__(self, ERconfiguration=DEFAULT_ER_CONFIGURATION):
+        self.configuration = dict(ERconfiguration)
+        # Segments of both databases, and the position of their first record
+        self.records = [[], []]
+        self.features = [[], []]
+        self.starts = [[], []]
+        self.sizes = [0, 0]
+        self.indexes = [[], []]
+        self.matches = [empty_matches()]
+        self.disjoint_set = DisjointSet(0)
+
+    def __len__(self):
+        return len(self.disjoint_set.parent)
+
+    def add_records(self, new_df, database):
+        """block, match and cluster a batch of new records
+
+        Args:
+            new_df (DataFrame): new records of a database
+            database (int): 1 or 2, the database of the new records
+
+        Returns:
+            DataFrame: the pairs matched with the new records
+        """
+        side, other = database - 1, 2 - database
+        new_df = new_df.reset_index(drop=True)
+        new_df["index"] = np.arange(len(self), len(self) + len(new_df))
+        features = FeatureStore(new_df).extract()
+        blocking_method = self.configuration["blocking_method"]
+        keys = blocking_keys(
+            new_df,
+            new_df,
+            PARTITION_KEYS.get(blocking_method, blocking_method),
+            (features, features),
+        )[side]
+
+        # The neighbourhood of the batch: records of the other database sharing a block
+        neighbours = np.unique(
+            np.concatenate(
+                [np.zeros(0, dtype=np.int64)]
+                + [index.candidate_pairs(keys)[1] for index in self.indexes[other]]
+            )
+        )
+        if len(neighbours) > 0:
+            neighbours_df, neighbours_features = self.take(other, neighbours)
+        else:
+            # Matching no records returns the columns and dtypes of any matches
+            neighbours_df = (
+                self.records[other][0] if self.records[other] else new_df
+            ).iloc[:0]
+            neighbours_features = FeatureStore(neighbours_df).extract()
+        dfs = [new_df, neighbours_df]
+        stores = [features, neighbours_features]
+        if database == 2:
+            dfs, stores = dfs[::-1], stores[::-1]
+        result_df = blocking(*dfs, blocking_method, stores)
+        result_df = matching(
+            result_df,
+            self.configuration["threshold"],
+            self.configuration["matching_method"],
+            features=stores,
+        )
+        logging.info(
+            f"{len(new_df)} records of database{database} matched {len(result_df)} "
+            f"pairs among {len(neighbours)} records"
+        )
+
+        # Add the batch to the state
+        offset = self.sizes[side]
+        self.indexes[side].append(
+            BlockIndex(
+                BlockKeys(offset + keys.size, keys.positions + offset, keys.values)
+            )
+        )
+        self.merge_index_segments(side)
+        self.records[side].append(new_df)
+        self.features[side].append(features)
+        self.starts[side].append(offset)
+        self.sizes[side] += len(new_df)
+        matches = result_df[MATCHES_COLUMNS].astype(empty_matches().dtypes.to_dict())
+        self.matches.append(matches)
+        self.disjoint_set.add(len(new_df))
+        for idx1, idx2 in zip(
+            matches["index_df1"].tolist(), matches["index_df2"].tolist()
+        ):
+            self.disjoint_set.union(idx1, idx2)
+        return result_df
+
+    def take(self, side, positions):
+        """records and features of a database at ascending positions
+
+        Returns:
+            (DataFrame, FeatureStore)
+        """
+        segments = (
+            np.searchsorted(np.asarray(self.starts[side]), positions, side="right") - 1
+        )
+        touched, firsts = np.unique(segments, return_index=True)
+        dfs, stores = [], []
+        for segment, segment_positions in zip(
+            touched.tolist(), np.split(positions, firsts[1:])
+        ):
+            local = segment_positions - self.starts[side][segment]
+            dfs.append(self.records[side][segment].iloc[local])
+            stores.append(self.features[side][segment].take(local))
+        return pd.concat(dfs), concat_features(stores)
+
+    def matched_pairs(self):
+        """pairs matched so far, as matching returns them
+
+        Returns:
+            DataFrame: "index_df1", "index_df2" and "similarity_score"
+        """
+        return pd.concat(self.matches, ignore_index=True)
+
+    def clusters(self):
+        """records representing a cluster, as clustering with "unionFind"
+
+        Returns:
+            DataFrame
+        """
+        idx_list = np.unique(self.disjoint_set.representatives())
+        dfs = [df[df["index"].isin(idx_list)] for side in self.records for df in side]
+        combined_df = pd.concat(dfs) if dfs else empty_records()
+        return combined_df
+
+    def save_clusters(self, filename=FILENAME_LOCAL_CLUSTERING):
+        combined_df = self.clusters()
+        save_result(combined_df[DATABSE_COLUMNS + ["index"]], filename)
+        return combined_df
+
+    def save(self, folder):
+        """persist the state in a folder
+
+        Args:
+            folder (str): state folder
+        """
+        test_and_create_folder(folder)
+        for side in range(2):
+            if self.sizes[side] == 0:
+                continue
+            # The segments are compacted into one
+            self.records[side] = [pd.concat(self.records[side], ignore_index=True)]
+            self.features[side] = [concat_features(self.features[side])]
+            self.starts[side] = [0]
+            self.indexes[side] = [merge_indexes(self.indexes[side])]
+            # Raises instead of skipping a database it cannot write
+            save_database_cache(
+                os.path.join(folder, f"records_df{side + 1}.csv"),
+                self.records[side][0],
+                strict=True,
+            )
+            self.features[side][0].save(
+                os.path.join(folder, f"features_df{side + 1}.npz")
+            )
+            self.indexes[side][0].save(os.path.join(folder, f"index_df{side + 1}.npz"))
+        matches = self.matched_pairs()
+        self.matches = [matches]
+        np.savez(
+            os.path.join(folder, "clusters.npz"),
+            parent=np.array(self.disjoint_set.parent, dtype=np.int64),
+            rank=np.array(self.disjoint_set.rank, dtype=np.int64),
+            maximum=np.array(self.disjoint_set.maximum, dtype=np.int64),
+            **{column: matches[column].to_numpy() for column in MATCHES_COLUMNS},
+        )
+        with open(os.path.join(folder, "configuration.json"), "w") as file:
+            json.dump(self.configuration, file)
+
+    @classmethod
+    def load(cls, folder):
+        """state persisted with save
+
+        Args:
+            folder (str): state folder
+
+        Returns:
+            IncrementalER
+        """
+        with open(os.path.join(folder, "configuration.json")) as file:
+            state = cls(json.load(file))
+        for side in range(2):
+            records = os.path.join(folder, f"records_df{side + 1}.npz")
+            features = os.path.join(folder, f"features_df{side + 1}.npz")
+            index = os.path.join(folder, f"index_df{side + 1}.npz")
+            if not os.path.exists(records):
+                if os.path.exists(features) or os.path.exists(index):
+                    raise FileNotFoundError(
+                        f"{records} is missing, the state in {folder} is incomplete"
+                    )
+                continue
+            df = load_database_cache(records)
+            state.records[side] = [df]
+            state.features[side] = [FeatureStore.load(features, df)]
+            state.starts[side] = [0]
+            state.sizes[side] = len(df)
+            state.indexes[side] = [BlockIndex.load(index)]
+        with np.load(os.path.join(folder, "clusters.npz"), allow_pickle=False) as data:
+            state.disjoint_set.parent = data["parent"].tolist()
+            state.disjoint_set.rank = data["rank"].tolist()
+            state.disjoint_set.maximum = data["maximum"].tolist()
+            state.matches = [
+                pd.DataFrame({column: data[column] for column in MATCHES_COLUMNS})
+            ]
+        return state
+
+    def merge_index_segments(self, side):
+        # Merges the last segment while it is not much smaller than the one
+        # before, as the levels of an LSM tree
+        segments = self.indexes[side]
+        while len(segments) > 1 and len(segments[-2].postings) <= (
+            INDEX_MERGE_FACTOR * len(segments[-1].postings)
+        ):
+            segments[-2:] = [merge_indexes(segments[-2:])]
+
+
+# ==================================================================================
+# ==============Functions basically never called externally=========================
+# ==================================================================================
+
+
+def empty_matches():
+    return pd.DataFrame(
+        {
+            "index_df1": np.zeros(0, dtype=np.int64),
+            "index_df2": np.zeros(0, dtype=np.int64),
+            "similarity_score": np.zeros(0, dtype=np.float64),
+        }
+    )
+
+
+def empty_records():
+    return pd.DataFrame(columns=DATABSE_COLUMNS + ["index"])
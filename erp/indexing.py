@@ -0,0 +1,298 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# Block keys flattened into (record position, key) pairs, positions ascending
+BlockKeys = namedtuple("BlockKeys", ["size", "positions", "values"])
+
+
+def explode_keys(keys):
+    """flatten block keys into (record position, key) pairs
+
+    Args:
+        keys (Series|BlockKeys): one block key per record, or a list-like of
+        keys when a record falls into several blocks. Missing keys are dropped.
+
+    Returns:
+        BlockKeys
+    """
+    if isinstance(keys, BlockKeys):
+        return keys
+    size = len(keys)
+    keys = pd.Series(keys).reset_index(drop=True)
+    if keys.dtype == object:
+        keys = keys.explode()
+    keys = keys.dropna()
+    return BlockKeys(size, keys.index.to_numpy(dtype=np.int64), keys.to_numpy())
+
+
+class BlockIndex:
+    """Inverted index from block key to the positions of the records in it.
+
+    The posting lists are stored as one array of positions sorted by key, so
+    the records of block `k` are `postings[offsets[k]:offsets[k + 1]]`, in
+    ascending order.
+    """
+
+    def __init__(self, keys):
+        """
+        Args:
+            keys (Series|BlockKeys): block keys of the indexed database
+        """
+        keys = explode_keys(keys)
+        codes, uniques = pd.factorize(keys.values)
+        self.size = keys.size
+        self.keys = pd.Index(uniques, tupleize_cols=False)
+        self.postings = keys.positions[np.argsort(codes, kind="stable")]
+        self.offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(uniques)), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def block_sizes(self):
+        return np.diff(self.offsets)
+
+    def lookup(self, keys):
+        """positions of probing keys in the index, -1 for unknown keys"""
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.keys.get_indexer(pd.Index(keys, tupleize_cols=False))
+
+    def count_candidates(self, keys):
+        """number of (not deduplicated) candidate pairs of every probing record
+
+        Args:
+            keys (Series|BlockKeys): block keys of the probing database
+
+        Returns:
+            ndarray
+        """
+        keys = explode_keys(keys)
+        positions, codes = self._probe(keys)
+        counts = np.diff(self.offsets)[codes]
+        return np.bincount(positions, weights=counts, minlength=keys.size).astype(
+            np.int64
+        )
+
+    def candidate_pairs(self, keys):
+        """walk the posting lists of every probing key
+
+        Args:
+            keys (Series|BlockKeys): block keys of the probing database
+
+        Returns:
+            (ndarray, ndarray): positions in the probing database and in the
+            indexed database of all records sharing at least one key, without
+            duplicates and in the order of the cartesian product.
+        """
+        positions, codes = self._probe(keys)
+        starts = self.offsets[codes]
+        counts = self.offsets[codes + 1] - starts
+        total = counts.sum()
+        positions_probe = np.repeat(positions, counts)
+        within = np.arange(total, dtype=np.int64) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        positions_index = self.postings[np.repeat(starts, counts) + within]
+
+        # A pair is only generated twice if the probing record has several keys
+        if len(positions) > 1 and (np.diff(positions) == 0).any():
+            packed = np.unique(positions_probe * max(self.size, 1) + positions_index)
+            positions_probe, positions_index = np.divmod(packed, max(self.size, 1))
+        return positions_probe, positions_index
+
+    def candidate_pair_chunks(self, keys, max_pairs):
+        """candidate_pairs by ranges of probing records
+
+        A range holds at most max_pairs (not deduplicated) candidate pairs, or
+        a single probing record with more candidate pairs.
+
+        Args:
+            keys (Series|BlockKeys): block keys of the probing database
+            max_pairs (int): candidate pairs of a range
+
+        Yields:
+            (ndarray, ndarray): candidate_pairs of every range, ranges in
+            ascending positions
+        """
+        keys = explode_keys(keys)
+        num_pairs = np.cumsum(self.count_candidates(keys))
+        begin = 0
+        while begin < keys.size:
+            previous = num_pairs[begin - 1] if begin > 0 else 0
+            end = max(
+                int(np.searchsorted(num_pairs, previous + max_pairs, side="right")),
+                begin + 1,
+            )
+            first, last = np.searchsorted(keys.positions, [begin, end])
+            yield self.candidate_pairs(
+                BlockKeys(
+                    keys.size, keys.positions[first:last], keys.values[first:last]
+                )
+            )
+            begin = end
+
+    def save(self, filename):
+        keys = np.asarray(self.keys)
+        np.savez(
+            filename,
+            size=self.size,
+            keys=keys.astype(str) if keys.dtype == object else keys,
+            postings=self.postings,
+            offsets=self.offsets,
+        )
+
+    @classmethod
+    def load(cls, filename):
+        block_index = cls.__new__(cls)
+        with np.load(filename, allow_pickle=False) as data:
+            block_index.size = int(data["size"])
+            block_index.keys = pd.Index(data["keys"], tupleize_cols=False)
+            block_index.postings = data["postings"]
+            block_index.offsets = data["offsets"]
+        return block_index
+
+    def _probe(self, keys):
+        keys = explode_keys(keys)
+        codes = self.lookup(keys.values)
+        found = codes >= 0
+        return keys.positions[found], codes[found]
+
+
+def merge_indexes(block_indexes):
+    """one BlockIndex of the records of several indexes of the same database"""
+    positions = np.concatenate([index.postings for index in block_indexes])
+    values = np.concatenate(
+        [
+            np.repeat(np.asarray(index.keys), index.block_sizes())
+            for index in block_indexes
+        ]
+    )
+    order = np.argsort(positions, kind="stable")
+    size = max(index.size for index in block_indexes)
+    return BlockIndex(BlockKeys(size, positions[order], values[order]))
+
+
+def similarity_join(token_matrix, num_df1, threshold):
+    """candidate pairs of a Jaccard similarity join (PPJoin)
+
+    Tokens are ordered by ascending global frequency. Two sets can only reach
+    the threshold if they share a token of their prefixes (prefix filtering),
+    if their sizes are close enough (length filtering) and if the tokens left
+    after their first common token can still make up the overlap (positional
+    filtering). The surviving pairs are a superset of the result and must be
+    verified with the exact similarity.
+
+    Args:
+        token_matrix (csr_matrix): binary token matrix of database1 followed by
+        database2, over a shared vocabulary
+        num_df1 (int): number of records of database1
+        threshold (float): Jaccard similarity threshold, at least 0
+
+    Returns:
+        (ndarray, ndarray): positions in database1 and database2, in the order
+        of the cartesian product
+    """
+    # Never shorten a prefix because of the rounding of threshold * size
+    threshold = max(threshold - 1e-9, 0.0)
+    num_df2 = token_matrix.shape[0] - num_df1
+    sizes = np.diff(token_matrix.indptr).astype(np.int64)
+    codes = token_matrix.indices
+    frequency = np.bincount(codes, minlength=token_matrix.shape[1])
+    ranks = np.empty(len(frequency), dtype=np.int64)
+    ranks[np.lexsort((np.arange(len(frequency)), frequency))] = np.arange(
+        len(frequency)
+    )
+
+    # Sort the tokens of every record, rarest first, and keep their prefixes
+    records = np.repeat(np.arange(len(sizes)), sizes)
+    tokens = ranks[codes]
+    order = np.lexsort((tokens, records))
+    records, tokens = records[order], tokens[order]
+    positions = np.arange(len(records)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    prefix_sizes = np.minimum(sizes - np.ceil(threshold * sizes) + 1, sizes)
+    in_prefix = positions < prefix_sizes[records]
+    records, tokens, positions = (
+        records[in_prefix],
+        tokens[in_prefix],
+        positions[in_prefix],
+    )
+
+    # Index the prefixes of database2 by (token, size)
+    indexed = records >= num_df1
+    max_size = max(int(sizes.max(initial=0)), 1)
+    index_keys = tokens[indexed] * (max_size + 1) + sizes[records[indexed]]
+    order = np.argsort(index_keys, kind="stable")
+    index_keys = index_keys[order]
+    index_records = records[indexed][order] - num_df1
+    index_positions = positions[indexed][order]
+
+    # Probe with the prefixes of database1, only sizes passing the length filter
+    probe_records = records[~indexed]
+    probe_positions = positions[~indexed]
+    probe_sizes = sizes[probe_records]
+    min_sizes = np.ceil(threshold * probe_sizes).astype(np.int64)
+    max_sizes = (
+        np.minimum(np.floor(probe_sizes / threshold), max_size).astype(np.int64)
+        if threshold > 0
+        else np.full(len(probe_sizes), max_size)
+    )
+    probe_keys = tokens[~indexed] * (max_size + 1)
+    starts = np.searchsorted(index_keys, probe_keys + min_sizes, side="left")
+    ends = np.searchsorted(index_keys, probe_keys + max_sizes, side="right")
+    counts = np.maximum(ends - starts, 0)
+    within = np.arange(counts.sum(), dtype=np.int64) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    matched = np.repeat(starts, counts) + within
+    positions_df1 = np.repeat(probe_records, counts)
+    positions_df2 = index_records[matched]
+
+    # The first generated occurrence of a pair is its first common token
+    packed, first = np.unique(
+        positions_df1 * max(num_df2, 1) + positions_df2, return_index=True
+    )
+    size_df1 = sizes[positions_df1[first]]
+    size_df2 = sizes[positions_df2[first] + num_df1]
+    overlap = np.ceil(threshold / (1 + threshold) * (size_df1 + size_df2))
+    upper_bound = 1 + np.minimum(
+        size_df1 - np.repeat(probe_positions, counts)[first] - 1,
+        size_df2 - index_positions[matched][first] - 1,
+    )
+    packed = packed[upper_bound >= overlap]
+    return np.divmod(packed, max(num_df2, 1))
+
+
+def array_keys(*keys):
+    """BlockKeys with one key per record in every array, missing keys (NaN, "")
+    are dropped"""
+    size = len(keys[0])
+    values = np.stack(keys, axis=1).ravel()
+    positions = np.repeat(np.arange(size, dtype=np.int64), len(keys))
+    if values.dtype.kind == "f":
+        keep = ~np.isnan(values)
+    elif values.dtype.kind == "U":
+        keep = values != ""
+    else:
+        keep = np.ones(len(values), dtype=bool)
+    return BlockKeys(size, positions[keep], values[keep])
+
+
+def set_keys(indptr, values, empty=None):
+    """BlockKeys of a set of keys per record stored as CSR arrays
+
+    Args:
+        indptr (ndarray): the keys of record i are values[indptr[i]:indptr[i + 1]]
+        values (ndarray): keys
+        empty (optional): key of the records without any key. Defaults to None.
+    """
+    size = len(indptr) - 1
+    sizes = np.diff(indptr)
+    positions = np.repeat(np.arange(size, dtype=np.int64), sizes)
+    if empty is not None:
+        positions = np.concatenate([positions, np.flatnonzero(sizes == 0)])
+        values = np.concatenate([values, np.full((sizes == 0).sum(), empty)])
+        order = np.argsort(positions, kind="stable")
+        positions, values = positions[order], values[order]
+    return BlockKeys(size, positions, values)
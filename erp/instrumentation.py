@@ -0,0 +1,359 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from time import process_time, time
+import numpy as np
+from erp.utils import RESULTS_FOLDER, test_and_create_folder
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak_rss is not measured
+    resource = None
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    # Only pyinstrument_hook needs it
+    Profiler = None
+
+STAGES = ["load", "block", "match", "block+match", "cluster", "evaluate"]
+FILENAME_METRICS = "pipeline_metrics.jsonl"
+# Stage records kept in memory by an Instrumentation
+MAX_RECORDS = 100000
+# Stage metrics exported to Prometheus, with their help text
+PROMETHEUS_METRICS = {
+    "wall_seconds": "Wall time of the stage",
+    "cpu_seconds": "CPU time of the stage, including finished child processes",
+    "rows": "Rows processed by the stage",
+    "rows_per_second": "Rows processed by the stage per second",
+    "candidate_pairs": "Candidate pairs of the blocking",
+    "matched_pairs": "Pairs above the similarity threshold",
+    "peak_rss_bytes": "Peak resident set size of the process at the end of the stage",
+    "peak_traced_bytes": "Peak memory traced by tracemalloc during the stage",
+}
+BLOCK_SIZE_QUANTILES = [0.5, 0.9, 0.99]
+
+
+class Instrumentation:
+    """Metrics of the stages of pipeline runs.
+
+    Every stage records its wall and CPU time, peak memory and the counts set
+    by the pipeline (rows, candidate pairs, matched pairs, block sizes). Hooks
+    attached to the stages, e.g. profilers, wrap the stages they are attached
+    to outside of the measured time.
+    """
+
+    def __init__(self, trace_memory=False):
+        """
+        Args:
+            trace_memory (bool, optional): also measure the peak memory of every
+            stage with tracemalloc, which slows the stages down. Defaults to False.
+        """
+        self.trace_memory = trace_memory
+        self.records = deque(maxlen=MAX_RECORDS)
+        self.hooks = []
+        self.labels = {}
+        self._runs = []
+
+    def attach(self, hook, stages=None):
+        """wrap stages with a hook
+
+        Args:
+            hook (callable): hook(stage, labels) returns a context manager
+            stages (list, optional): stage names. Defaults to every stage.
+        """
+        self.hooks.append((hook, stages))
+
+    @contextmanager
+    def run(self, **labels):
+        """label the stages of a pipeline run
+
+        Yields:
+            list: the records of the stages of the run, filled as they end
+        """
+        previous = self.labels
+        self.labels = {**previous, "run": uuid.uuid4().hex, **labels}
+        records = []
+        self._runs.append(records)
+        try:
+            yield records
+        finally:
+            self.labels = previous
+            self._runs.remove(records)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """measure a stage
+
+        Yields:
+            dict: the record of the stage, the counts of the stage ("rows",
+            "candidate_pairs", "matched_pairs", "block_sizes") are set in it
+        """
+        labels = {**self.labels, **labels}
+        record = {
+            "stage": name,
+            "run": labels.pop("run", None),
+            "labels": labels,
+            "timestamp": time(),
+            "rows": None,
+            "candidate_pairs": None,
+            "matched_pairs": None,
+            "block_sizes": None,
+        }
+        with ExitStack() as hooks:
+            for hook, stages in self.hooks:
+                if (stages is None) or (name in stages):
+                    hooks.enter_context(hook(name, labels))
+            if self.trace_memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+            start_time, start_cpu_time = time(), cpu_time()
+            try:
+                yield record
+            except BaseException as e:
+                record["error"] = repr(e)
+                raise
+            finally:
+                record["wall_seconds"] = time() - start_time
+                record["cpu_seconds"] = cpu_time() - start_cpu_time
+                record["peak_rss_bytes"] = peak_rss()
+                record["peak_traced_bytes"] = (
+                    tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+                )
+                record["rows_per_second"] = (
+                    record["rows"] / record["wall_seconds"]
+                    if (record["rows"] is not None) and record["wall_seconds"] > 0
+                    else None
+                )
+                self.records.append(record)
+                for records in self._runs:
+                    records.append(record)
+                logging.info(
+                    f"stage {name}: {record['wall_seconds']:.2f}s wall, "
+                    f"{record['cpu_seconds']:.2f}s cpu, {record['rows']} rows"
+                )
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation():
+    """Instrumentation the pipeline stages record to"""
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation):
+    """replace the Instrumentation the pipeline stages record to
+
+    Returns:
+        Instrumentation: the previous one
+    """
+    global _instrumentation
+    previous, _instrumentation = _instrumentation, instrumentation
+    return previous
+
+
+def stage(name, **labels):
+    """measure a stage with the current Instrumentation, see Instrumentation.stage"""
+    return get_instrumentation().stage(name, **labels)
+
+
+def instrumented(name, **labels):
+    """decorator measuring every call of a function as a stage"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, **labels):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def export_metrics(records, metrics_output=FILENAME_METRICS, prometheus_output=None):
+    """append stage records as JSON lines and write them for Prometheus
+
+    Args:
+        records (list): stage records
+        metrics_output (str, optional): JSON lines filename in RESULTS_FOLDER,
+        None to skip. Defaults to FILENAME_METRICS.
+        prometheus_output (str, optional): Prometheus text filename in
+        RESULTS_FOLDER, None to skip. Defaults to None.
+    """
+    if metrics_output is not None:
+        write_json_lines(records, metrics_output)
+    if prometheus_output is not None:
+        write_prometheus(records, prometheus_output)
+
+
+def write_json_lines(records, filename=FILENAME_METRICS):
+    test_and_create_folder(RESULTS_FOLDER)
+    with open(RESULTS_FOLDER + filename, "a") as file:
+        for record in records:
+            file.write(json.dumps(record, default=to_json) + "\n")
+
+
+def write_prometheus(records, filename):
+    # Written to a temporary file first, so that a scrape never reads half a file
+    test_and_create_folder(RESULTS_FOLDER)
+    path = RESULTS_FOLDER + filename
+    with open(path + ".tmp", "w") as file:
+        file.write(prometheus_text(records))
+    os.replace(path + ".tmp", path)
+
+
+def prometheus_text(records):
+    """Prometheus text exposition of the last record of every stage and labels
+
+    Returns:
+        str
+    """
+    latest = {}
+    for record in records:
+        labels = {"stage": record["stage"], **record["labels"]}
+        latest[tuple(sorted(labels.items()))] = (labels, record)
+
+    lines = []
+    for metric, help_text in PROMETHEUS_METRICS.items():
+        lines.append(f"# HELP erp_stage_{metric} {help_text}")
+        lines.append(f"# TYPE erp_stage_{metric} gauge")
+        for labels, record in latest.values():
+            if record.get(metric) is not None:
+                lines.append(
+                    f"erp_stage_{metric}{prometheus_labels(labels)} {record[metric]}"
+                )
+    lines.append("# HELP erp_stage_block_size Records in the blocks of the blocking")
+    lines.append("# TYPE erp_stage_block_size summary")
+    for labels, record in latest.values():
+        block_sizes = record.get("block_sizes")
+        if block_sizes is None:
+            continue
+        for quantile in BLOCK_SIZE_QUANTILES:
+            lines.append(
+                "erp_stage_block_size"
+                + prometheus_labels({**labels, "quantile": quantile})
+                + f" {block_sizes[f'p{round(quantile * 100)}']}"
+            )
+        lines.append(
+            f"erp_stage_block_size_sum{prometheus_labels(labels)} {block_sizes['sum']}"
+        )
+        lines.append(
+            f"erp_stage_block_size_count{prometheus_labels(labels)} "
+            f"{block_sizes['count']}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def block_size_summary(sizes):
+    """distribution of the block sizes of a blocking
+
+    Returns:
+        dict: count, sum, min, mean, quantiles and max of the sizes
+    """
+    sizes = np.asarray(sizes)
+    if len(sizes) == 0:
+        return {"count": 0, "sum": 0}
+    summary = {
+        "count": len(sizes),
+        "sum": int(sizes.sum()),
+        "min": int(sizes.min()),
+        "mean": float(sizes.mean()),
+    }
+    for quantile in BLOCK_SIZE_QUANTILES:
+        summary[f"p{round(quantile * 100)}"] = float(np.quantile(sizes, quantile))
+    summary["max"] = int(sizes.max())
+    return summary
+
+
+def cprofile_hook(folder=RESULTS_FOLDER + "profiles/"):
+    """hook writing a cProfile of every stage to folder/<stage>_<time>.prof"""
+
+    @contextmanager
+    def hook(name, labels):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            test_and_create_folder(folder)
+            profiler.dump_stats(profile_filename(folder, name, "prof"))
+
+    return hook
+
+
+def pyinstrument_hook(folder=RESULTS_FOLDER + "profiles/"):
+    """hook writing a pyinstrument profile of every stage to
+    folder/<stage>_<time>.html"""
+    if Profiler is None:
+        raise ImportError("pyinstrument is required by pyinstrument_hook")
+
+    @contextmanager
+    def hook(name, labels):
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            test_and_create_folder(folder)
+            with open(profile_filename(folder, name, "html"), "w") as file:
+                file.write(profiler.output_html())
+
+    return hook
+
+
+# ==================================================================================
+# ==============Functions basically never called externally=========================
+# ==================================================================================
+
+
+def cpu_time():
+    # CPU time of the process and of its finished child processes
+    times = os.times()
+    return process_time() + times.children_user + times.children_system
+
+
+def peak_rss():
+    """peak RSS of the process and of its largest finished child, in bytes,
+    None without the resource module
+
+    The peak only grows, so the peak of a stage includes the stages before it.
+    """
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def prometheus_labels(labels):
+    escaped = {
+        key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for key, value in labels.items()
+    }
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+
+def profile_filename(folder, name, extension):
+    return os.path.join(folder, f"{name}_{int(time() * 1000)}.{extension}")
+
+
+def to_json(value):
+    # numpy scalars in the records
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value)} is not JSON serializable")
@@ -1,19 +1,28 @@
 import logging
 import random
-from time import time
 import numpy as np
 import pandas as pd
+from erp.benchmark import SMALL_SCALE_FACTORS, plot_benchmark, run_benchmark
 from erp.dperp import ER_pipeline_dp
 from erp.matching import *
 from erp.clustering import clustering_basic, clustering
-from erp.preparing import prepare_data
+from erp.evaluation import PAPER_ID_COLUMNS, confusion_matrix, differences, pair_keys
+from erp.features import load_features
+from erp.instrumentation import (
+    FILENAME_METRICS,
+    block_size_summary,
+    export_metrics,
+    get_instrumentation,
+)
+from erp.perturbation import database_variants, perturb_database
+from erp.preparing import prepare_data, prepare_data_parallel
 from erp.utils import (
     FILENAME_DP_CLUSTERING,
     FILENAME_DP_LOCAL_DIFFERENCE,
     FILENAME_LOCAL_CLUSTERING,
     FILENAME_LOCAL_MATCHED_ENTITIES,
     FILENAME_DP_MATCHED_ENTITIES,
-    FILENAME_SCABILITY_TEST_RESULTS,
+    FILENAME_BENCHMARK_RESULTS,
     ORIGINAL_DATABASE_LOCALTIONS,
     RESULTS_FOLDER,
     test_and_create_folder,
@@ -21,11 +30,12 @@ from erp.utils import (
     DATABSE_COLUMNS,
     DATABASES_LOCATIONS,
     logging_delimiter,
+    read_database,
+    read_result,
 )
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 import string
-import matplotlib.pyplot as plt
 
 
 def ER_pipeline(
@@ -114,63 +124,150 @@ def ER_pipeline_local(
     Returns:
         dict: execution information
     """
-    # import database
-    df1 = pd.read_csv(dfilename1, sep=",", engine="python")
-    df2 = pd.read_csv(dfilename2, sep=",", engine="python")
-
-    df1["index"] = np.arange(len(df1))
-    df2["index"] = np.arange(len(df2)) + len(df1)
-
-    similarity_threshold = ERconfiguration["threshold"]
-    start_time = time()
-    result_df = blocking(df1, df2, ERconfiguration["blocking_method"])
-    result_df = matching(
-        result_df,
-        similarity_threshold,
-        ERconfiguration["matching_method"],
-        outputfile=matched_output,
+    instrumentation = get_instrumentation()
+    with instrumentation.run(
+        pipeline="local",
+        blocking_method=ERconfiguration["blocking_method"],
+        matching_method=ERconfiguration["matching_method"],
+        threshold=ERconfiguration["threshold"],
+    ) as records:
+        # import database
+        with instrumentation.stage("load") as metrics:
+            df1 = read_database(dfilename1)
+            df2 = read_database(dfilename2)
+
+            df1["index"] = np.arange(len(df1))
+            df2["index"] = np.arange(len(df2)) + len(df1)
+            features = (load_features(dfilename1, df1), load_features(dfilename2, df2))
+            metrics["rows"] = len(df1) + len(df2)
+
+        similarity_threshold = ERconfiguration["threshold"]
+        if ERconfiguration.get("parallel", False):
+            # Blocks are blocked and matched together in the workers
+            with instrumentation.stage("match") as metrics:
+                result_df = parallel_matching(
+                    df1,
+                    df2,
+                    ERconfiguration["blocking_method"],
+                    similarity_threshold,
+                    ERconfiguration["matching_method"],
+                    outputfile=matched_output,
+                    features=features,
+                    num_workers=ERconfiguration.get("num_workers"),
+                    memory_budget=ERconfiguration.get(
+                        "memory_budget", DEFAULT_MEMORY_BUDGET
+                    ),
+                )
+                metrics["rows"] = len(df1) + len(df2)
+                metrics["matched_pairs"] = len(result_df)
+        else:
+            # Candidate pairs are generated and scored in chunks of at most
+            # memory_budget bytes, None builds all of them at once
+            memory_budget = ERconfiguration.get("memory_budget", DEFAULT_MEMORY_BUDGET)
+            if memory_budget is not None:
+                # Lazy candidate pairs are only generated while they are
+                # matched, so blocking and matching are measured as one stage
+                with instrumentation.stage("block+match") as metrics:
+                    candidate_pairs = blocking(
+                        df1,
+                        df2,
+                        ERconfiguration["blocking_method"],
+                        features,
+                        memory_budget,
+                    )
+                    result_df = matching(
+                        candidate_pairs,
+                        similarity_threshold,
+                        ERconfiguration["matching_method"],
+                        outputfile=matched_output,
+                        features=features,
+                    )
+                    metrics["rows"] = len(candidate_pairs)
+                    metrics["candidate_pairs"] = len(candidate_pairs)
+                    metrics["matched_pairs"] = len(result_df)
+                    metrics["block_sizes"] = block_size_summary(
+                        candidate_pairs.block_sizes()
+                    )
+            else:
+                with instrumentation.stage("block") as metrics:
+                    candidate_pairs = blocking(
+                        df1, df2, ERconfiguration["blocking_method"], features, None
+                    )
+                    metrics["rows"] = len(df1) + len(df2)
+                    metrics["candidate_pairs"] = len(candidate_pairs)
+                with instrumentation.stage("match") as metrics:
+                    result_df = matching(
+                        candidate_pairs,
+                        similarity_threshold,
+                        ERconfiguration["matching_method"],
+                        outputfile=matched_output,
+                        features=features,
+                    )
+                    metrics["rows"] = len(candidate_pairs)
+                    metrics["matched_pairs"] = len(result_df)
+        c_df = []
+        if cluster:
+            with instrumentation.stage("cluster") as metrics:
+                metrics["rows"] = len(result_df)
+                c_df = clustering(
+                    result_df,
+                    df1,
+                    df2,
+                    ERconfiguration["clustering_method"],
+                    filename=cluster_output,
+                )
+
+        if baseline:
+            with instrumentation.stage("evaluate") as metrics:
+                baseline_df = calculate_baseline(
+                    df1,
+                    df2,
+                    baseline_config={
+                        "method": ERconfiguration["matching_method"],
+                        "threshold": ERconfiguration["threshold"],
+                    },
+                    features=features,
+                )
+                metrics["rows"] = len(baseline_df) + len(result_df)
+                out = resultToString(
+                    ERconfiguration,
+                    -1,
+                    -1,
+                    -1,
+                    baseline_df,
+                    matched_df=result_df,
+                    suffix="_local",
+                )
+    export_metrics(
+        records,
+        ERconfiguration.get("metrics_output", FILENAME_METRICS),
+        ERconfiguration.get("prometheus_output"),
     )
-    end_time = time()
-    matching_time = end_time - start_time
-    c_df = []
-    if cluster:
-        c_df = clustering(
-            result_df,
-            df1,
-            df2,
-            ERconfiguration["clustering_method"],
-            filename=cluster_output,
-        )
-    end_time = time()
-
     if baseline:
-        baseline_df = calculate_baseline(
-            df1,
-            df2,
-            baseline_config={
-                "method": ERconfiguration["matching_method"],
-                "threshold": ERconfiguration["threshold"],
-            },
-        )
-
-        return resultToString(
-            ERconfiguration,
-            -1,
-            -1,
-            -1,
-            baseline_df,
-            matched_df=result_df,
-            suffix="_local",
-        )
+        return out
+    stage_times = {record["stage"]: record["wall_seconds"] for record in records}
+    matching_time = sum(
+        stage_times.get(stage, 0) for stage in ["block", "match", "block+match"]
+    )
     return {
         "local rate": round(len(c_df) / (len(df1) + len(df2)), 4),
-        "local execution time": round((end_time - start_time) / 60, 2),
+        "local execution time": round(
+            (matching_time + stage_times.get("cluster", 0)) / 60, 2
+        ),
         "local execution time(matching+blocking)": round(matching_time / 60, 2),
     }
 
 
-def part1():
-    """pareparing and clean data from original database file"""
+def part1(parallel=False, max_workers=None):
+    """pareparing and clean data from original database file
+
+    Args:
+        parallel (bool, optional): parse all files concurrently in a process pool. Defaults to False.
+        max_workers (int, optional): number of processes. Defaults to the number of CPUs.
+    """
+    if parallel:
+        prepare_data_parallel(ORIGINAL_DATABASE_LOCALTIONS, max_workers)
+        return
     for data in ORIGINAL_DATABASE_LOCALTIONS:
         prepare_data(data)
 
@@ -182,24 +279,41 @@ def part2(thresholds=[0.5, 0.7]):
         thresholds (list, optional): _description_. Defaults to [0.5, 0.7].
     """
     # import database
-    df1 = pd.read_csv(DATABASES_LOCATIONS[0], sep=",", engine="python")
+    df1 = read_database(DATABASES_LOCATIONS[0])
     df1["index"] = np.arange(len(df1))
-    df2 = pd.read_csv(DATABASES_LOCATIONS[1], sep=",", engine="python")
+    df2 = read_database(DATABASES_LOCATIONS[1])
     df2["index"] = np.arange(len(df2)) + len(df1)
-    # Run all blocking methods for each baseline and record results
+    # Feature extraction is cached next to the databases for the next runs
+    features = (
+        load_features(DATABASES_LOCATIONS[0], df1),
+        load_features(DATABASES_LOCATIONS[1], df2),
+    )
+    # Run all blocking methods for each baseline and record results, scoring
+    # every pair once for all thresholds
     run_all_blocking_matching_methods(
-        df1, df2, thresholds, MATCHING_METHODS, BLOCKING_METHODS
+        df1,
+        df2,
+        thresholds,
+        MATCHING_METHODS,
+        BLOCKING_METHODS,
+        features=features,
+        sweep=True,
     )
 
 
-def part3():
-    """compare local and dp ERpipeline and scability tests"""
-    logging_delimiter(str="scability test")
-    scability_test()
-    logging.info(
-        f"scability test result is stored in {FILENAME_SCABILITY_TEST_RESULTS}"
-    )
-    logging.info("scability test figure is stored in results/scability.png")
+def part3(scale_factors=SMALL_SCALE_FACTORS):
+    """compare local and dp ERpipeline and benchmark them
+
+    Args:
+        scale_factors (list, optional): numbers of records of the synthetic
+        databases of the benchmark, up to SCALE_FACTORS. Defaults to
+        SMALL_SCALE_FACTORS.
+    """
+    logging_delimiter(str="benchmark")
+    results = run_benchmark(scale_factors)
+    plot_benchmark(results)
+    logging.info(f"benchmark result is stored in {FILENAME_BENCHMARK_RESULTS}")
+    logging.info("benchmark figure is stored in results/benchmark.png")
     logging_delimiter(str="comparing local and dp ERpipeline")
     naive_DPvsLocal(
         FILENAME_DP_MATCHED_ENTITIES, FILENAME_LOCAL_MATCHED_ENTITIES
@@ -226,116 +340,79 @@ def add_random_characters_to_string(str, number):
 DATABASE_CHANGES_CHOICE = ["year", "author", "title"]
 
 
-def databaseWithMinimalChanges(filename, option="title", num=3):
-    """minimal modification to database
+def minimal_changes(option="title", num=3):
+    """keyword arguments of perturb_database of a minimal modification
 
     Args:
-        database (_type_): _description_
         option (str, optional): "year"|"author"|"title".
         num (int): number of changes
     """
-    database = pd.read_csv(filename)
     if option == "author":
-        database[DATABSE_COLUMNS[2]] = database.apply(
-            lambda x: add_random_characters_to_string(str(x[DATABSE_COLUMNS[2]]), num),
-            axis=1,
-        )
+        return {"author_typos": num}
     elif option == "title":
-        database[DATABSE_COLUMNS[1]] = database.apply(
-            lambda x: add_random_characters_to_string(str(x[DATABSE_COLUMNS[1]]), num),
-            axis=1,
-        )
+        return {"title_typos": num}
     elif option == "year":
-        database[DATABSE_COLUMNS[-1]] += random.randint(-int(num / 2), -int(num / 2))
-    return database
+        return {"year_shift": max(int(num / 2), 1)}
+    raise ValueError(f"{option} is not one of {DATABASE_CHANGES_CHOICE}")
 
 
-def create_databaseWithChanges(L_filename, num=3, cnum=3):
-    L_datanames = []
-    for filename in L_filename:
-        for i in range(num):
-            option = DATABASE_CHANGES_CHOICE[i % len(DATABASE_CHANGES_CHOICE)]
-            df = databaseWithMinimalChanges(filename, option, cnum)
-            new_filename = filename[5:-4] + "_" + option[:4] + str(cnum) + ".csv"
-            new_folder = filename[:-4]
-            test_and_create_folder(new_folder)
-            df.to_csv(new_folder + "/" + new_filename)
-            L_datanames.append(new_folder + "/" + new_filename)
-    return L_datanames
-
-
-def plot_scability_figures(results):
-    # Assuming results is a DataFrame or a dictionary containing the required data
-    # results = {"d1-d2": [...], "dp execution time": [...], "local execution time": [...]}
-
-    # Convert "d1-d2" values to strings
-    results["d1-d2"] = [str(i) for i in results["d1-d2"]]
-
-    # Set the width of the bars
-    bar_width = 0.35
-
-    # Create an array of indices for the first set of bars
-    indices = np.arange(len(results["d1-d2"]))
-
-    # Plot the first set of bars
-    plt.figure(figsize=(10, 4), dpi=100)
-    plt.bar(
-        indices,
-        results["dp execution time"],
-        label="dp execution time",
-        alpha=0.6,
-        width=bar_width,
-    )
-
-    # Shift the indices for the second set of bars
-    indices_shifted = indices + bar_width
+def databaseWithMinimalChanges(database, option="title", num=3, seed=0):
+    """minimal modification to database
 
-    # Plot the second set of bars
-    plt.bar(
-        indices_shifted,
-        results["local execution time"],
-        label="local execution time",
-        alpha=0.6,
-        width=bar_width,
-    )
+    Args:
+        database (str|DataFrame): database or database filename
+        option (str, optional): "year"|"author"|"title".
+        num (int): number of changes
+        seed (int, optional): Defaults to 0.
+    """
+    if isinstance(database, str):
+        database = read_database(database)
+    return perturb_database(database, seed, **minimal_changes(option, num))
 
-    plt.xlabel("replication factor")
-    plt.ylabel("execution time(min)")
-    plt.title("Resulting Execution Time")
-    plt.xticks(indices + bar_width / 2, results["d1-d2"], fontsize=7)
-    plt.legend(loc="upper right")
-    plt.savefig(RESULTS_FOLDER + "scability.png")
 
+def create_databaseWithChanges(L_filename, num=3, cnum=3, seed=0, persist=True):
+    """variants of databases with minimal changes, generated in memory
 
-def scability_test(
-    ERconfiguration=DEFAULT_ER_CONFIGURATION,
-    num_duplicates=3,
-    num_changes=4,
-    output=FILENAME_SCABILITY_TEST_RESULTS,
-):
-    L_filenames = create_databaseWithChanges(
-        DATABASES_LOCATIONS, num_duplicates, num_changes
-    )
-    D = [(d1, d2) for d1 in L_filenames[:3] for d2 in L_filenames[3:]]
-    results = []
+    Every database is read once. Variant i of a database has the changes
+    DATABASE_CHANGES_CHOICE[i % 3], and is reproducible from the seed.
 
-    for d1, d2 in D:
-        result = ER_pipeline(d1, d2, ERconfiguration, baseline=False, cluster=False)
-        result["d1-d2"] = (d1[-9:-4], d2[-9:-4])
-        result2 = ER_pipeline(d1, d2, ERconfiguration, baseline=False, cluster=False, isdp=True)
-        results.append({**result2, **result})
-    results = pd.DataFrame(results)
-    save_result(results, output)
-    plot_scability_figures(results)
+    Args:
+        L_filename (list): database filenames
+        num (int, optional): number of variants of every database. Defaults to 3.
+        cnum (int, optional): number of changes. Defaults to 3.
+        seed (int, optional): Defaults to 0.
+        persist (bool, optional): also write the variants in a folder next to
+        their database. Defaults to True.
+
+    Yields:
+        (str, DataFrame): filename and variant
+    """
+    for i, filename in enumerate(L_filename):
+        options = [
+            DATABASE_CHANGES_CHOICE[j % len(DATABASE_CHANGES_CHOICE)]
+            for j in range(num)
+        ]
+        variants = database_variants(
+            read_database(filename),
+            [minimal_changes(option, cnum) for option in options],
+            seed=(seed, i),
+        )
+        for option, df in zip(options, variants):
+            new_filename = filename[5:-4] + "_" + option[:4] + str(cnum) + ".csv"
+            new_folder = filename[:-4]
+            if persist:
+                test_and_create_folder(new_folder)
+                df.to_csv(new_folder + "/" + new_filename)
+            yield new_folder + "/" + new_filename, df
 
 
 def compareTwoDatabase(
     df1, df2, name_df1="df1", name_df2="df2", item_name="matched pairs"
 ):
-    tp, fn, fp, precision, recall, f1 = calculate_confusion_matrix(df1, df2)
-    merged = pd.merge(df1, df2, how="outer", indicator=True)
-    differences = merged[merged["_merge"] != "both"]
-    differences.to_csv(
+    # Records are identified by paper ID, the indexes of two pipelines differ
+    keys_df1, keys_df2 = pair_keys(df1, df2, columns=PAPER_ID_COLUMNS)
+    tp, fn, fp, precision, recall, f1 = confusion_matrix(keys_df1, keys_df2)
+    differences(df1, df2, keys_df1, keys_df2).to_csv(
         RESULTS_FOLDER
         + FILENAME_DP_LOCAL_DIFFERENCE[:-4]
         + "_"
@@ -371,6 +448,6 @@ def naive_DPvsLocal(fdp, flocal):
         matched_output=flocal,
         cluster=False,
     )
-    df_dp = pd.read_csv(RESULTS_FOLDER + fdp)
-    df_local = pd.read_csv(RESULTS_FOLDER + flocal)
+    df_dp = read_result(fdp)
+    df_local = read_result(flocal)
     compareTwoDatabase(df_dp, df_local, name_df1="DP ERP", name_df2="local ERP")
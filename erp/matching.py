@@ -1,12 +1,22 @@
+import heapq
 import logging
-from time import time
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from erp.evaluation import confusion_matrix, pair_keys
+from erp.features import FeatureStore, features_from_pairs, shared_matrix
+from erp.indexing import BlockIndex, array_keys, set_keys, similarity_join
+from erp.instrumentation import export_metrics, get_instrumentation
 from erp.utils import (
     DEFAULT_ER_CONFIGURATION,
     FILENAME_ALL_METHODS_RESULTS,
     baseline_filename,
+    create_blocked_product,
     create_cartesian_product,
+    create_pairs,
     jaccard_similarity,
+    jaccard_similarity_batch,
     matched_entities_filename,
     save_result,
     trigram_similarity,logging_delimiter
@@ -28,8 +38,35 @@ BLOCKING_METHODS = {
 
 MATCHING_METHODS = {"Jaccard", "Combined"}
 
+# Blocking methods partitioned by the blocks of another method in parallel_matching
+PARTITION_KEYS = {"commonAndNumAuthors": "commonAuthors"}
 
-def blocking(df1, df2, blocking_method=DEFAULT_ER_CONFIGURATION["blocking_method"]):
+# Blocking methods dropping the pairs with a record without a title
+TITLE_BLOCKING_METHODS = {
+    "Year",
+    "TwoYear",
+    "FirstLetterTitle",
+    "LastLetterTitle",
+    "FirstOrLastLetterTitle",
+    "numAuthors",
+    "commonAndNumAuthors",
+}
+
+# Memory of the candidate pairs generated and scored at once, in bytes
+DEFAULT_MEMORY_BUDGET = 1 << 30
+# Peak memory of a candidate pair of a chunk, dominated by the rows of the
+# author trigram matrix sliced by "Combined" (about 1.3KB a pair, traced on the
+# ACM and DBLP databases)
+BYTES_PER_CANDIDATE_PAIR = 1536
+
+
+def blocking(
+    df1,
+    df2,
+    blocking_method=DEFAULT_ER_CONFIGURATION["blocking_method"],
+    features=None,
+    memory_budget=None,
+):
     """blocking non-dp
 
     Args:
@@ -39,12 +76,18 @@ def blocking(df1, df2, blocking_method=DEFAULT_ER_CONFIGURATION["blocking_method
         {Year”,“TwoYear”,“FirstLetterTitle”,“LastLetterTitle”,“FirstOrLastLetterTitle”,
         “numAuthors”,“authorLastName”,“commonAuthors”,“commonAndNumAuthors”}.
         Defaults to DEFAULT_ER_CONFIGURATION["blocking_method"].
+        features (tuple, optional): FeatureStore of both databases. Defaults to None.
+        memory_budget (int, optional): bytes of the candidate pairs generated at
+        once, the pairs are then generated lazily in chunks. Defaults to None,
+        all pairs are built as a DataFrame.
 
     Returns:
-        DataFrame
+        DataFrame|CandidatePairs
     """
+    if memory_budget is not None:
+        return CandidatePairs(df1, df2, blocking_method, features, memory_budget)
     blocking_function = globals()[f"create_{blocking_method}Blocking"]
-    return blocking_function(df1, df2)
+    return blocking_function(df1, df2, features)
 
 
 def matching(
@@ -52,27 +95,48 @@ def matching(
     similarity_threshold=DEFAULT_ER_CONFIGURATION["threshold"],
     matching_method=DEFAULT_ER_CONFIGURATION["matching_method"],
     outputfile=None,
+    features=None,
 ):
     """Matching non-dp
 
     Args:
-        pairs (DataFrame): cross product of databases after blocking
+        pairs (DataFrame|CandidatePairs): cross product of databases after
+        blocking, CandidatePairs are scored chunk by chunk and only the matched
+        pairs are built as a DataFrame
         threshold (float, optional): Defaults to DEFAULT_ER_CONFIGURATION["threshold"].
         matching_method (str, optional): Defaults to DEFAULT_ER_CONFIGURATION["matching method"],
         output (str, optional): Defaults to FILENAME_DP_MATCHED_ENTITIES.
+        features (tuple, optional): FeatureStore of both databases, used when the
+        pairs carry the "index" of their records. Defaults to None.
 
     Returns:
         DataFrame
     """
+    if isinstance(blocking_results, CandidatePairs):
+        result_df = match_candidate_pairs(
+            blocking_results, similarity_threshold, matching_method, features
+        )
+        if outputfile != None:
+            save_result(result_df, outputfile)
+        return result_df
+
     result_df = blocking_results.copy()
+    if (features is None) or not {"index_df1", "index_df2"}.issubset(result_df):
+        features_df1, features_df2, positions_df1, positions_df2 = features_from_pairs(
+            result_df
+        )
+    else:
+        features_df1, features_df2 = features
+        positions_df1 = features_df1.positions(result_df["index_df1"])
+        positions_df2 = features_df2.positions(result_df["index_df2"])
     # Calculate similarity based on the specified matching method
     if matching_method == "Jaccard":
-        result_df["similarity_score"] = result_df.apply(
-            calculate_jaccard_similarity, axis=1
+        result_df["similarity_score"] = calculate_jaccard_similarity_batch(
+            features_df1, features_df2, positions_df1, positions_df2
         )
     elif matching_method == "Combined":
-        result_df["similarity_score"] = result_df.apply(
-            calculate_combined_similarity, axis=1
+        result_df["similarity_score"] = calculate_combined_similarity_batch(
+            features_df1, features_df2, positions_df1, positions_df2
         )
 
     # Keep rows where similarity is above the threshold
@@ -83,10 +147,352 @@ def matching(
     return result_df
 
 
+def parallel_matching(
+    df1,
+    df2,
+    blocking_method=DEFAULT_ER_CONFIGURATION["blocking_method"],
+    similarity_threshold=DEFAULT_ER_CONFIGURATION["threshold"],
+    matching_method=DEFAULT_ER_CONFIGURATION["matching_method"],
+    outputfile=None,
+    features=None,
+    num_workers=None,
+    memory_budget=None,
+):
+    """Blocking and matching non-dp in a process pool
+
+    Blocks are grouped into partitions of similar numbers of candidate pairs.
+    Every partition is blocked, scored and thresholded in a worker and only
+    the matches come back, in the same order as the sequential pipeline.
+
+    Args:
+        df1 (DataFrame): database1
+        df2 (DataFrame): database2
+        blocking_method (str, optional): Defaults to DEFAULT_ER_CONFIGURATION["blocking_method"].
+        similarity_threshold (float, optional): Defaults to DEFAULT_ER_CONFIGURATION["threshold"].
+        matching_method (str, optional): Defaults to DEFAULT_ER_CONFIGURATION["matching method"],
+        outputfile (str, optional): Defaults to None.
+        features (tuple, optional): FeatureStore of both databases. Defaults to None.
+        num_workers (int, optional): number of processes. Defaults to the number of CPUs.
+        memory_budget (int, optional): bytes of the candidate pairs generated at
+        once by all the workers, shared evenly, see blocking. Defaults to None.
+
+    Returns:
+        DataFrame
+    """
+    num_workers = num_workers or os.cpu_count()
+    partitions = partition_blocks(df1, df2, blocking_method, 4 * num_workers, features)
+    # Keep track of the records across partitions to merge the matches
+    df1 = df1.assign(**{"record position": np.arange(len(df1))})
+    df2 = df2.assign(**{"record position": np.arange(len(df2))})
+    arguments = (
+        blocking_method,
+        similarity_threshold,
+        matching_method,
+        None if memory_budget is None else memory_budget // num_workers,
+    )
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                match_partition,
+                df1.iloc[positions_df1],
+                df2.iloc[positions_df2],
+                *arguments,
+            )
+            for positions_df1, positions_df2 in partitions
+        ]
+        matches = [future.result() for future in futures]
+    if len(matches) == 0:
+        matches = [match_partition(df1.iloc[:0], df2.iloc[:0], *arguments)]
+
+    # A pair of records sharing several blocks can be matched in several partitions
+    result_df = pd.concat(matches, ignore_index=True)
+    result_df = result_df.drop_duplicates(
+        ["record position_df1", "record position_df2"]
+    )
+    result_df = result_df.sort_values(["record position_df1", "record position_df2"])
+    result_df = result_df.drop(["record position_df1", "record position_df2"], axis=1)
+    result_df = result_df.reset_index(drop=True)
+    if outputfile != None:
+        save_result(result_df, outputfile)
+    return result_df
+
+
+def blocking_keys(df1, df2, blocking_method, features=None):
+    """block keys of both databases
+
+    Records of df1 and df2 sharing at least one key are the candidate pairs of
+    the blocking method, so blocks are joined instead of filtering the
+    cartesian product.
+
+    Args:
+        df1 (DataFrame): database1
+        df2 (DataFrame): database2
+        blocking_method (str): key based method of BLOCKING_METHODS
+        features (tuple, optional): FeatureStore of both databases. Defaults to None.
+
+    Returns:
+        (BlockKeys, BlockKeys)
+    """
+    features_df1, features_df2 = features or (FeatureStore(df1), FeatureStore(df2))
+    if blocking_method == "Year":
+        return array_keys(features_df1["year"]), array_keys(features_df2["year"])
+    elif blocking_method == "TwoYear":
+        # year_df2 - 1 == year_df1 or year_df2 == year_df1
+        year = features_df2["year"]
+        return array_keys(features_df1["year"]), array_keys(year, year - 1)
+    elif blocking_method == "FirstLetterTitle":
+        return (
+            array_keys(features_df1["first_letter"]),
+            array_keys(features_df2["first_letter"]),
+        )
+    elif blocking_method == "LastLetterTitle":
+        return (
+            array_keys(features_df1["last_letter"]),
+            array_keys(features_df2["last_letter"]),
+        )
+    elif blocking_method == "FirstOrLastLetterTitle":
+        # "^" and "$" keep the first letter and last letter blocks apart
+        return tuple(
+            array_keys(
+                np.where(first != "", np.char.add("^", first), ""),
+                np.where(last != "", np.char.add(last, "$"), ""),
+            )
+            for first, last in (
+                (features_df1["first_letter"], features_df1["last_letter"]),
+                (features_df2["first_letter"], features_df2["last_letter"]),
+            )
+        )
+    elif blocking_method == "numAuthors":
+        # |num_authors_df1 - num_authors_df2| <= 1
+        num_authors = features_df1["num_authors"]
+        return (
+            array_keys(num_authors - 1, num_authors, num_authors + 1),
+            array_keys(features_df2["num_authors"]),
+        )
+    elif blocking_method == "commonAuthors":
+        return tuple(
+            set_keys(features.indptr("author_names"), features.values("author_names"))
+            for features in (features_df1, features_df2)
+        )
+    elif blocking_method == "authorLastName":
+        # Records without any last name only match each other
+        return tuple(
+            set_keys(features.indptr("last_names"), features.values("last_names"), " ")
+            for features in (features_df1, features_df2)
+        )
+    raise ValueError(f"{blocking_method} is not a key based blocking method")
+
+
+def block_sizes(df1, df2, blocking_method, features=None):
+    """records of both databases in every block shared by both databases
+
+    "commonAndNumAuthors" filters the pairs of the "commonAuthors" blocks, so
+    it has the same blocks.
+
+    Returns:
+        ndarray
+    """
+    return CandidatePairs(df1, df2, blocking_method, features).block_sizes()
+
+
+class CandidatePairs:
+    """Candidate pairs of a blocking method, generated lazily in chunks.
+
+    A chunk holds the pairs of a range of records of df1 as positions of
+    records, with at most the pairs fitting in the memory budget, so that the
+    pairs are never all in memory. Every iteration generates the pairs again.
+    """
+
+    def __init__(
+        self,
+        df1,
+        df2,
+        blocking_method,
+        features=None,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+    ):
+        """
+        Args:
+            df1 (DataFrame): database1
+            df2 (DataFrame): database2
+            blocking_method (str): method of BLOCKING_METHODS
+            features (tuple, optional): FeatureStore of both databases. Defaults to None.
+            memory_budget (int, optional): bytes of the candidate pairs of a
+            chunk. Defaults to DEFAULT_MEMORY_BUDGET.
+        """
+        self.df1 = df1
+        self.df2 = df2
+        self.blocking_method = blocking_method
+        self.features = features or (FeatureStore(df1), FeatureStore(df2))
+        self.max_pairs = max(int(memory_budget // BYTES_PER_CANDIDATE_PAIR), 1)
+        keys_method = PARTITION_KEYS.get(blocking_method, blocking_method)
+        self.keys_df1, keys_df2 = blocking_keys(df1, df2, keys_method, self.features)
+        self.block_index = BlockIndex(keys_df2)
+        # Counted by the first complete iteration
+        self.num_pairs = None
+
+    def __iter__(self):
+        """
+        Yields:
+            (ndarray, ndarray): positions of the records of df1 and df2 of the
+            pairs of a chunk, in the order of the pairs of blocking()
+        """
+        features_df1, features_df2 = self.features
+        if self.blocking_method in TITLE_BLOCKING_METHODS:
+            untitled_df1 = self.df1["paper title"].isna().to_numpy()
+            untitled_df2 = self.df2["paper title"].isna().to_numpy()
+        num_pairs = 0
+        for positions_df1, positions_df2 in self.block_index.candidate_pair_chunks(
+            self.keys_df1, self.max_pairs
+        ):
+            if self.blocking_method == "commonAndNumAuthors":
+                keep = (
+                    np.abs(
+                        features_df1["num_authors"][positions_df1]
+                        - features_df2["num_authors"][positions_df2]
+                    )
+                    <= 2
+                )
+                positions_df1, positions_df2 = positions_df1[keep], positions_df2[keep]
+            if self.blocking_method in TITLE_BLOCKING_METHODS:
+                keep = ~(untitled_df1[positions_df1] | untitled_df2[positions_df2])
+                positions_df1, positions_df2 = positions_df1[keep], positions_df2[keep]
+            num_pairs += len(positions_df1)
+            yield positions_df1, positions_df2
+        self.num_pairs = num_pairs
+
+    def block_sizes(self):
+        """records of both databases in every block shared by both databases,
+        from the block index of the candidate pairs
+
+        Returns:
+            ndarray
+        """
+        codes_df1 = self.block_index.lookup(self.keys_df1.values)
+        block_sizes_df1 = np.bincount(
+            codes_df1[codes_df1 >= 0], minlength=len(self.block_index)
+        )
+        shared = block_sizes_df1 > 0
+        return block_sizes_df1[shared] + self.block_index.block_sizes()[shared]
+
+    def max_num_pairs(self):
+        """number of candidate pairs before deduplication and filtering, an
+        upper bound counted without generating them"""
+        return int(self.block_index.count_candidates(self.keys_df1).sum())
+
+    def __len__(self):
+        if self.num_pairs is None:
+            for _ in self:
+                pass
+        return self.num_pairs
+
+    def frame(self, positions_df1, positions_df2):
+        """pairs of records at the given positions, with the columns of blocking()
+
+        Returns:
+            DataFrame
+        """
+        result_df = create_pairs(self.df1, self.df2, positions_df1, positions_df2)
+        if self.blocking_method == "Year":
+            result_df = result_df.drop(["year of publication_df1"], axis=1).rename(
+                columns={"year of publication_df2": "year of publication"}
+            )
+        return result_df
+
+
 #==================================================================================
 #==============Functions basically never called externally=========================
 #==================================================================================
 
+def partition_blocks(df1, df2, blocking_method, num_partitions, features=None):
+    """group the blocks of a blocking method into partitions
+
+    Blocks are assigned, largest first, to the partition with the fewest
+    candidate pairs so far.
+
+    Returns:
+        list: positions of the records of df1 and df2 in every partition
+    """
+    keys_df1, keys_df2 = blocking_keys(
+        df1, df2, PARTITION_KEYS.get(blocking_method, blocking_method), features
+    )
+    block_index = BlockIndex(keys_df2)
+    codes_df1 = block_index.lookup(keys_df1.values)
+    positions_df1 = keys_df1.positions[codes_df1 >= 0]
+    codes_df1 = codes_df1[codes_df1 >= 0]
+    block_sizes_df1 = np.bincount(codes_df1, minlength=len(block_index))
+    pairs = block_sizes_df1 * block_index.block_sizes()
+
+    partition_of_block = np.zeros(len(block_index), dtype=np.int64)
+    heap = [(0, partition) for partition in range(num_partitions)]
+    for block in np.argsort(-pairs, kind="stable"):
+        if pairs[block] == 0:
+            break
+        num_pairs, partition = heapq.heappop(heap)
+        partition_of_block[block] = partition
+        heapq.heappush(heap, (num_pairs + int(pairs[block]), partition))
+
+    partitions = []
+    postings_blocks = np.repeat(np.arange(len(block_index)), block_index.block_sizes())
+    for partition in range(num_partitions):
+        in_partition = partition_of_block == partition
+        in_partition[pairs == 0] = False
+        if in_partition.any():
+            partitions.append(
+                (
+                    np.unique(positions_df1[in_partition[codes_df1]]),
+                    np.unique(block_index.postings[in_partition[postings_blocks]]),
+                )
+            )
+    return partitions
+
+
+def match_candidate_pairs(
+    candidate_pairs, similarity_threshold, matching_method, features=None
+):
+    """score CandidatePairs chunk by chunk, only the matched pairs are kept
+
+    Returns:
+        DataFrame: the matched pairs, with their "similarity_score"
+    """
+    features_df1, features_df2 = features or candidate_pairs.features
+    matrices = similarity_matrices(features_df1, features_df2, matching_method)
+    matches = [(np.zeros(0, dtype=np.int64),) * 2 + (np.zeros(0),)]
+    for positions_df1, positions_df2 in candidate_pairs:
+        if matching_method == "Jaccard":
+            similarity = calculate_jaccard_similarity_batch(
+                features_df1, features_df2, positions_df1, positions_df2, matrices
+            )
+        elif matching_method == "Combined":
+            similarity = calculate_combined_similarity_batch(
+                features_df1, features_df2, positions_df1, positions_df2, matrices
+            )
+        keep = similarity > similarity_threshold
+        matches.append((positions_df1[keep], positions_df2[keep], similarity[keep]))
+    positions_df1, positions_df2, similarity = (
+        np.concatenate(arrays) for arrays in zip(*matches)
+    )
+    result_df = candidate_pairs.frame(positions_df1, positions_df2)
+    result_df["similarity_score"] = similarity
+    return result_df
+
+
+def similarity_matrices(features_df1, features_df2, matching_method):
+    # Shared matrices of the features scored by a matching method, built once
+    names = ["title_tokens"]
+    if matching_method == "Combined":
+        names.append("author_trigrams")
+    return {name: shared_matrix(features_df1, features_df2, name) for name in names}
+
+
+def match_partition(
+    df1, df2, blocking_method, similarity_threshold, matching_method, memory_budget
+):
+    # Runs in a worker of parallel_matching
+    result_df = blocking(df1, df2, blocking_method, memory_budget=memory_budget)
+    return matching(result_df, similarity_threshold, matching_method)
+
+
 # Define a function to calculate Jaccard similarity
 def calculate_jaccard_similarity(row: pd.ArrowDtype):
     # Convert the values to sets and calculate Jaccard similarity
@@ -99,6 +505,43 @@ def calculate_jaccard_similarity(row: pd.ArrowDtype):
     return value / len(L)
 
 
+def calculate_jaccard_similarity_batch(
+    features_df1, features_df2, positions_df1, positions_df2, matrices=None
+):
+    # Score all pairs with array operations on the title tokens of both databases
+    if matrices is None:
+        matrices = similarity_matrices(features_df1, features_df2, "Jaccard")
+    title_matrix = matrices["title_tokens"]
+    return jaccard_similarity_batch(
+        title_matrix, positions_df1, positions_df2 + len(features_df1)
+    )
+
+
+def calculate_combined_similarity_batch(
+    features_df1, features_df2, positions_df1, positions_df2, matrices=None
+):
+    # Vectorized calculate_combined_similarity on the author trigrams of both databases
+    if matrices is None:
+        matrices = similarity_matrices(features_df1, features_df2, "Combined")
+    combined_similarity = calculate_jaccard_similarity_batch(
+        features_df1, features_df2, positions_df1, positions_df2, matrices
+    )
+    has_authors = (
+        features_df1["has_authors"][positions_df1]
+        & features_df2["has_authors"][positions_df2]
+    )
+    trigram_matrix = matrices["author_trigrams"]
+    trigram_similarity_author = jaccard_similarity_batch(
+        trigram_matrix,
+        positions_df1[has_authors],
+        positions_df2[has_authors] + len(features_df1),
+    )
+    combined_similarity[has_authors] = (
+        0.7 * combined_similarity[has_authors] + 0.3 * trigram_similarity_author
+    )
+    return combined_similarity
+
+
 # Function to calculate combined similarity (modify weights as needed)
 def calculate_combined_similarity(row: pd.ArrowDtype):
     title_set1 = set(row["paper title_df1"].split())
@@ -121,42 +564,16 @@ def calculate_combined_similarity(row: pd.ArrowDtype):
     return combined_similarity
 
 
-def authorLastName(df):
-    last_names_column = []
-    for author_names_list in [str(names).split(", ") for names in df["author names"]]:
-        if len(author_names_list) == 0:
-            last_names_column.append(set())
-        else:
-            last_names_column.append(
-                {name.split(" ")[-1] for name in author_names_list if len(name) > 0}
-            )
-    return last_names_column
-
-
-def create_authorLastNameBlocking(df1, df2):
-    df1["last name list"] = authorLastName(df1)
-    df2["last name list"] = authorLastName(df2)
-    result_df = create_cartesian_product(df1, df2)
-
-    def filter_function(l1, l2):
-        return (len(l1.intersection(l2)) != 0) or ((len(l1) == 0) and (len(l2) == 0))
-
-    result_df = result_df[
-        result_df.apply(
-            lambda x: filter_function(x["last name list_df1"], x["last name list_df2"]),
-            axis=1,
-        )
-    ]
-    return result_df
-
+def create_authorLastNameBlocking(df1, df2, features=None):
+    return create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "authorLastName", features)
+    )
 
-def create_YearBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
 
-    # Filter rows based on the 'year of publication' column
-    result_df = result_df[
-        result_df["year of publication_df1"] == result_df["year of publication_df2"]
-    ]
+def create_YearBlocking(df1, df2, features=None):
+    result_df = create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "Year", features)
+    )
 
     # Optionally, drop duplicate columns and reset the index
     result_df = result_df.drop(["year of publication_df1"], axis=1).reset_index(
@@ -174,20 +591,10 @@ def create_YearBlocking(df1, df2):
 
 
 # Function to run a blocking and matching method
-def create_TwoYearBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
-
-    # Filter rows based on the two-year range
-    result_df = result_df[
-        (
-            result_df["year of publication_df2"] - 1
-            == result_df["year of publication_df1"]
-        )
-        | (result_df["year of publication_df2"] == result_df["year of publication_df1"])
-    ]
-
-    # Optionally, reset the index
-    result_df = result_df.reset_index(drop=True)
+def create_TwoYearBlocking(df1, df2, features=None):
+    result_df = create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "TwoYear", features)
+    )
 
     # Drop rows with NaN values in text columns
     result_df = result_df.dropna(subset=["paper title_df1", "paper title_df2"])
@@ -195,33 +602,20 @@ def create_TwoYearBlocking(df1, df2):
 
 
 # Function for blocking by first letter of title
-def create_FirstLetterTitleBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
-
-    # Filter rows based on the starting letter of the paper title
-    result_df = result_df[
-        result_df["paper title_df1"].str[0] == result_df["paper title_df2"].str[0]
-    ]
-
-    # Optionally, reset the index
-    result_df = result_df.reset_index(drop=True)
+def create_FirstLetterTitleBlocking(df1, df2, features=None):
+    result_df = create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "FirstLetterTitle", features)
+    )
 
     # Drop rows with NaN values in text columns
     result_df = result_df.dropna(subset=["paper title_df1", "paper title_df2"])
     return result_df
 
 
-def create_FirstOrLastLetterTitleBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
-
-    # Filter rows based on the starting letter of the paper title
-    result_df = result_df[
-        (result_df["paper title_df1"].str[0] == result_df["paper title_df2"].str[0])
-        | (result_df["paper title_df1"].str[-1] == result_df["paper title_df2"].str[-1])
-    ]
-
-    # Optionally, reset the index
-    result_df = result_df.reset_index(drop=True)
+def create_FirstOrLastLetterTitleBlocking(df1, df2, features=None):
+    result_df = create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "FirstOrLastLetterTitle", features)
+    )
 
     # Drop rows with NaN values in text columns
     result_df = result_df.dropna(subset=["paper title_df1", "paper title_df2"])
@@ -229,82 +623,45 @@ def create_FirstOrLastLetterTitleBlocking(df1, df2):
 
 
 # Function for blocking by last letter of title
-def create_LastLetterTitleBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
-
-    # Filter rows based on the starting letter of the paper title
-    result_df = result_df[
-        result_df["paper title_df1"].str[-1] == result_df["paper title_df2"].str[-1]
-    ]
-
-    # Optionally, reset the index
-    result_df = result_df.reset_index(drop=True)
+def create_LastLetterTitleBlocking(df1, df2, features=None):
+    result_df = create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "LastLetterTitle", features)
+    )
 
     # Drop rows with NaN values in text columns
     result_df = result_df.dropna(subset=["paper title_df1", "paper title_df2"])
     return result_df
 
 
-def create_commonAndNumAuthorsBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
-
-    # Filter rows based on co-authorship (common authors)
-    result_df["common_authors"] = result_df.apply(
-        lambda row: set(str(row["author names_df1"]).split(", ")).intersection(
-            set(str(row["author names_df2"]).split(", "))
-        ),
-        axis=1,
+def create_commonAndNumAuthorsBlocking(df1, df2, features=None):
+    features_df1, features_df2 = features or (FeatureStore(df1), FeatureStore(df2))
+    # Walk the posting lists of the author index (co-authorship)
+    keys_df1, keys_df2 = blocking_keys(
+        df1, df2, "commonAuthors", (features_df1, features_df2)
     )
-    result_df = result_df[result_df["common_authors"].apply(len) > 0]
+    positions_df1, positions_df2 = BlockIndex(keys_df2).candidate_pairs(keys_df1)
 
     # Filter pairs based on the difference in the number of authors
-    result_df["num_authors_df1"] = result_df["author names_df1"].apply(
-        lambda x: len(str(x).split(", "))
-    )
-    result_df["num_authors_df2"] = result_df["author names_df2"].apply(
-        lambda x: len(str(x).split(", "))
-    )
-    result_df = result_df[
-        abs(result_df["num_authors_df1"] - result_df["num_authors_df2"]) <= 2
-    ]
-
-    # Optionally, reset the index
-    result_df = result_df.reset_index(drop=True)
+    num_authors_df1 = features_df1["num_authors"][positions_df1]
+    num_authors_df2 = features_df2["num_authors"][positions_df2]
+    keep = np.abs(num_authors_df1 - num_authors_df2) <= 2
+    result_df = create_pairs(df1, df2, positions_df1[keep], positions_df2[keep])
 
     # Drop rows with NaN values in text columns
     result_df = result_df.dropna(subset=["paper title_df1", "paper title_df2"])
     return result_df
 
 
-def create_commonAuthorsBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
-    result_df["common_authors"] = result_df.apply(
-        lambda row: set(str(row["author names_df1"]).split(", ")).intersection(
-            set(str(row["author names_df2"]).split(", "))
-        ),
-        axis=1,
+def create_commonAuthorsBlocking(df1, df2, features=None):
+    return create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "commonAuthors", features)
     )
-    result_df = result_df[result_df["common_authors"].apply(lambda x: len(x) > 0)]
-    return result_df
-
 
-def create_numAuthorsBlocking(df1, df2):
-    result_df = create_cartesian_product(df1, df2)
 
-    # Filter pairs based on the difference in the number of authors
-    result_df = result_df[
-        result_df.apply(
-            lambda x: abs(
-                len(str(x["author names_df1"]).split(", "))
-                - len(str(x["author names_df2"]).split(", "))
-            )
-            <= 1,
-            axis=1,
-        )
-    ]
-
-    # Optionally, reset the index
-    result_df = result_df.reset_index(drop=True)
+def create_numAuthorsBlocking(df1, df2, features=None):
+    result_df = create_blocked_product(
+        df1, df2, *blocking_keys(df1, df2, "numAuthors", features)
+    )
 
     # Drop rows with NaN values in text columns
     result_df = result_df.dropna(subset=["paper title_df1", "paper title_df2"])
@@ -312,40 +669,48 @@ def create_numAuthorsBlocking(df1, df2):
 
 
 def calculate_confusion_matrix(baseline_df, blocked_df):
-    baseline_df["ID"] = baseline_df["paper ID_df1"] + baseline_df["paper ID_df2"]
-    blocked_df["ID"] = blocked_df["paper ID_df1"] + blocked_df["paper ID_df2"]
-
-    inner_join = pd.merge(baseline_df, blocked_df, how="inner", on=["ID"])
-    inner_no_duplicates = inner_join.drop_duplicates(subset=["ID"])
-
-    baseline_no_duplicates = baseline_df.drop_duplicates(subset=["ID"])
-    tp = inner_no_duplicates.shape[0]
-
-    fn = baseline_no_duplicates.shape[0] - tp
-
-    blocked_no_duplicates = blocked_df.drop_duplicates(subset=["ID"])
-    right_join = pd.merge(
-        baseline_no_duplicates, blocked_no_duplicates, how="right", on=["ID"]
-    )
-    fp = right_join.shape[0] - inner_no_duplicates.shape[0]
-
-    # Calculate precision, recall, and F1 score
-    precision = tp / (tp + fp) if (tp + fp) > 0 else 0
-    recall = tp / (tp + fn) if (tp + fn) > 0 else 0
-    f1 = (
-        (2 * (precision * recall) / (precision + recall))
-        if (precision + recall) > 0
-        else 0
-    )
-
-    return tp, fn, fp, precision, recall, f1
+    # Pairs are compared as sets of int64 keys, the inputs are not modified
+    return confusion_matrix(*pair_keys(baseline_df, blocked_df))
 
 
-def calculate_baseline(df1, df2, baseline_config):
+def calculate_baseline(df1, df2, baseline_config, features=None):
     similarity_threshold = baseline_config["threshold"]
     matching_method = baseline_config["method"]
-    result_df = create_cartesian_product(df1, df2)
-    result_df = matching(result_df, similarity_threshold, matching_method)
+    features = features or (FeatureStore(df1), FeatureStore(df2))
+    # Only score the pairs whose title similarity can pass the threshold
+    if matching_method == "Combined":
+        # The trigram part is at most 0.3, so jaccard > (threshold - 0.3) / 0.7
+        title_threshold = max((similarity_threshold - 0.3) / 0.7, 0)
+    else:
+        title_threshold = similarity_threshold
+    if similarity_threshold < 0:
+        result_df = create_cartesian_product(df1, df2)
+    else:
+        positions_df1, positions_df2 = similarity_join(
+            shared_matrix(*features, "title_tokens"), len(df1), title_threshold
+        )
+        if matching_method == "Combined" and similarity_threshold < 0.3:
+            # Below 0.3 a pair without a common title token can pass on its
+            # authors alone, with a trigram similarity above threshold / 0.3
+            author_positions = similarity_join(
+                shared_matrix(*features, "author_trigrams"),
+                len(df1),
+                similarity_threshold / 0.3,
+            )
+            num_df2 = max(len(df2), 1)
+            keys = np.unique(
+                np.concatenate(
+                    [
+                        positions_df1 * num_df2 + positions_df2,
+                        author_positions[0] * num_df2 + author_positions[1],
+                    ]
+                )
+            )
+            positions_df1, positions_df2 = np.divmod(keys, num_df2)
+        result_df = create_pairs(df1, df2, positions_df1, positions_df2)
+    result_df = matching(
+        result_df, similarity_threshold, matching_method, features=features
+    )
     return result_df
 
 
@@ -392,60 +757,86 @@ def run_all_blocking_matching_methods(
     blocking_methods,
     save=True,
     output=FILENAME_ALL_METHODS_RESULTS,
+    features=None,
+    sweep=False,
 ):
+    # Extract the features of both databases once for all methods
+    features = features or (FeatureStore(df1), FeatureStore(df2))
+    if sweep:
+        results_list = sweep_blocking_matching_methods(
+            df1, df2, thresholds, matching_methods, blocking_methods, features
+        )
+        if save:
+            save_result(pd.DataFrame(results_list), output)
+        return results_list
     # Create an empty DataFrame to store the results
     results_list = []
-    
+    instrumentation = get_instrumentation()
+
     logging_delimiter()
-    for matching_method in matching_methods:
-        for threshold in thresholds:
-            logging.info(f"begin baseline {matching_method}{threshold}")
-            start_time = time()
-            baseline_df = calculate_baseline(
-                df1, df2, {"method": matching_method, "threshold": threshold}
-            )
-            end_time = time()
-            logging.info("finished baseline: " + matching_method)
-            save_result(baseline_df, baseline_filename(matching_method, threshold))
-            baseline_execution_time = end_time - start_time
-            # Iterate through each blocking method
-            for blocking_method in blocking_methods:
-                # Dynamically call the blocking method function
-                logging.info(f"begin blocking method {blocking_method}")
-                start_time = time()
-                blocking_df = blocking(df1, df2, blocking_method)
-                end_time = time()
-                blocking_execution_time = end_time - start_time
-                logging.info("finished blocking method: " + blocking_method)
-                logging.info(f"begin matching method {matching_method}")
-                start_time = time()
-                matched_df = matching(blocking_df, threshold, matching_method)
-                end_time = time()
-                matching_execution_time = end_time - start_time
-                logging.info("finished matching method: " + matching_method)
-                save_result(
-                    matched_df,
-                    matched_entities_filename(
-                        blocking_method, matching_method, threshold
-                    ),
-                )
-                # Append results to the list
-                results_list.append(
-                    resultToString(
-                        {
-                            "blocking_method": blocking_method,
-                            "matching_method": matching_method,
-                            "threshold": threshold,
-                        },
-                        baseline_execution_time,
-                        blocking_execution_time,
-                        matching_execution_time,
-                        baseline_df,
+    with instrumentation.run(pipeline="all methods") as records:
+        for matching_method in matching_methods:
+            for threshold in thresholds:
+                labels = {"matching_method": matching_method, "threshold": threshold}
+                logging.info(f"begin baseline {matching_method}{threshold}")
+                with instrumentation.stage("baseline", **labels) as metrics:
+                    baseline_df = calculate_baseline(
+                        df1,
+                        df2,
+                        {"method": matching_method, "threshold": threshold},
+                        features=features,
+                    )
+                    metrics["rows"] = len(df1) + len(df2)
+                    metrics["matched_pairs"] = len(baseline_df)
+                logging.info("finished baseline: " + matching_method)
+                save_result(baseline_df, baseline_filename(matching_method, threshold))
+                baseline_execution_time = metrics["wall_seconds"]
+                # Iterate through each blocking method
+                for blocking_method in blocking_methods:
+                    labels["blocking_method"] = blocking_method
+                    # Dynamically call the blocking method function
+                    logging.info(f"begin blocking method {blocking_method}")
+                    with instrumentation.stage("block", **labels) as metrics:
+                        blocking_df = blocking(df1, df2, blocking_method, features)
+                        metrics["rows"] = len(df1) + len(df2)
+                        metrics["candidate_pairs"] = len(blocking_df)
+                    blocking_execution_time = metrics["wall_seconds"]
+                    logging.info("finished blocking method: " + blocking_method)
+                    logging.info(f"begin matching method {matching_method}")
+                    with instrumentation.stage("match", **labels) as metrics:
+                        matched_df = matching(
+                            blocking_df, threshold, matching_method, features=features
+                        )
+                        metrics["rows"] = len(blocking_df)
+                        metrics["matched_pairs"] = len(matched_df)
+                    matching_execution_time = metrics["wall_seconds"]
+                    logging.info("finished matching method: " + matching_method)
+                    save_result(
                         matched_df,
+                        matched_entities_filename(
+                            blocking_method, matching_method, threshold
+                        ),
                     )
-                )
-                logging.info(results_list[-1])
-            # Write results to a single CSV Ffile
+                    # Append results to the list
+                    with instrumentation.stage("evaluate", **labels) as metrics:
+                        results_list.append(
+                            resultToString(
+                                {
+                                    "blocking_method": blocking_method,
+                                    "matching_method": matching_method,
+                                    "threshold": threshold,
+                                },
+                                baseline_execution_time,
+                                blocking_execution_time,
+                                matching_execution_time,
+                                baseline_df,
+                                matched_df,
+                            )
+                        )
+                        metrics["rows"] = len(baseline_df) + len(matched_df)
+                    logging.info(results_list[-1])
+                # Write results to a single CSV Ffile
+    export_metrics(records)
     if save:
         save_result(
             pd.DataFrame(results_list),
@@ -453,3 +844,129 @@ def run_all_blocking_matching_methods(
         )
     logging_delimiter()
     return results_list
+
+
+def sweep_blocking_matching_methods(
+    df1, df2, thresholds, matching_methods, blocking_methods, features
+):
+    """run_all_blocking_matching_methods scoring every pair once
+
+    The baseline and the candidate pairs of every blocking method are scored
+    once at the lowest threshold, the results of every threshold are cut from
+    these scores. Execution times are the shared scoring time plus the cut.
+
+    Returns:
+        list: a row of resultToString per matching method, threshold and
+        blocking method, in the order of run_all_blocking_matching_methods
+    """
+    thresholds = list(thresholds)
+    matching_methods = list(matching_methods)
+    blocking_methods = list(blocking_methods)
+    lowest_threshold = min(thresholds)
+    results = {}
+
+    instrumentation = get_instrumentation()
+    logging_delimiter()
+    baselines = {}
+    with instrumentation.run(pipeline="all methods sweep") as records:
+        for matching_method in matching_methods:
+            labels = {"matching_method": matching_method}
+            logging.info(f"begin baseline {matching_method}{lowest_threshold}")
+            with instrumentation.stage("baseline", **labels) as metrics:
+                baseline_df = calculate_baseline(
+                    df1,
+                    df2,
+                    {"method": matching_method, "threshold": lowest_threshold},
+                    features=features,
+                )
+                metrics["rows"] = len(df1) + len(df2)
+                metrics["matched_pairs"] = len(baseline_df)
+            baseline_execution_time = metrics["wall_seconds"]
+            logging.info("finished baseline: " + matching_method)
+            for threshold in thresholds:
+                with instrumentation.stage(
+                    "cut", threshold=threshold, **labels
+                ) as metrics:
+                    threshold_df = cut_scores(baseline_df, threshold)
+                    metrics["rows"] = len(baseline_df)
+                    metrics["matched_pairs"] = len(threshold_df)
+                baselines[matching_method, threshold] = (
+                    threshold_df,
+                    baseline_execution_time + metrics["wall_seconds"],
+                )
+                save_result(threshold_df, baseline_filename(matching_method, threshold))
+
+        # The candidate pairs do not depend on the matching method
+        for blocking_method in blocking_methods:
+            labels = {"blocking_method": blocking_method}
+            logging.info(f"begin blocking method {blocking_method}")
+            with instrumentation.stage("block", **labels) as metrics:
+                blocking_df = blocking(df1, df2, blocking_method, features)
+                metrics["rows"] = len(df1) + len(df2)
+                metrics["candidate_pairs"] = len(blocking_df)
+            blocking_execution_time = metrics["wall_seconds"]
+            logging.info("finished blocking method: " + blocking_method)
+            for matching_method in matching_methods:
+                labels["matching_method"] = matching_method
+                logging.info(f"begin matching method {matching_method}")
+                with instrumentation.stage("match", **labels) as metrics:
+                    scored_df = matching(
+                        blocking_df,
+                        lowest_threshold,
+                        matching_method,
+                        features=features,
+                    )
+                    metrics["rows"] = len(blocking_df)
+                    metrics["matched_pairs"] = len(scored_df)
+                scoring_time = metrics["wall_seconds"]
+                logging.info("finished matching method: " + matching_method)
+                for threshold in thresholds:
+                    with instrumentation.stage(
+                        "cut", threshold=threshold, **labels
+                    ) as metrics:
+                        matched_df = cut_scores(scored_df, threshold)
+                        metrics["rows"] = len(scored_df)
+                        metrics["matched_pairs"] = len(matched_df)
+                    matching_execution_time = scoring_time + metrics["wall_seconds"]
+                    save_result(
+                        matched_df,
+                        matched_entities_filename(
+                            blocking_method, matching_method, threshold
+                        ),
+                    )
+                    baseline_df, baseline_execution_time = baselines[
+                        matching_method, threshold
+                    ]
+                    with instrumentation.stage(
+                        "evaluate", threshold=threshold, **labels
+                    ) as metrics:
+                        results[blocking_method, matching_method, threshold] = (
+                            resultToString(
+                                {
+                                    "blocking_method": blocking_method,
+                                    "matching_method": matching_method,
+                                    "threshold": threshold,
+                                },
+                                baseline_execution_time,
+                                blocking_execution_time,
+                                matching_execution_time,
+                                baseline_df,
+                                matched_df,
+                            )
+                        )
+                        metrics["rows"] = len(baseline_df) + len(matched_df)
+                    logging.info(results[blocking_method, matching_method, threshold])
+            del blocking_df
+    export_metrics(records)
+    logging_delimiter()
+    return [
+        results[blocking_method, matching_method, threshold]
+        for matching_method in matching_methods
+        for threshold in thresholds
+        for blocking_method in blocking_methods
+    ]
+
+
+def cut_scores(scored_df, threshold):
+    # Pairs of a matching result above a higher threshold
+    return scored_df[scored_df["similarity_score"] > threshold].copy()
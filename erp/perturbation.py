@@ -0,0 +1,283 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from erp.utils import DATABSE_COLUMNS
+
+# Text of a column as UTF-8 bytes, row i is data[starts[i]:ends[i]]
+TextColumn = namedtuple("TextColumn", ["data", "starts", "ends", "missing"])
+
+
+def perturb_database(
+    df,
+    rng,
+    title_typos=0,
+    author_typos=0,
+    token_drop_rate=0.0,
+    author_swap_rate=0.0,
+    year_shift=0,
+):
+    """database with random changes in every record
+
+    Args:
+        df (DataFrame): database
+        rng (Generator|int): random generator or seed
+        title_typos (int, optional): characters replaced in every title. Defaults to 0.
+        author_typos (int, optional): characters replaced in the author names
+        of every record. Defaults to 0.
+        token_drop_rate (float, optional): probability to drop a title word,
+        a title keeps at least one word. Defaults to 0.0.
+        author_swap_rate (float, optional): probability to swap an author for an
+        author of another record. Defaults to 0.0.
+        year_shift (int, optional): years are shifted by at most this number of
+        years. Defaults to 0.
+
+    Returns:
+        DataFrame
+    """
+    rng = np.random.default_rng(rng)
+    df = df.copy()
+    if title_typos or token_drop_rate:
+        title = encode_column(df[DATABSE_COLUMNS[1]])
+        if token_drop_rate:
+            title = drop_tokens(title, token_drop_rate, rng)
+        title = add_typos(title, title_typos, rng)
+        df[DATABSE_COLUMNS[1]] = decode_column(title)
+    if author_typos or author_swap_rate:
+        authors = encode_column(df[DATABSE_COLUMNS[2]])
+        if author_swap_rate:
+            authors = swap_tokens(authors, author_swap_rate, rng)
+        authors = add_typos(authors, author_typos, rng)
+        df[DATABSE_COLUMNS[2]] = decode_column(authors)
+    if year_shift:
+        df[DATABSE_COLUMNS[4]] = shift_years(
+            df[DATABSE_COLUMNS[4]].to_numpy(), year_shift, rng
+        )
+    return df
+
+
+def database_variants(df, changes, seed=0):
+    """perturbed variants of a database, generated one at a time
+
+    Variant i only depends on the seed and i, so a variant is the same whether
+    the variants before it are generated or not.
+
+    Args:
+        df (DataFrame): database
+        changes (list): keyword arguments of perturb_database of every variant
+        seed (int|tuple, optional): Defaults to 0.
+
+    Yields:
+        DataFrame
+    """
+    seed = list(np.atleast_1d(seed))
+    for i, change in enumerate(changes):
+        yield perturb_database(df, np.random.default_rng(seed + [i]), **change)
+
+
+def replicate_database(df, factor, seed=0, **changes):
+    """database followed by factor - 1 perturbed copies of it
+
+    The paper IDs of copy i get the suffix "_i", so that they stay unique.
+
+    Args:
+        df (DataFrame): database
+        factor (int): number of copies, including the database
+        seed (int, optional): Defaults to 0.
+        changes: keyword arguments of perturb_database
+
+    Returns:
+        DataFrame
+    """
+    copies = [df]
+    for i, copy in enumerate(
+        database_variants(df, [changes] * (factor - 1), seed), start=1
+    ):
+        copy[DATABSE_COLUMNS[0]] = copy[DATABSE_COLUMNS[0]].astype(str) + f"_{i}"
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def encode_column(values):
+    """TextColumn of a column of strings, NaN is kept as missing"""
+    values = pd.Series(values)
+    missing = values.isna().to_numpy()
+    encoded = [
+        b"" if is_missing else str(value).encode("utf-8")
+        for value, is_missing in zip(values.tolist(), missing.tolist())
+    ]
+    lengths = np.array([len(value) for value in encoded], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return TextColumn(
+        np.frombuffer(b"".join(encoded), dtype=np.uint8), ends - lengths, ends, missing
+    )
+
+
+def decode_column(column):
+    """strings of a TextColumn, NaN for missing rows
+
+    Returns:
+        ndarray
+    """
+    data = column.data.tobytes()
+    values = np.empty(len(column.starts), dtype=object)
+    values[:] = [
+        data[start:end].decode("utf-8")
+        for start, end in zip(column.starts.tolist(), column.ends.tolist())
+    ]
+    values[column.missing] = np.nan
+    return values
+
+
+def add_typos(column, typos, rng):
+    """replace random characters of every row by random lowercase letters, as
+    add_random_characters_to_string does
+
+    Args:
+        column (TextColumn):
+        typos (int|ndarray): number of characters replaced in every row
+        rng (Generator):
+
+    Returns:
+        TextColumn
+    """
+    lengths = column.ends - column.starts
+    typos = np.where(lengths > 0, np.broadcast_to(typos, lengths.shape), 0)
+    if typos.sum() == 0:
+        return column
+    positions = np.repeat(column.starts, typos) + (
+        rng.random(typos.sum()) * np.repeat(lengths, typos)
+    ).astype(np.int64)
+    data = column.data.copy()
+    # Bytes of multi-byte UTF-8 characters are left as they are
+    positions = positions[data[positions] < 128]
+    data[positions] = rng.integers(ord("a"), ord("z") + 1, len(positions), np.uint8)
+    return column._replace(data=data)
+
+
+def drop_tokens(column, rate, rng, separator=b" "):
+    """drop every token with a probability, every row keeps at least one token
+
+    Returns:
+        TextColumn
+    """
+    starts, ends, counts = split_tokens(column, separator)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    keep = rng.random(len(starts)) >= rate
+    emptied = np.flatnonzero(
+        (np.bincount(rows, weights=keep, minlength=len(counts)) == 0) & (counts > 0)
+    )
+    first_tokens = np.cumsum(counts) - counts
+    keep[first_tokens[emptied] + rng.integers(0, counts[emptied])] = True
+    tokens = np.flatnonzero(keep)
+    return join_tokens(
+        column.data,
+        starts,
+        ends,
+        tokens,
+        np.bincount(rows[tokens], minlength=len(counts)),
+        separator,
+    )
+
+
+def swap_tokens(column, rate, rng, separator=b", "):
+    """swap every token with a probability for a random token of the column,
+    e.g. an author for an author of another record
+
+    Returns:
+        TextColumn
+    """
+    starts, ends, counts = split_tokens(column, separator)
+    tokens = np.arange(len(starts))
+    swapped = np.flatnonzero(rng.random(len(tokens)) < rate)
+    tokens[swapped] = rng.integers(0, max(len(tokens), 1), len(swapped))
+    return join_tokens(column.data, starts, ends, tokens, counts, separator)
+
+
+def shift_years(years, max_shift, rng):
+    # Every year is shifted by a number of years between -max_shift and max_shift
+    return years + rng.integers(-max_shift, max_shift + 1, len(years))
+
+
+# ==================================================================================
+# ==============Functions basically never called externally=========================
+# ==================================================================================
+
+
+def split_tokens(column, separator):
+    """tokens of every row of a TextColumn
+
+    Returns:
+        (ndarray, ndarray, ndarray): starts and ends of the tokens in column.data,
+        row after row, and the number of tokens of every row (0 if missing)
+    """
+    separator = np.frombuffer(separator, dtype=np.uint8)
+    data = column.data
+    num_positions = max(len(data) - len(separator) + 1, 0)
+    found = np.ones(num_positions, dtype=bool)
+    for i, byte in enumerate(separator):
+        found &= data[i : i + num_positions] == byte
+    positions = np.flatnonzero(found)
+    # Only separators within a row, rows may not be contiguous
+    rows = np.minimum(
+        np.searchsorted(column.ends, positions, side="right"), len(column.ends) - 1
+    )
+    within = (positions >= column.starts[rows]) & (
+        positions + len(separator) <= column.ends[rows]
+    )
+    positions, rows = positions[within], rows[within]
+
+    present = ~column.missing
+    starts = np.sort(
+        np.concatenate([column.starts[present], positions + len(separator)])
+    )
+    ends = np.sort(np.concatenate([positions, column.ends[present]]))
+    counts = np.where(present, np.bincount(rows, minlength=len(column.starts)) + 1, 0)
+    return starts, ends, counts
+
+
+def join_tokens(data, starts, ends, tokens, counts, separator):
+    """concatenate the tokens of every row with a separator
+
+    Args:
+        data (ndarray): uint8 characters of the tokens
+        starts (ndarray): token i is data[starts[i]:ends[i]]
+        ends (ndarray):
+        tokens (ndarray): tokens of all rows, one row after the other
+        counts (ndarray): number of tokens of every row, rows without tokens
+        are missing
+        separator (bytes):
+
+    Returns:
+        TextColumn
+    """
+    separator = np.frombuffer(separator, dtype=np.uint8)
+    data = np.concatenate([data, separator])
+    # Every token is followed by the separator, the last one of a row is cut off
+    token_lengths = (ends - starts)[tokens]
+    lengths = token_lengths + len(separator)
+    piece_starts = np.stack(
+        [starts[tokens], np.full(len(tokens), len(data) - len(separator))], axis=1
+    ).ravel()
+    piece_lengths = np.stack(
+        [token_lengths, np.full(len(tokens), len(separator))], axis=1
+    ).ravel()
+    nonempty = piece_lengths > 0
+    piece_starts, piece_lengths = piece_starts[nonempty], piece_lengths[nonempty]
+    # The characters of a piece follow each other in data, so the positions
+    # of the characters are a cumulative sum jumping at every piece
+    step = np.ones(piece_lengths.sum(), dtype=np.int64)
+    step[np.cumsum(piece_lengths) - piece_lengths] = (
+        piece_starts - np.concatenate([[1], (piece_starts + piece_lengths)[:-1]]) + 1
+    )
+    chars = data[np.cumsum(step)]
+
+    row_ends = np.cumsum(
+        np.bincount(
+            np.repeat(np.arange(len(counts)), counts),
+            weights=lengths,
+            minlength=len(counts),
+        ).astype(np.int64)
+    )
+    row_starts = np.concatenate([[0], row_ends[:-1]]).astype(np.int64)
+    row_ends = row_ends - np.where(counts > 0, len(separator), 0)
+    return TextColumn(chars, row_starts, row_ends, counts == 0)
@@ -1,66 +1,201 @@
+import io
+import locale
 import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 
 from erp.utils import DATABSE_COLUMNS, logging_delimiter
 
-def prepare_data(file_name:str):
+# Define the order of information in each entry
+IDENTIFY_STRING = ["#index", "#*", "#@", "#c", "#t"]
+# Anything but alphanumeric characters, spaces and commas ("_" is a word character)
+SPECIAL_CHARACTERS = re.compile(r"[^\w ,]|_")
+
+
+def prepare_data(file_name: str, chunk_size=10000):
     """extracting and cleaning data
 
+    The file is streamed entry by entry and the cleaned rows are written in
+    chunks, so memory does not grow with the size of the file. The columnar
+    cache is written by read_database the first time the output is read.
+
     Args:
         file_name (str): database txt file
+        chunk_size (int, optional): rows written at once. Defaults to 10000.
     """
-    databases = []
     logging_delimiter()
     logging.info(f"Preparing database: {file_name}")
+    output = file_name[:-4] + "_1995_2004.csv"
     # paper ID, paper title, author names, publication venue, and year of publication
     with open(file_name) as f:
-        # Split the file into a list of entries
-        list_of_papers = f.read().split("\n\n")
-        
-        # Initialize a dataset with column length as requested schema, row length as number of entries
-        databases = [["" for j in range(5)] for i in range(len(list_of_papers))]
-
-        # Define the order of information in each entry
-        identify_string = ["#index", "#*", "#@", "#c", "#t"]
-
-        # Split each entry into lines and extract information based on identify_string
-        list_of_papers = [col.split("\n") for col in list_of_papers]
-        # for i in range(len(list_of_papers)):
-        for i in range(len(list_of_papers)):
-            if i % 100000 == 0:
-                logging.info(f"Progress: {i / len(list_of_papers) * 100 :.2f}%")
-
-            for col in list_of_papers[i]:
-                for j in range(len(identify_string)):
-                    filtered_string = "".join(
-                        [
-                            char
-                            for char in col[len(identify_string[j]) :].lower()
-                            if (char.isalnum()) or (char in [" ", ","])
-                        ]
-                    )
-
-                    if col[: len(identify_string[j])] == identify_string[j]:
-                        # Lowercase all characters and eliminate special characters
-                        databases[i][j] = filtered_string
-                        break
-
-    # Filter the data based on specified criteria
-    databases = [data for data in databases if (data[-1] != "") and (data[0] != "")]
-    databases = [
-        data
-        for data in databases
-        if (
-            (int(data[-1]) >= 1995)
-            and (int(data[-1]) <= 2004)
-            and (("SIGMOD".lower() in data[-2]) or ("VLDB".lower() in data[-2]))
-        )
-    ]
-    database = pd.DataFrame(databases, columns=DATABSE_COLUMNS)
-    # Assuming in the same databse if the ids are the same, then the papers are the same, delete the duplicate ids.
-    database = database.drop_duplicates(subset=["paper ID"])
-    # Write the filtered data to a CSV file
-    database.to_csv(file_name[:-4] + "_1995_2004.csv", index=False)
-    logging.info(f"Cleaned data is stored in {file_name[:-4] + '_1995_2004.csv'}")
+        write_csv_chunks(parse_entries(read_entries(f)), output, chunk_size)
+    logging.info(f"Cleaned data is stored in {output}")
+    logging_delimiter()
+
+
+def prepare_data_parallel(
+    file_names, max_workers=None, range_size=64 * 1024 * 1024, chunk_size=10000
+):
+    """extracting and cleaning data with a process pool
+
+    Every file is split into byte ranges aligned on the blank lines between
+    entries. The ranges of all files are parsed and filtered concurrently and
+    merged in file order, so the output is the same as with prepare_data.
+
+    Args:
+        file_names (list): database txt files
+        max_workers (int, optional): number of processes. Defaults to the number of CPUs.
+        range_size (int, optional): approximate bytes parsed by a task. Defaults to 64MB.
+        chunk_size (int, optional): rows written at once. Defaults to 10000.
+    """
+    logging_delimiter()
+    logging.info(f"Preparing databases in parallel: {file_names}")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # Submit the ranges of every file before waiting for any of them
+        futures = {
+            file_name: [
+                executor.submit(parse_range, file_name, start, end)
+                for start, end in split_file(file_name, range_size)
+            ]
+            for file_name in file_names
+        }
+        for file_name, range_futures in futures.items():
+            output = file_name[:-4] + "_1995_2004.csv"
+            rows = (row for future in range_futures for row in future.result())
+            write_csv_chunks(drop_duplicate_ids(rows), output, chunk_size)
+            logging.info(f"Cleaned data is stored in {output}")
     logging_delimiter()
 
+
+def split_file(file_name, range_size):
+    """byte ranges of a file, every range starts right after a blank line
+
+    Returns:
+        list: (start, end) of every range
+    """
+    size = os.path.getsize(file_name)
+    bounds = [0]
+    with open(file_name, "rb") as f:
+        for offset in range(range_size, size, range_size):
+            if offset <= bounds[-1]:
+                continue
+            f.seek(offset)
+            # Finish the current line, then move to the end of the next blank line
+            line = f.readline()
+            while line:
+                line = f.readline()
+                if line.strip(b"\r\n") == b"":
+                    break
+            if f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def parse_range(file_name, start, end):
+    """extract and clean the entries in a byte range of a file, see parse_entries
+
+    Returns:
+        list: rows of the range
+    """
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # Decode like open() does, including universal newlines
+    lines = io.TextIOWrapper(
+        io.BytesIO(data), encoding=locale.getpreferredencoding(False)
+    )
+    return list(parse_entries(read_entries(lines)))
+
+
+def drop_duplicate_ids(rows):
+    # Keep the first row of every paper ID
+    seen_ids = set()
+    for row in rows:
+        if row[0] not in seen_ids:
+            seen_ids.add(row[0])
+            yield row
+
+
+def read_entries(lines):
+    """group lines into entries, entries are separated by blank lines
+
+    Args:
+        lines (iterable): lines of a database txt file
+
+    Yields:
+        list: lines of an entry
+    """
+    entry = []
+    for i, line in enumerate(lines):
+        if i and (i % 1000000 == 0):
+            logging.info(f"Progress: {i} lines")
+        line = line.rstrip("\n")
+        if line == "":
+            if entry:
+                yield entry
+            entry = []
+        else:
+            entry.append(line)
+    if entry:
+        yield entry
+
+
+def parse_entries(entries):
+    """extract and clean the entries published in 1995-2004 by SIGMOD or VLDB
+
+    Args:
+        entries (iterable): lines of every entry
+
+    Yields:
+        list: paper ID, paper title, author names, publication venue, and year
+        of publication. Entries with an already seen paper ID are skipped.
+    """
+    seen_ids = set()
+    for entry in entries:
+        # Split each entry into lines and extract information based on IDENTIFY_STRING
+        fields = [""] * len(IDENTIFY_STRING)
+        for line in entry:
+            for j in range(len(IDENTIFY_STRING)):
+                if line.startswith(IDENTIFY_STRING[j]):
+                    fields[j] = line[len(IDENTIFY_STRING[j]) :]
+                    break
+
+        # Filter the data based on specified criteria before cleaning the rest
+        year, paper_id = clean_string(fields[-1]), clean_string(fields[0])
+        if (year == "") or (paper_id == ""):
+            continue
+        if (int(year) < 1995) or (int(year) > 2004):
+            continue
+        venue = clean_string(fields[-2])
+        if ("SIGMOD".lower() not in venue) and ("VLDB".lower() not in venue):
+            continue
+        # Assuming in the same databse if the ids are the same, then the papers are the same, delete the duplicate ids.
+        if paper_id in seen_ids:
+            continue
+        seen_ids.add(paper_id)
+        yield [paper_id, clean_string(fields[1]), clean_string(fields[2]), venue, year]
+
+
+def clean_string(string):
+    # Lowercase all characters and eliminate special characters
+    return SPECIAL_CHARACTERS.sub("", string.lower())
+
+
+def write_csv_chunks(rows, file_name, chunk_size=10000):
+    """write rows to a CSV file, chunk_size rows at a time"""
+    chunk = []
+    header = True
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            pd.DataFrame(chunk, columns=DATABSE_COLUMNS).to_csv(
+                file_name, mode="w" if header else "a", header=header, index=False
+            )
+            chunk, header = [], False
+    if chunk or header:
+        pd.DataFrame(chunk, columns=DATABSE_COLUMNS).to_csv(
+            file_name, mode="w" if header else "a", header=header, index=False
+        )
@@ -1,7 +1,10 @@
+import glob
 import logging
 import os
+import numpy as np
 import pandas as pd
 import re
+from erp.indexing import BlockIndex
 
 DATABSE_COLUMNS = [
     "paper ID",
@@ -29,7 +32,7 @@ FILENAME_DP_MATCHED_ENTITIES = "matched_entities_dp.csv"
 FILENAME_LOCAL_CLUSTERING = "clustering_results_local.csv"
 FILENAME_DP_CLUSTERING = "clustering_results_dp.csv"
 FILENAME_ALL_METHODS_RESULTS = "method_results.csv"
-FILENAME_SCABILITY_TEST_RESULTS = "scability_results.csv"
+FILENAME_BENCHMARK_RESULTS = "benchmark_results.csv"
 FILENAME_DP_LOCAL_DIFFERENCE = "difference_results.csv"
 
 
@@ -42,11 +45,24 @@ def matched_entities_filename(blocking_method, matching_method, threshold):
 
 
 def create_cartesian_product(df1, df2):
-    # Create a common key for the Cartesian product
-    df1["key"] = 1
-    df2["key"] = 1
-    # Perform a Cartesian product (cross join) on the common key
-    return pd.merge(df1, df2, on="key", suffixes=("_df1", "_df2")).drop("key", axis=1)
+    # Perform a Cartesian product (cross join) without touching the inputs
+    return pd.merge(df1, df2, how="cross", suffixes=("_df1", "_df2"))
+
+
+def create_pairs(df1, df2, positions_df1, positions_df2):
+    # Build only the given rows of the cartesian product, with the same columns
+    common_columns = set(df1.columns).intersection(df2.columns)
+    left = df1.iloc[positions_df1].reset_index(drop=True)
+    right = df2.iloc[positions_df2].reset_index(drop=True)
+    left.columns = [c + "_df1" if c in common_columns else c for c in left.columns]
+    right.columns = [c + "_df2" if c in common_columns else c for c in right.columns]
+    return pd.concat([left, right], axis=1)
+
+
+def create_blocked_product(df1, df2, keys_df1, keys_df2):
+    # Hash join on block keys: only pairs sharing a key are ever created
+    positions_df1, positions_df2 = BlockIndex(keys_df2).candidate_pairs(keys_df1)
+    return create_pairs(df1, df2, positions_df1, positions_df2)
 
 
 # Define a Jaccard similarity function
@@ -60,6 +76,27 @@ def jaccard_similarity(set1, set2):
     return intersection_size / union_size
 
 
+def jaccard_similarity_batch(matrix, rows1, rows2, batch_size=1 << 20):
+    # Jaccard similarity of the sets in rows1 and rows2 of a token matrix
+    sizes = np.diff(matrix.indptr)
+    similarity = np.zeros(len(rows1), dtype=np.float64)
+    for begin in range(0, len(rows1), batch_size):
+        r1 = rows1[begin : begin + batch_size]
+        r2 = rows2[begin : begin + batch_size]
+        intersection_size = np.asarray(
+            matrix[r1].multiply(matrix[r2]).sum(axis=1), dtype=np.float64
+        ).ravel()
+        union_size = sizes[r1] + sizes[r2] - intersection_size
+        # 0 to handle the case when both sets are empty
+        np.divide(
+            intersection_size,
+            union_size,
+            out=similarity[begin : begin + batch_size],
+            where=union_size > 0,
+        )
+    return similarity
+
+
 # Function to find ngrams in a given text
 def find_ngrams(text: str, number: int = 3) -> set:
     if not text:
@@ -95,12 +132,124 @@ def test_and_create_folder(folder_path):
         logging.warning(f"Folder '{folder_path}' already exists.")
 
 
+def database_cache_filename(filename):
+    return filename[:-4] + ".npz"
+
+
+def read_database(filename):
+    """read a cleaned database
+
+    The columnar cache next to the CSV file is read when it is up to date,
+    otherwise the CSV file is parsed and the cache is written for the next runs,
+    if the folder can be written.
+
+    Args:
+        filename (str): database CSV filename
+
+    Returns:
+        DataFrame
+    """
+    cache = database_cache_filename(filename)
+    if os.path.exists(cache) and (
+        (not os.path.exists(filename))
+        or (os.path.getmtime(cache) >= os.path.getmtime(filename))
+    ):
+        return load_database_cache(cache)
+    df = pd.read_csv(filename, sep=",", engine="python")
+    try:
+        save_database_cache(filename, df)
+    except OSError as e:
+        logging.warning(f"{filename} is not cached: {e}")
+    return df
+
+
+def save_database_cache(filename, df=None, strict=False):
+    """write a database in a typed columnar format (.npz)
+
+    Numeric columns are stored as arrays, text columns are dictionary-encoded
+    as int32 codes (-1 for NaN) and their UTF-8 encoded distinct values.
+
+    Args:
+        filename (str): database CSV filename
+        df (DataFrame, optional): the database. Defaults to reading filename.
+        strict (bool, optional): raise a ValueError for a column that cannot be
+        written, instead of logging it and not writing the cache. Defaults to False.
+    """
+    if df is None:
+        df = pd.read_csv(filename, sep=",", engine="python")
+    arrays = {"columns": np.array(df.columns, dtype=str)}
+    for i, column in enumerate(df.columns):
+        if df[column].dtype != object:
+            arrays[f"values_{i}"] = df[column].to_numpy()
+            continue
+        codes, categories = pd.factorize(df[column])
+        if not all(isinstance(value, str) for value in categories):
+            message = f"{filename} is not cached: {column} is not a text column"
+            if strict:
+                raise ValueError(message)
+            logging.warning(message)
+            return
+        encoded = [value.encode("utf-8") for value in categories]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        arrays[f"codes_{i}"] = codes.astype(np.int32)
+        arrays[f"offsets_{i}"] = offsets
+        arrays[f"data_{i}"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    np.savez(database_cache_filename(filename), **arrays)
+
+
+def load_database_cache(cache):
+    columns = {}
+    with np.load(cache, allow_pickle=False) as arrays:
+        for i, column in enumerate(arrays["columns"]):
+            if f"values_{i}" in arrays:
+                columns[column] = arrays[f"values_{i}"]
+                continue
+            data, offsets = arrays[f"data_{i}"].tobytes(), arrays[f"offsets_{i}"]
+            categories = [
+                data[begin:end].decode("utf-8")
+                for begin, end in zip(offsets[:-1], offsets[1:])
+            ]
+            # NaN is appended to the categories so that code -1 points to it
+            columns[column] = np.array(categories + [np.nan], dtype=object)[
+                arrays[f"codes_{i}"]
+            ]
+    return pd.DataFrame(columns)
+
+
 def save_result(result_df, filename):
     folder_path = RESULTS_FOLDER
     test_and_create_folder(folder_path)
     result_df.to_csv(folder_path + filename, index=False)
 
 
+def result_parquet_filename(filename):
+    return filename[:-4] + ".parquet"
+
+
+def read_result(filename):
+    """read a result, a CSV file or a folder of CSV part files written by Spark
+
+    Args:
+        filename (str): result filename in RESULTS_FOLDER
+
+    Returns:
+        DataFrame
+    """
+    path = RESULTS_FOLDER + filename
+    if not os.path.isdir(path):
+        return pd.read_csv(path)
+    # Spark can leave empty part files without a header
+    parts = [
+        part
+        for part in sorted(glob.glob(os.path.join(path, "part-*.csv")))
+        if os.path.getsize(part) > 0
+    ]
+    if len(parts) == 0:
+        return pd.DataFrame()
+    return pd.concat([pd.read_csv(part) for part in parts], ignore_index=True)
+
+
 def save_data(df, filename):
     folder_path = DATA_FOLDER
     test_and_create_folder(folder_path)
@@ -20,7 +20,7 @@ from erp.utils import (
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 # part1()  # cleaned data stored in "data" as "data/citation-acm-v8_1995_2004.csv" and "data/dblp_1995_2004.csv"
 # part2()  # results of all methods stored in "results/method_results.csv"
-part3()  # scability test results stored in "results/scability_results.csv" and "results/scability.png"
+part3()  # benchmark results stored in "results/benchmark_results.csv" and "results/benchmark.png"
 ER_pipeline(
     DATABASES_LOCATIONS[0], DATABASES_LOCATIONS[1], DEFAULT_ER_CONFIGURATION
 )  # test the entire local pipeline including clustering
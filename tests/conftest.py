@@ -0,0 +1,39 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pytest
+from erp.features import FeatureStore
+
+DATA_FOLDER = Path(__file__).resolve().parent.parent / "data"
+# Records of every database sample, small enough for a cartesian product
+NUM_RECORDS = 200
+
+
+def read_sample(name, num_records=NUM_RECORDS):
+    return pd.read_csv(DATA_FOLDER / name, sep=",", engine="python").head(num_records)
+
+
+@pytest.fixture(autouse=True)
+def working_folder(tmp_path, monkeypatch):
+    # Results and caches are written relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def databases():
+    """samples of both databases numbered as in ER_pipeline_local, with records
+    without a title or without authors"""
+    df1 = read_sample("dblp_1995_2004.csv")
+    df2 = read_sample("citation-acm-v8_1995_2004.csv")
+    df1.loc[3, "paper title"] = np.nan
+    df1.loc[5, "author names"] = np.nan
+    df2.loc[7, "paper title"] = np.nan
+    df2.loc[11, "author names"] = np.nan
+    df1["index"] = np.arange(len(df1))
+    df2["index"] = np.arange(len(df2)) + len(df1)
+    return df1, df2
+
+
+@pytest.fixture
+def features(databases):
+    return FeatureStore(databases[0]), FeatureStore(databases[1])
@@ -0,0 +1,109 @@
+import os
+from time import sleep
+import pandas as pd
+import pytest
+from erp.benchmark import (
+    BENCHMARK_ER_CONFIGURATION,
+    run_benchmark,
+    run_isolated,
+    synthetic_databases,
+)
+from erp.utils import DATABSE_COLUMNS, FILENAME_BENCHMARK_RESULTS, RESULTS_FOLDER
+
+# Functions run by run_isolated are imported by name in the new process
+
+
+def report_and_return(num_reports, report):
+    for i in range(num_reports):
+        report({"stage": i})
+    return "done"
+
+
+def report_and_fail(report):
+    report({"stage": "load"})
+    raise ValueError("failed after load")
+
+
+def report_and_sleep(report):
+    report({"stage": "load"})
+    sleep(60)
+
+
+def test_synthetic_databases_and_truth():
+    df1, df2, truth_df = synthetic_databases(1001, duplicate_rate=0.5, seed=3)
+    assert (len(df1), len(df2), len(truth_df)) == (500, 501, 250)
+    assert df1["paper ID"].is_unique and df2["paper ID"].is_unique
+    assert truth_df["paper ID_df1"].isin(df1["paper ID"]).all()
+    assert truth_df["paper ID_df2"].isin(df2["paper ID"]).all()
+    assert truth_df["paper ID_df1"].is_unique
+    df1_again, _, _ = synthetic_databases(1001, duplicate_rate=0.5, seed=3)
+    pd.testing.assert_frame_equal(df1_again, df1)
+
+
+def test_duplicates_without_noise_are_copies():
+    df1, df2, truth_df = synthetic_databases(400, noise=0)
+    columns = DATABSE_COLUMNS[1:]
+    duplicates1 = df1.set_index("paper ID").loc[truth_df["paper ID_df1"], columns]
+    duplicates2 = df2.set_index("paper ID").loc[truth_df["paper ID_df2"], columns]
+    assert duplicates1.values.tolist() == duplicates2.values.tolist()
+
+
+def test_run_isolated_returns_the_result_and_the_reports():
+    reports = []
+    assert run_isolated(report_and_return, (3,), report=reports.append) == "done"
+    assert reports == [{"stage": 0}, {"stage": 1}, {"stage": 2}]
+
+
+def test_run_isolated_keeps_the_reports_of_a_failed_run():
+    reports = []
+    with pytest.raises(ValueError, match="failed after load"):
+        run_isolated(report_and_fail, (), report=reports.append)
+    assert reports == [{"stage": "load"}]
+
+
+def test_run_isolated_timeout_keeps_the_reports():
+    reports = []
+    with pytest.raises(TimeoutError):
+        run_isolated(report_and_sleep, (), timeout=5, report=reports.append)
+    assert reports == [{"stage": "load"}]
+
+
+@pytest.mark.parametrize(
+    "memory_budget, stages",
+    [
+        (1 << 20, ["load", "block+match", "cluster", "evaluate"]),
+        (None, ["load", "block", "match", "cluster", "evaluate"]),
+    ],
+)
+def test_local_benchmark_stages(memory_budget, stages):
+    configuration = {**BENCHMARK_ER_CONFIGURATION, "memory_budget": memory_budget}
+    results = run_benchmark(
+        [600], ["local"], configuration, noise=0, isolate=False, output="results.csv"
+    )
+    assert results["stage"].tolist() == stages
+    assert results["pairs"].iloc[1] > 0
+    assert results["recall"].iloc[-1] == 1
+    assert os.path.exists(RESULTS_FOLDER + "results.csv")
+
+
+def test_failed_run_keeps_its_stages_and_skips_larger_scale_factors():
+    results = run_benchmark(
+        [600, 300],
+        ["local"],
+        isolate=False,
+        max_candidate_pairs=1,
+        output=FILENAME_BENCHMARK_RESULTS,
+    )
+    assert results["scale factor"].tolist() == [300, 300, 600]
+    assert results["stage"].iloc[0] == "load"
+    assert "RuntimeError" in results["error"].iloc[1]
+    assert results["error"].iloc[2].startswith("skipped")
+
+
+def test_isolated_benchmark_equals_in_process():
+    results = [
+        run_benchmark([400], ["local"], isolate=isolate, output="results.csv")
+        for isolate in [True, False]
+    ]
+    columns = ["stage", "pairs", "precision", "recall"]
+    pd.testing.assert_frame_equal(results[0][columns], results[1][columns])
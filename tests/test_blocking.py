@@ -0,0 +1,112 @@
+from itertools import product
+import pandas as pd
+import pytest
+from erp.matching import blocking
+
+
+def first_letter(record):
+    title = record["paper title"]
+    return title[0] if isinstance(title, str) else None
+
+
+def last_letter(record):
+    title = record["paper title"]
+    return title[-1] if isinstance(title, str) else None
+
+
+def num_authors(record):
+    return len(str(record["author names"]).split(", "))
+
+
+def authors(record):
+    # Missing author names are the author "nan", as in the replaced filters
+    return set(str(record["author names"]).split(", "))
+
+
+def last_names(record):
+    names = str(record["author names"]).split(", ")
+    return {name.split(" ")[-1] for name in names if len(name) > 0}
+
+
+def same_year(r1, r2):
+    return r1["year of publication"] == r2["year of publication"]
+
+
+def two_years(r1, r2):
+    return r2["year of publication"] - r1["year of publication"] in (0, 1)
+
+
+def same_first_letter(r1, r2):
+    return first_letter(r1) is not None and first_letter(r1) == first_letter(r2)
+
+
+def same_last_letter(r1, r2):
+    return last_letter(r1) is not None and last_letter(r1) == last_letter(r2)
+
+
+def same_first_or_last_letter(r1, r2):
+    return same_first_letter(r1, r2) or same_last_letter(r1, r2)
+
+
+def close_num_authors(r1, r2):
+    return abs(num_authors(r1) - num_authors(r2)) <= 1
+
+
+def common_authors(r1, r2):
+    return len(authors(r1) & authors(r2)) > 0
+
+
+def common_and_num_authors(r1, r2):
+    return common_authors(r1, r2) and abs(num_authors(r1) - num_authors(r2)) <= 2
+
+
+def common_last_name(r1, r2):
+    names1, names2 = last_names(r1), last_names(r2)
+    return len(names1 & names2) > 0 or (len(names1) == 0 and len(names2) == 0)
+
+
+# The filters of the blocking methods on the cartesian product they replace
+REFERENCE_FILTERS = {
+    "Year": same_year,
+    "TwoYear": two_years,
+    "FirstLetterTitle": same_first_letter,
+    "LastLetterTitle": same_last_letter,
+    "FirstOrLastLetterTitle": same_first_or_last_letter,
+    "numAuthors": close_num_authors,
+    "commonAuthors": common_authors,
+    "commonAndNumAuthors": common_and_num_authors,
+    "authorLastName": common_last_name,
+}
+# Reference methods dropping the pairs with a record without a title
+TITLE_FILTERS = set(REFERENCE_FILTERS) - {"commonAuthors", "authorLastName"}
+
+
+def reference_pairs(df1, df2, blocking_method):
+    pairs = []
+    for r1, r2 in product(df1.to_dict("records"), df2.to_dict("records")):
+        if blocking_method in TITLE_FILTERS and (
+            pd.isna(r1["paper title"]) or pd.isna(r2["paper title"])
+        ):
+            continue
+        if REFERENCE_FILTERS[blocking_method](r1, r2):
+            pairs.append((r1["index"], r2["index"]))
+    return pairs
+
+
+def pairs(result_df):
+    return list(zip(result_df["index_df1"].tolist(), result_df["index_df2"].tolist()))
+
+
+@pytest.mark.parametrize("blocking_method", sorted(REFERENCE_FILTERS))
+def test_blocking_equals_filtered_cartesian_product(
+    databases, features, blocking_method
+):
+    df1, df2 = databases
+    result_df = blocking(df1, df2, blocking_method, features)
+    assert pairs(result_df) == reference_pairs(df1, df2, blocking_method)
+
+
+def test_year_blocking_keeps_one_year_column(databases, features):
+    result_df = blocking(*databases, "Year", features)
+    assert "year of publication" in result_df
+    assert "year of publication_df1" not in result_df
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from erp.clustering import (
+    DisjointSet,
+    clustering,
+    clustering_basic,
+    clustering_union_find,
+)
+from erp.matching import blocking, matching
+
+
+def test_disjoint_set_representatives_are_the_largest_nodes():
+    disjoint_set = DisjointSet(6)
+    disjoint_set.union(0, 4)
+    disjoint_set.union(4, 2)
+    disjoint_set.union(5, 1)
+    disjoint_set.add(2)
+    disjoint_set.union(6, 0)
+    assert disjoint_set.representatives().tolist() == [6, 5, 6, 3, 6, 5, 6, 7]
+    assert disjoint_set.find(2) == disjoint_set.find(6)
+    assert disjoint_set.find(3) != disjoint_set.find(7)
+
+
+def matched_pairs(databases, features):
+    # Matches of the sample and chains of pairs joining several records
+    result_df = matching(
+        blocking(*databases, "FirstOrLastLetterTitle", features),
+        0.5,
+        "Combined",
+        features=features,
+    )
+    chains = pd.DataFrame(
+        {"index_df1": [0, 1, 1, 2, 2], "index_df2": [200, 200, 201, 201, 350]}
+    )
+    return pd.concat([result_df[["index_df1", "index_df2"]], chains])
+
+
+def test_union_find_equals_basic(databases, features):
+    df1, df2 = databases
+    result_df = matched_pairs(databases, features)
+    # clustering_basic selects the representatives by the DataFrame index
+    df2 = df2.set_index(df2["index"].to_numpy())
+    expected = clustering_basic(result_df, df1, df2)
+    combined_df = clustering_union_find(result_df, df1, df2)
+    pd.testing.assert_frame_equal(combined_df, expected)
+    assert len(combined_df) < len(df1) + len(df2)
+
+
+def test_clustering_keeps_a_record_per_component(databases, features):
+    df1, df2 = databases
+    result_df = matched_pairs(databases, features)
+    combined_df = clustering(result_df, df1, df2, "unionFind")
+    disjoint_set = DisjointSet(len(df1) + len(df2))
+    for idx1, idx2 in zip(result_df["index_df1"], result_df["index_df2"]):
+        disjoint_set.union(idx1, idx2)
+    roots = {disjoint_set.find(node) for node in range(len(df1) + len(df2))}
+    assert len(combined_df) == len(roots)
+    assert np.isin(combined_df["index"], disjoint_set.representatives()).all()
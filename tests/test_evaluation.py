@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from erp.evaluation import confusion_matrix, differences, pair_keys
+from erp.matching import calculate_confusion_matrix
+
+
+def reference_confusion_matrix(baseline_df, matched_df, columns):
+    # Confusion matrix of the pairs as sets of tuples
+    baseline = set(zip(*(baseline_df[column] for column in columns)))
+    matched = set(zip(*(matched_df[column] for column in columns)))
+    tp = len(baseline & matched)
+    fn, fp = len(baseline) - tp, len(matched) - tp
+    precision = tp / (tp + fp) if tp + fp else 0
+    recall = tp / (tp + fn) if tp + fn else 0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0
+    return tp, fn, fp, precision, recall, f1
+
+
+def random_pairs(rng, num_pairs, low, high):
+    return pd.DataFrame(
+        {
+            "index_df1": rng.integers(low, high, num_pairs),
+            "index_df2": rng.integers(low, high, num_pairs),
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "low, high",
+    [
+        (0, 50),
+        # First indexes of 2**31 and above do not fit in packed int64 keys
+        (2**31 - 20, 2**31 + 20),
+        (2**32 - 20, 2**32 + 20),
+        (2**62, 2**62 + 40),
+    ],
+)
+def test_confusion_matrix_equals_sets_of_pairs(low, high):
+    rng = np.random.default_rng(0)
+    baseline_df = random_pairs(rng, 300, low, high)
+    matched_df = pd.concat([baseline_df.iloc[:200], random_pairs(rng, 100, low, high)])
+    result = confusion_matrix(*pair_keys(baseline_df, matched_df))
+    expected = reference_confusion_matrix(
+        baseline_df, matched_df, ["index_df1", "index_df2"]
+    )
+    assert result == pytest.approx(expected)
+
+
+def test_same_pair_has_the_same_key():
+    large = 2**31 + 5
+    keys_df1, keys_df2 = pair_keys(
+        pd.DataFrame({"index_df1": [large, 1], "index_df2": [2, large]}),
+        pd.DataFrame({"index_df1": [1, large, 2], "index_df2": [large, 2, large]}),
+    )
+    assert keys_df1.tolist() == keys_df2[:2].tolist()[::-1]
+    assert len(set(keys_df1.tolist() + keys_df2.tolist())) == 3
+
+
+def test_paper_ids_are_used_without_index_columns():
+    baseline_df = pd.DataFrame(
+        {"paper ID_df1": ["a", "b", "c"], "paper ID_df2": ["x", "y", "z"]}
+    )
+    matched_df = pd.DataFrame(
+        {
+            "paper ID_df1": ["a", "c", "c"],
+            "paper ID_df2": ["x", "y", "z"],
+            "index_df1": [0, 2, 2],
+            "index_df2": [3, 4, 5],
+        }
+    )
+    result = calculate_confusion_matrix(baseline_df, matched_df)
+    assert result[:3] == (2, 1, 1)
+    # The inputs are not modified
+    assert list(baseline_df.columns) == ["paper ID_df1", "paper ID_df2"]
+
+
+def test_differences():
+    df1 = pd.DataFrame({"index_df1": [0, 1, 2], "index_df2": [5, 6, 7]})
+    df2 = pd.DataFrame({"index_df1": [1, 3], "index_df2": [6, 8]})
+    result = differences(df1, df2, *pair_keys(df1, df2))
+    assert result[["index_df1", "_merge"]].values.tolist() == [
+        [0, "left_only"],
+        [2, "left_only"],
+        [3, "right_only"],
+    ]
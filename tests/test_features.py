@@ -0,0 +1,102 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from erp.features import (
+    ARRAY_FEATURES,
+    SET_FEATURES,
+    FeatureStore,
+    concat_features,
+    features_filename,
+    load_features,
+)
+
+
+def record_sets(features, name):
+    # The set of strings of every record, independent of the vocabulary order
+    vocabulary, indptr = features.vocabulary(name), features.indptr(name)
+    indices = features.indices(name)
+    return [
+        set(vocabulary[indices[start:end]].tolist())
+        for start, end in zip(indptr[:-1], indptr[1:])
+    ]
+
+
+def assert_same_features(features, expected):
+    assert len(features) == len(expected)
+    assert features.index.tolist() == expected.index.tolist()
+    for name in SET_FEATURES:
+        assert record_sets(features, name) == record_sets(expected, name)
+    for name in ARRAY_FEATURES:
+        np.testing.assert_array_equal(features[name], expected[name])
+
+
+def test_title_tokens_are_the_title_words(databases):
+    df1, _ = databases
+    features = FeatureStore(df1)
+    expected = [
+        set(title.split()) if isinstance(title, str) else set()
+        for title in df1["paper title"]
+    ]
+    assert record_sets(features, "title_tokens") == expected
+    assert features.index.tolist() == df1["index"].tolist()
+
+
+def test_save_and_load(databases, tmp_path):
+    features = FeatureStore(databases[0])
+    features.save(tmp_path / "features.npz")
+    loaded = FeatureStore.load(tmp_path / "features.npz", databases[0])
+    assert_same_features(loaded, features)
+
+
+def test_take_equals_features_of_the_records(databases):
+    df1, _ = databases
+    positions = np.array([0, 3, 5, 42, 199])
+    features = FeatureStore(df1).take(positions)
+    assert_same_features(features, FeatureStore(df1.iloc[positions]))
+
+
+def test_append_and_concat_equal_features_of_all_records(databases):
+    df1, df2 = databases
+    expected = FeatureStore(pd.concat([df1, df2]))
+    assert_same_features(FeatureStore(df1).append(FeatureStore(df2)), expected)
+    assert_same_features(
+        concat_features([FeatureStore(df1), FeatureStore(df2)]), expected
+    )
+
+
+def test_concat_keeps_only_the_used_vocabulary(databases):
+    df1, _ = databases
+    features = concat_features([FeatureStore(df1).take([0, 1])])
+    assert len(features.vocabulary("title_tokens")) == len(
+        set(df1["paper title"][0].split()) | set(df1["paper title"][1].split())
+    )
+
+
+def test_positions(databases):
+    _, df2 = databases
+    features = FeatureStore(df2)
+    assert features.positions(df2["index"][[4, 2]]).tolist() == [4, 2]
+    features = features.take([5, 1, 3])
+    assert features.positions(df2["index"][[1, 3]]).tolist() == [1, 2]
+
+
+def test_load_features_caches_next_to_the_database(databases, tmp_path):
+    filename = str(tmp_path / "database.csv")
+    databases[0].to_csv(filename, index=False)
+    features = load_features(filename, databases[0])
+    assert os.path.exists(features_filename(filename))
+    assert_same_features(load_features(filename, databases[0]), features)
+
+
+def test_load_features_without_writable_cache(databases, tmp_path, monkeypatch, caplog):
+    def save(self, filename):
+        raise PermissionError(13, "Permission denied", filename)
+
+    monkeypatch.setattr(FeatureStore, "save", save)
+    filename = str(tmp_path / "database.csv")
+    databases[0].to_csv(filename, index=False)
+    with caplog.at_level(logging.WARNING):
+        features = load_features(filename, databases[0])
+    assert "not cached" in caplog.text
+    assert_same_features(features, FeatureStore(databases[0]))
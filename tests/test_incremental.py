@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+from erp.clustering import clustering_union_find
+from erp.incremental import INDEX_MERGE_FACTOR, IncrementalER
+from erp.matching import blocking, matching
+from erp.utils import DEFAULT_ER_CONFIGURATION
+
+CONFIGURATIONS = [
+    DEFAULT_ER_CONFIGURATION,
+    {**DEFAULT_ER_CONFIGURATION, "blocking_method": "commonAndNumAuthors"},
+    {**DEFAULT_ER_CONFIGURATION, "blocking_method": "Year", "threshold": 0.5},
+]
+
+
+def batch_matches(databases, configuration):
+    return matching(
+        blocking(*databases, configuration["blocking_method"]),
+        configuration["threshold"],
+        configuration["matching_method"],
+    )
+
+
+def paper_id_pairs(result_df):
+    return set(zip(result_df["paper ID_df1"], result_df["paper ID_df2"]))
+
+
+def state_paper_id_pairs(state):
+    # Matched pairs of the state as paper IDs, independent of the numbering
+    records = pd.concat([df for side in state.records for df in side])
+    paper_ids = dict(zip(records["index"], records["paper ID"]))
+    matches = state.matched_pairs()
+    return {
+        (paper_ids[idx1], paper_ids[idx2])
+        for idx1, idx2 in zip(matches["index_df1"], matches["index_df2"])
+    }
+
+
+def add_in_batches(state, databases, batch_size):
+    # Batches of both databases alternate, so that segments interleave
+    df1, df2 = (df.drop(columns="index") for df in databases)
+    for start in range(0, max(len(df1), len(df2)), batch_size):
+        for database, df in [(1, df1), (2, df2)]:
+            if start < len(df):
+                state.add_records(df.iloc[start : start + batch_size], database)
+
+
+@pytest.mark.parametrize("configuration", CONFIGURATIONS)
+def test_two_batches_equal_the_pipeline(databases, configuration):
+    state = IncrementalER(configuration)
+    state.add_records(databases[0].drop(columns="index"), 1)
+    result_df = state.add_records(databases[1].drop(columns="index"), 2)
+    expected = batch_matches(databases, configuration)
+    assert len(expected) > 0
+    assert paper_id_pairs(result_df) == paper_id_pairs(expected)
+    matches = state.matched_pairs()
+    assert matches["index_df1"].tolist() == expected["index_df1"].tolist()
+    assert matches["index_df2"].tolist() == expected["index_df2"].tolist()
+    pd.testing.assert_frame_equal(
+        state.clusters(),
+        clustering_union_find(expected, *databases),
+    )
+
+
+@pytest.mark.parametrize("configuration", CONFIGURATIONS)
+def test_interleaved_batches_equal_the_pipeline(databases, configuration):
+    state = IncrementalER(configuration)
+    add_in_batches(state, databases, 30)
+    assert len(state.records[0]) == len(state.records[1]) == 7
+    assert state_paper_id_pairs(state) == paper_id_pairs(
+        batch_matches(databases, configuration)
+    )
+
+
+def test_index_segments_stay_logarithmic(databases):
+    state = IncrementalER()
+    add_in_batches(state, databases, 10)
+    for side in range(2):
+        segments = state.indexes[side]
+        assert len(segments) <= np.log2(len(state.records[side])) + 1
+        # Every segment has more than INDEX_MERGE_FACTOR times the postings of the next
+        for segment, next_segment in zip(segments[:-1], segments[1:]):
+            assert len(segment.postings) > INDEX_MERGE_FACTOR * len(
+                next_segment.postings
+            )
+
+
+def test_batch_without_neighbours_returns_the_matches_columns(databases):
+    state = IncrementalER()
+    empty_df = state.add_records(databases[0].drop(columns="index"), 1)
+    result_df = state.add_records(databases[1].drop(columns="index"), 2)
+    assert len(empty_df) == 0
+    assert len(result_df) > 0
+    pd.testing.assert_series_equal(empty_df.dtypes, result_df.dtypes)
+
+
+def test_save_and_load_continue_like_the_state(databases, tmp_path):
+    df1, df2 = (df.drop(columns="index") for df in databases)
+    state = IncrementalER()
+    state.add_records(df1.iloc[:120], 1)
+    state.add_records(df2.iloc[:100], 2)
+    state.save(str(tmp_path / "state"))
+    loaded = IncrementalER.load(str(tmp_path / "state"))
+    for current in [state, loaded]:
+        current.add_records(df1.iloc[120:], 1)
+        current.add_records(df2.iloc[100:], 2)
+    pd.testing.assert_frame_equal(loaded.matched_pairs(), state.matched_pairs())
+    pd.testing.assert_frame_equal(
+        loaded.clusters().reset_index(drop=True),
+        state.clusters().reset_index(drop=True),
+    )
+
+
+def test_load_incomplete_state(databases, tmp_path):
+    state = IncrementalER()
+    state.add_records(databases[0].drop(columns="index"), 1)
+    state.save(str(tmp_path / "state"))
+    (tmp_path / "state" / "records_df1.npz").unlink()
+    with pytest.raises(FileNotFoundError):
+        IncrementalER.load(str(tmp_path / "state"))
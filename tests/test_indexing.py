@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import csr_matrix
+from erp.indexing import (
+    BlockIndex,
+    BlockKeys,
+    explode_keys,
+    merge_indexes,
+    similarity_join,
+)
+
+KEYS_INDEX = pd.Series([["a", "b"], ["b"], np.nan, ["c", "a"], [], ["b"]])
+KEYS_PROBE = pd.Series([["b"], ["a", "c"], ["d"], np.nan, ["a", "b", "c"]])
+
+
+def brute_force_pairs(keys_probe, keys_index):
+    # Pairs of records sharing a key, in the order of the cartesian product
+    sets_probe = [set(keys) if isinstance(keys, list) else set() for keys in keys_probe]
+    sets_index = [set(keys) if isinstance(keys, list) else set() for keys in keys_index]
+    pairs = [
+        (i, j)
+        for i, keys_i in enumerate(sets_probe)
+        for j, keys_j in enumerate(sets_index)
+        if keys_i & keys_j
+    ]
+    return [i for i, _ in pairs], [j for _, j in pairs]
+
+
+def test_explode_keys_drops_missing_keys():
+    keys = explode_keys(KEYS_INDEX)
+    assert keys.size == len(KEYS_INDEX)
+    assert keys.positions.tolist() == [0, 0, 1, 3, 3, 5]
+    assert keys.values.tolist() == ["a", "b", "b", "c", "a", "b"]
+
+
+def test_candidate_pairs_match_brute_force():
+    positions_probe, positions_index = BlockIndex(KEYS_INDEX).candidate_pairs(
+        KEYS_PROBE
+    )
+    expected_probe, expected_index = brute_force_pairs(KEYS_PROBE, KEYS_INDEX)
+    assert positions_probe.tolist() == expected_probe
+    assert positions_index.tolist() == expected_index
+
+
+def test_count_candidates_counts_every_shared_key():
+    counts = BlockIndex(KEYS_INDEX).count_candidates(KEYS_PROBE)
+    # Record 4 shares "a" with record 0 and "b" with records 0, 1 and 5, pairs
+    # are counted before deduplication
+    assert counts.tolist() == [3, 3, 0, 0, 6]
+
+
+@pytest.mark.parametrize("max_pairs", [1, 2, 4, 100])
+def test_candidate_pair_chunks_concatenate_to_candidate_pairs(max_pairs):
+    block_index = BlockIndex(KEYS_INDEX)
+    chunks = list(block_index.candidate_pair_chunks(KEYS_PROBE, max_pairs))
+    expected = block_index.candidate_pairs(KEYS_PROBE)
+    assert np.concatenate([chunk[0] for chunk in chunks]).tolist() == (
+        expected[0].tolist()
+    )
+    assert np.concatenate([chunk[1] for chunk in chunks]).tolist() == (
+        expected[1].tolist()
+    )
+    counts = block_index.count_candidates(KEYS_PROBE)
+    for positions_probe, _ in chunks:
+        records = np.unique(positions_probe)
+        assert len(records) <= 1 or counts[records].sum() <= max_pairs
+
+
+def test_scalar_keys():
+    keys_index = pd.Series([1995.0, 1996.0, np.nan, 1995.0])
+    keys_probe = pd.Series([1995.0, 2004.0, 1996.0])
+    positions_probe, positions_index = BlockIndex(keys_index).candidate_pairs(
+        keys_probe
+    )
+    assert list(zip(positions_probe.tolist(), positions_index.tolist())) == [
+        (0, 0),
+        (0, 3),
+        (2, 1),
+    ]
+
+
+def test_merge_indexes_equals_index_of_all_records():
+    keys = explode_keys(KEYS_INDEX)
+    split = np.searchsorted(keys.positions, 3)
+    segments = [
+        BlockIndex(BlockKeys(keys.size, keys.positions[:split], keys.values[:split])),
+        BlockIndex(BlockKeys(keys.size, keys.positions[split:], keys.values[split:])),
+    ]
+    merged = merge_indexes(segments)
+    expected = BlockIndex(KEYS_INDEX)
+    for positions, expected_positions in zip(
+        merged.candidate_pairs(KEYS_PROBE), expected.candidate_pairs(KEYS_PROBE)
+    ):
+        assert positions.tolist() == expected_positions.tolist()
+
+
+def test_save_and_load(tmp_path):
+    block_index = BlockIndex(KEYS_INDEX)
+    block_index.save(tmp_path / "index.npz")
+    loaded = BlockIndex.load(tmp_path / "index.npz")
+    assert loaded.size == block_index.size
+    assert loaded.block_sizes().tolist() == block_index.block_sizes().tolist()
+    for positions, expected_positions in zip(
+        loaded.candidate_pairs(KEYS_PROBE), block_index.candidate_pairs(KEYS_PROBE)
+    ):
+        assert positions.tolist() == expected_positions.tolist()
+
+
+@pytest.mark.parametrize("threshold", [0.0, 0.2, 0.5, 0.8, 1.0])
+def test_similarity_join_keeps_every_similar_pair(threshold):
+    rng = np.random.default_rng(0)
+    matrix = csr_matrix(rng.random((120, 30)) < 0.15, dtype=np.int32)
+    num_df1 = 50
+    positions_df1, positions_df2 = similarity_join(matrix, num_df1, threshold)
+    candidates = set(zip(positions_df1.tolist(), positions_df2.tolist()))
+    assert len(candidates) == len(positions_df1)
+
+    sets = [
+        set(matrix.indices[start:end])
+        for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:])
+    ]
+    # Pairs are matched above the threshold
+    for i in range(num_df1):
+        for j in range(matrix.shape[0] - num_df1):
+            set1, set2 = sets[i], sets[num_df1 + j]
+            union = len(set1 | set2)
+            if union and len(set1 & set2) / union > threshold:
+                assert (i, j) in candidates
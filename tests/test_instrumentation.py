@@ -0,0 +1,156 @@
+import json
+import numpy as np
+import pytest
+from erp import instrumentation
+from erp.instrumentation import (
+    Instrumentation,
+    block_size_summary,
+    export_metrics,
+    instrumented,
+    peak_rss,
+    prometheus_text,
+    set_instrumentation,
+)
+from erp.main import ER_pipeline_local
+from erp.utils import DEFAULT_ER_CONFIGURATION, RESULTS_FOLDER
+
+
+@pytest.fixture
+def metrics():
+    # Pipeline stages record to a new Instrumentation during the test
+    current = Instrumentation()
+    previous = set_instrumentation(current)
+    yield current
+    set_instrumentation(previous)
+
+
+def test_stage_records_counts_and_rates():
+    metrics = Instrumentation()
+    with metrics.run(pipeline="test") as records:
+        with metrics.stage("block", method="Year") as record:
+            record["rows"] = 1000
+            record["candidate_pairs"] = 10
+    assert records == list(metrics.records)
+    (record,) = records
+    assert record["stage"] == "block"
+    assert record["labels"] == {"pipeline": "test", "method": "Year"}
+    assert record["run"] is not None
+    assert record["rows_per_second"] == pytest.approx(1000 / record["wall_seconds"])
+    assert record["cpu_seconds"] >= 0
+    assert record["peak_traced_bytes"] is None
+
+
+def test_failed_stage_is_recorded():
+    metrics = Instrumentation(trace_memory=True)
+    with pytest.raises(ValueError):
+        with metrics.stage("match"):
+            np.ones(1 << 16)
+            raise ValueError("no pairs")
+    (record,) = metrics.records
+    assert record["error"] == "ValueError('no pairs')"
+    assert record["rows_per_second"] is None
+    assert record["peak_traced_bytes"] >= 8 << 16
+
+
+def test_hooks_wrap_their_stages():
+    calls = []
+
+    class Hook:
+        def __init__(self, name, labels):
+            self.name = name
+
+        def __enter__(self):
+            calls.append(("enter", self.name))
+
+        def __exit__(self, *exc_info):
+            calls.append(("exit", self.name))
+
+    metrics = Instrumentation()
+    metrics.attach(Hook, stages=["match"])
+    for name in ["block", "match"]:
+        with metrics.stage(name):
+            pass
+    assert calls == [("enter", "match"), ("exit", "match")]
+
+
+def test_instrumented_functions_record_to_the_current_instrumentation(metrics):
+    @instrumented("cluster")
+    def cluster(value):
+        return value + 1
+
+    assert cluster(1) == 2
+    assert [record["stage"] for record in metrics.records] == ["cluster"]
+
+
+def test_export_metrics_appends_json_lines_and_writes_prometheus():
+    metrics = Instrumentation()
+    for rows in [10, 20]:
+        with metrics.stage("block", pipeline="local") as record:
+            record["rows"] = np.int64(rows)
+            record["block_sizes"] = block_size_summary([1, 2, 3, 10])
+        export_metrics([record], "metrics.jsonl", "metrics.prom")
+    lines = open(RESULTS_FOLDER + "metrics.jsonl").read().splitlines()
+    assert [json.loads(line)["rows"] for line in lines] == [10, 20]
+    text = open(RESULTS_FOLDER + "metrics.prom").read()
+    assert text == prometheus_text(metrics.records)
+    # Only the last record of the same stage and labels is exported
+    assert 'erp_stage_rows{stage="block",pipeline="local"} 20\n' in text
+    assert (
+        'erp_stage_block_size{stage="block",pipeline="local",quantile="0.5"} 2.5'
+        in text
+    )
+    assert 'erp_stage_block_size_count{stage="block",pipeline="local"} 4\n' in text
+    assert "erp_stage_candidate_pairs{" not in text
+
+
+def test_prometheus_labels_are_escaped():
+    metrics = Instrumentation()
+    with metrics.stage("load", path='a "b"\\c'):
+        pass
+    assert 'path="a \\"b\\"\\\\c"' in prometheus_text(metrics.records)
+
+
+def test_block_size_summary():
+    summary = block_size_summary(np.arange(1, 101))
+    assert summary["count"] == 100 and summary["sum"] == 5050
+    assert (summary["min"], summary["max"]) == (1, 100)
+    assert summary["p50"] == pytest.approx(50.5)
+    assert block_size_summary([]) == {"count": 0, "sum": 0}
+
+
+def test_peak_rss_without_resource(monkeypatch):
+    assert peak_rss() > 0
+    monkeypatch.setattr(instrumentation, "resource", None)
+    assert peak_rss() is None
+    metrics = Instrumentation()
+    with metrics.stage("load"):
+        pass
+    assert metrics.records[0]["peak_rss_bytes"] is None
+
+
+@pytest.mark.parametrize(
+    "memory_budget, stages",
+    [
+        (1 << 20, ["load", "block+match", "cluster"]),
+        (None, ["load", "block", "match", "cluster"]),
+    ],
+)
+def test_pipeline_stages(databases, metrics, memory_budget, stages):
+    filenames = []
+    for i, df in enumerate(databases):
+        filenames.append(f"database{i}.csv")
+        df.drop(columns="index").to_csv(filenames[-1], index=False)
+    configuration = {**DEFAULT_ER_CONFIGURATION, "memory_budget": memory_budget}
+    ER_pipeline_local(*filenames, configuration)
+    records = list(metrics.records)
+    assert [record["stage"] for record in records] == stages
+    assert records[0]["rows"] == 400
+    candidate_pairs = records[1]["candidate_pairs"]
+    assert candidate_pairs > 0
+    matched_pairs = records[-2]["matched_pairs"]
+    assert 0 < matched_pairs <= candidate_pairs
+    assert records[-1]["rows"] == matched_pairs
+    if memory_budget is not None:
+        assert records[1]["block_sizes"]["count"] > 0
+    lines = open(RESULTS_FOLDER + "pipeline_metrics.jsonl").read().splitlines()
+    assert [json.loads(line)["stage"] for line in lines] == stages
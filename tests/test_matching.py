@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+import pytest
+from erp.matching import (
+    BLOCKING_METHODS,
+    BYTES_PER_CANDIDATE_PAIR,
+    CandidatePairs,
+    blocking,
+    calculate_baseline,
+    calculate_combined_similarity,
+    calculate_combined_similarity_batch,
+    calculate_jaccard_similarity,
+    calculate_jaccard_similarity_batch,
+    matching,
+    parallel_matching,
+    run_all_blocking_matching_methods,
+)
+from erp.utils import create_cartesian_product
+
+
+@pytest.fixture
+def candidate_pairs(databases, features):
+    # Pairs of records with a title, about a tenth of the cartesian product
+    return blocking(*databases, "FirstOrLastLetterTitle", features)
+
+
+def test_jaccard_batch_equals_row_wise(candidate_pairs, features):
+    similarity = calculate_jaccard_similarity_batch(
+        *features,
+        features[0].positions(candidate_pairs["index_df1"]),
+        features[1].positions(candidate_pairs["index_df2"]),
+    )
+    expected = candidate_pairs.apply(calculate_jaccard_similarity, axis=1)
+    np.testing.assert_allclose(similarity, expected.to_numpy())
+
+
+def test_combined_batch_equals_row_wise(candidate_pairs, features):
+    # The sample has records without authors, scored on their titles only
+    assert candidate_pairs["author names_df1"].isna().any()
+    similarity = calculate_combined_similarity_batch(
+        *features,
+        features[0].positions(candidate_pairs["index_df1"]),
+        features[1].positions(candidate_pairs["index_df2"]),
+    )
+    expected = candidate_pairs.apply(calculate_combined_similarity, axis=1)
+    np.testing.assert_allclose(similarity, expected.to_numpy())
+
+
+@pytest.mark.parametrize("matching_method", ["Jaccard", "Combined"])
+def test_matching_with_and_without_features(candidate_pairs, features, matching_method):
+    # Without the feature stores the features are extracted from the pairs
+    result_df = matching(candidate_pairs, 0.5, matching_method, features=features)
+    expected = matching(candidate_pairs, 0.5, matching_method)
+    assert len(result_df) > 0
+    assert result_df["index_df1"].tolist() == expected["index_df1"].tolist()
+    assert result_df["index_df2"].tolist() == expected["index_df2"].tolist()
+    np.testing.assert_allclose(
+        result_df["similarity_score"], expected["similarity_score"]
+    )
+
+
+@pytest.mark.parametrize(
+    "matching_method, threshold",
+    [
+        ("Jaccard", 0.2),
+        ("Jaccard", 0.5),
+        ("Combined", 0.5),
+        ("Combined", 0.7),
+        # Below 0.3 pairs without a common title word can match on their authors
+        ("Combined", 0.1),
+        ("Combined", 0.25),
+    ],
+)
+def test_baseline_equals_matching_of_cartesian_product(
+    databases, features, matching_method, threshold
+):
+    baseline_df = calculate_baseline(
+        *databases, {"method": matching_method, "threshold": threshold}, features
+    )
+    expected = matching(
+        create_cartesian_product(*databases),
+        threshold,
+        matching_method,
+        features=features,
+    )
+    assert len(baseline_df) > 0
+    assert baseline_df["index_df1"].tolist() == expected["index_df1"].tolist()
+    assert baseline_df["index_df2"].tolist() == expected["index_df2"].tolist()
+
+
+@pytest.mark.parametrize("blocking_method", sorted(BLOCKING_METHODS))
+def test_candidate_pair_chunks_equal_blocking(databases, features, blocking_method):
+    # A budget of 50 pairs splits the candidate pairs in many chunks
+    candidate_pairs = blocking(
+        *databases, blocking_method, features, 50 * BYTES_PER_CANDIDATE_PAIR
+    )
+    assert isinstance(candidate_pairs, CandidatePairs)
+    chunks = list(candidate_pairs)
+    expected = blocking(*databases, blocking_method, features)
+    assert len(chunks) > 1
+    # A record with more candidate pairs than the budget is a chunk of its own
+    assert all(
+        len(positions_df1) <= 50 or len(np.unique(positions_df1)) == 1
+        for positions_df1, _ in chunks
+    )
+    result_df = pd.concat(
+        [candidate_pairs.frame(*chunk) for chunk in chunks], ignore_index=True
+    )
+    pd.testing.assert_frame_equal(result_df, expected.reset_index(drop=True))
+    assert len(candidate_pairs) == len(expected)
+    assert candidate_pairs.max_num_pairs() >= len(expected)
+
+
+@pytest.mark.parametrize("matching_method", ["Jaccard", "Combined"])
+@pytest.mark.parametrize("blocking_method", ["FirstLetterTitle", "commonAuthors"])
+def test_matching_of_candidate_pairs_equals_matching(
+    databases, features, blocking_method, matching_method
+):
+    result_df = matching(
+        blocking(*databases, blocking_method, features, 50 * BYTES_PER_CANDIDATE_PAIR),
+        0.5,
+        matching_method,
+        features=features,
+    )
+    expected = matching(
+        blocking(*databases, blocking_method, features),
+        0.5,
+        matching_method,
+        features=features,
+    )
+    assert len(result_df) > 0
+    pd.testing.assert_frame_equal(result_df, expected.reset_index(drop=True))
+
+
+@pytest.mark.parametrize(
+    "blocking_method, memory_budget",
+    [
+        ("FirstLetterTitle", None),
+        ("commonAndNumAuthors", None),
+        ("authorLastName", 1 << 20),
+        ("Year", 1 << 20),
+    ],
+)
+def test_parallel_matching_equals_matching(
+    databases, features, blocking_method, memory_budget
+):
+    result_df = parallel_matching(
+        *databases,
+        blocking_method,
+        0.5,
+        "Combined",
+        features=features,
+        num_workers=2,
+        memory_budget=memory_budget,
+    )
+    expected = matching(
+        blocking(*databases, blocking_method, features),
+        0.5,
+        "Combined",
+        features=features,
+    ).reset_index(drop=True)
+    assert len(result_df) > 0
+    pd.testing.assert_frame_equal(result_df, expected)
+
+
+def test_sweep_equals_running_every_threshold(databases, features):
+    arguments = (*databases, [0.2, 0.5, 0.7], ["Jaccard", "Combined"])
+    blocking_methods = ["Year", "commonAuthors"]
+    results = run_all_blocking_matching_methods(
+        *arguments, blocking_methods, save=False, features=features, sweep=True
+    )
+    expected = run_all_blocking_matching_methods(
+        *arguments, blocking_methods, save=False, features=features
+    )
+    columns = [
+        "Blocking method",
+        "Matching Method",
+        "Similarity Threshold",
+        "Pairs In Baseline",
+        "Pairs In Blocking",
+        "TP",
+        "FN",
+        "FP",
+    ]
+    assert len(results) == len(expected) == 12
+    for row, expected_row in zip(results, expected):
+        assert {column: row[column] for column in columns} == {
+            column: expected_row[column] for column in columns
+        }
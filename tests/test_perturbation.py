@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+from erp.perturbation import (
+    database_variants,
+    decode_column,
+    encode_column,
+    join_tokens,
+    perturb_database,
+    replicate_database,
+    split_tokens,
+)
+from erp.utils import DATABSE_COLUMNS
+
+TITLE, AUTHORS, YEAR = DATABSE_COLUMNS[1], DATABSE_COLUMNS[2], DATABSE_COLUMNS[4]
+
+
+def test_encode_and_decode_round_trip():
+    values = pd.Series(["a study", np.nan, "", "müller, ann lee"])
+    column = encode_column(values)
+    assert column.missing.tolist() == [False, True, False, False]
+    pd.testing.assert_series_equal(pd.Series(decode_column(column)), values)
+
+
+def test_split_and_join_tokens_round_trip():
+    column = encode_column(["ann lee, bob ray", np.nan, "cy tan", "a, b, c"])
+    starts, ends, counts = split_tokens(column, b", ")
+    assert counts.tolist() == [2, 0, 1, 3]
+    joined = join_tokens(
+        column.data, starts, ends, np.arange(len(starts)), counts, b", "
+    )
+    assert decode_column(joined)[[0, 2, 3]].tolist() == [
+        "ann lee, bob ray",
+        "cy tan",
+        "a, b, c",
+    ]
+    assert joined.missing.tolist() == [False, True, False, False]
+
+
+def test_no_changes_keep_the_database(databases):
+    df = databases[0]
+    pd.testing.assert_frame_equal(perturb_database(df, 0), df)
+
+
+def test_same_seed_gives_the_same_database(databases):
+    df = databases[0]
+    changes = dict(title_typos=2, author_swap_rate=0.3, year_shift=1)
+    pd.testing.assert_frame_equal(
+        perturb_database(df, 5, **changes), perturb_database(df, 5, **changes)
+    )
+    assert not perturb_database(df, 5, **changes).equals(
+        perturb_database(df, 6, **changes)
+    )
+
+
+def test_typos_replace_characters(databases):
+    df = databases[0]
+    result = perturb_database(df, 0, title_typos=2)
+    assert result[TITLE].isna().tolist() == df[TITLE].isna().tolist()
+    for original, perturbed in zip(df[TITLE].dropna(), result[TITLE].dropna()):
+        assert len(original) == len(perturbed)
+        assert sum(a != b for a, b in zip(original, perturbed)) <= 2
+    assert not result[TITLE].equals(df[TITLE])
+    pd.testing.assert_series_equal(result[AUTHORS], df[AUTHORS])
+
+
+@pytest.mark.parametrize("rate", [0.5, 1.0])
+def test_dropped_tokens_keep_a_word_in_order(databases, rate):
+    df = databases[0]
+    result = perturb_database(df, 0, token_drop_rate=rate)
+    for original, perturbed in zip(df[TITLE].dropna(), result[TITLE].dropna()):
+        words = iter(original.split(" "))
+        kept = perturbed.split(" ")
+        # The kept words are a subsequence of the title
+        assert all(word in words for word in kept)
+        assert len(kept) == 1 if rate == 1.0 else len(kept) >= 1
+
+
+def test_swapped_authors_come_from_the_column(databases):
+    df = databases[0]
+    result = perturb_database(df, 0, author_swap_rate=0.5)
+    authors = set(", ".join(df[AUTHORS].dropna()).split(", "))
+    assert result[AUTHORS].isna().tolist() == df[AUTHORS].isna().tolist()
+    for original, perturbed in zip(df[AUTHORS].dropna(), result[AUTHORS].dropna()):
+        assert len(perturbed.split(", ")) == len(original.split(", "))
+        assert set(perturbed.split(", ")) <= authors
+    assert not result[AUTHORS].equals(df[AUTHORS])
+
+
+def test_years_are_shifted_within_bounds(databases):
+    df = databases[0]
+    shift = perturb_database(df, 0, year_shift=2)[YEAR] - df[YEAR]
+    assert shift.abs().max() == 2
+    assert shift.min() >= -2
+
+
+def test_variant_does_not_depend_on_the_variants_before(databases):
+    df = databases[0]
+    change = dict(title_typos=1, year_shift=1)
+    variants = list(database_variants(df, [{}, change], seed=3))
+    other_variants = list(database_variants(df, [dict(author_typos=4), change], 3))
+    pd.testing.assert_frame_equal(variants[1], other_variants[1])
+    pd.testing.assert_frame_equal(variants[0], df)
+
+
+def test_replicated_paper_ids_stay_unique(databases):
+    df = databases[0]
+    result = replicate_database(df, 3, seed=1, title_typos=1)
+    assert len(result) == 3 * len(df)
+    assert result[DATABSE_COLUMNS[0]].is_unique
+    pd.testing.assert_frame_equal(result.iloc[: len(df)], df.astype(result.dtypes))
+    assert result[DATABSE_COLUMNS[0]].iloc[-1] == f"{df[DATABSE_COLUMNS[0]].iloc[-1]}_2"
@@ -0,0 +1,68 @@
+import os
+import pandas as pd
+import pytest
+from erp.preparing import prepare_data, prepare_data_parallel, split_file
+from erp.utils import database_cache_filename, read_database
+
+ENTRIES = [
+    ["#*A Study of Joins!", "#@Ann Lee, Bob Ray", "#t2001", "#cVLDB", "#index1"],
+    ["#*Too Old", "#@Ann Lee", "#t1990", "#cVLDB", "#index2"],
+    ["#*Other Venue", "#@Bob Ray", "#t1999", "#cICDE", "#index3"],
+    ["#*Duplicate ID", "#@Cy Tan", "#t2000", "#cSIGMOD Record", "#index1"],
+    ["#*No_Authors", "#t2004", "#cSIGMOD Conference", "#index4"],
+    ["#*No Year", "#@Cy Tan", "#cVLDB", "#index5"],
+]
+
+
+def write_entries(filename, entries):
+    with open(filename, "w") as f:
+        f.write("\n\n".join("\n".join(entry) for entry in entries) + "\n")
+
+
+def test_prepare_data_cleans_and_filters_entries(tmp_path):
+    filename = str(tmp_path / "citations.txt")
+    write_entries(filename, ENTRIES)
+    prepare_data(filename, chunk_size=1)
+    df = pd.read_csv(
+        tmp_path / "citations_1995_2004.csv", dtype=str, keep_default_na=False
+    )
+    assert df.values.tolist() == [
+        ["1", "a study of joins", "ann lee, bob ray", "vldb", "2001"],
+        ["4", "noauthors", "", "sigmod conference", "2004"],
+    ]
+
+
+@pytest.mark.parametrize("range_size", [1, 40, 1 << 20])
+def test_prepare_data_parallel_equals_prepare_data(tmp_path, range_size):
+    # Every file holds the entries in another order, to check the merge order
+    filenames = []
+    for i in range(2):
+        filename = str(tmp_path / f"citations{i}.txt")
+        write_entries(filename, ENTRIES[i:] + ENTRIES[:i])
+        filenames.append(filename)
+    prepare_data_parallel(filenames, max_workers=2, range_size=range_size)
+    outputs = [open(filename[:-4] + "_1995_2004.csv").read() for filename in filenames]
+    for filename, output in zip(filenames, outputs):
+        prepare_data(filename)
+        assert open(filename[:-4] + "_1995_2004.csv").read() == output
+
+
+def test_split_file_starts_ranges_after_blank_lines(tmp_path):
+    filename = str(tmp_path / "citations.txt")
+    write_entries(filename, ENTRIES)
+    data = open(filename, "rb").read()
+    ranges = split_file(filename, 30)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+        assert end == start and data[start - 2 : start] == b"\n\n"
+
+
+def test_cache_is_written_by_the_first_read(tmp_path):
+    filename = str(tmp_path / "citations.txt")
+    write_entries(filename, ENTRIES)
+    prepare_data(filename)
+    output = filename[:-4] + "_1995_2004.csv"
+    assert not os.path.exists(database_cache_filename(output))
+    df = read_database(output)
+    assert os.path.exists(database_cache_filename(output))
+    assert df["paper ID"].tolist() == [1, 4]
@@ -0,0 +1,61 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from erp import utils
+from erp.utils import (
+    database_cache_filename,
+    load_database_cache,
+    read_database,
+    save_database_cache,
+)
+
+
+@pytest.fixture
+def database_file(databases, tmp_path):
+    filename = str(tmp_path / "database.csv")
+    databases[0].drop(columns="index").to_csv(filename, index=False)
+    return filename
+
+
+def test_cache_round_trip(database_file):
+    df = pd.read_csv(database_file, sep=",", engine="python")
+    save_database_cache(database_file, df)
+    pd.testing.assert_frame_equal(
+        load_database_cache(database_cache_filename(database_file)), df
+    )
+
+
+def test_read_database_writes_and_reads_the_cache(database_file):
+    df = read_database(database_file)
+    assert os.path.exists(database_cache_filename(database_file))
+    pd.testing.assert_frame_equal(read_database(database_file), df)
+
+
+def test_read_database_without_writable_cache(database_file, monkeypatch, caplog):
+    def save_database_cache(filename, df=None, strict=False):
+        raise PermissionError(13, "Permission denied", filename)
+
+    monkeypatch.setattr(utils, "save_database_cache", save_database_cache)
+    with caplog.at_level(logging.WARNING):
+        df = read_database(database_file)
+    assert "not cached" in caplog.text
+    assert not os.path.exists(database_cache_filename(database_file))
+    assert len(df) == 200
+
+
+def test_mixed_column_is_not_cached(database_file, caplog):
+    df = pd.DataFrame({"paper ID": ["a", 1], "year of publication": [2000, 2001]})
+    with caplog.at_level(logging.WARNING):
+        save_database_cache(database_file, df)
+    assert not os.path.exists(database_cache_filename(database_file))
+    with pytest.raises(ValueError):
+        save_database_cache(database_file, df, strict=True)
+
+
+def test_text_columns_keep_missing_values(database_file):
+    df = pd.DataFrame({"author names": ["ann lee", np.nan, "ann lee"]})
+    save_database_cache(database_file, df)
+    loaded = load_database_cache(database_cache_filename(database_file))
+    assert loaded["author names"].isna().tolist() == [False, True, False]